@@ -0,0 +1,509 @@
+# fake_docker serves the parts of the Docker Engine API dpanel uses on a unix socket,
+# backed by in-memory containers and images, with a fixed latency added to every call
+# bench.server runs it on a thread of its own process; `python -m bench.fake_docker` runs it
+# in a process of its own, publishing to a real redis like the go publisher with --redis-url
+
+import argparse
+import asyncio
+import ctypes
+import datetime
+import json
+import os
+import random
+import struct
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List
+from aiohttp import web
+
+VERSION = r"/{version:(v[0-9.]+/)?}"
+
+
+class DaemonError(Exception):
+    # turned into an error response by the middleware
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def error(status: int, message: str) -> web.Response:
+    # aiodocker only parses the message out of an exact application/json content type
+    return web.Response(
+        body=json.dumps({"message": message}).encode(),
+        status=status,
+        headers={"Content-Type": "application/json"},
+    )
+
+
+class FakeDaemon:
+    def __init__(
+        self,
+        containers: int = 100,
+        images: int = 20,
+        latency: float = 0.0,
+        clock_offset: float = 0.0,
+    ):
+        self.latency = latency
+        # seconds the daemon's clock is ahead of this machine's, like a remote host's
+        self.clock_offset = clock_offset
+        # recent events, replayed to streams opened with ?since=
+        self.recent: Deque[dict] = deque(maxlen=1000)
+        self.images: Dict[str, dict] = {}
+        for i in range(images):
+            id = f"sha256:{i:064x}"
+            self.images[id] = {
+                "Id": id,
+                "RepoTags": [f"bench/image-{i}:latest"],
+                "Created": 1700000000 + i,
+                "Size": 10_000_000 + i,
+                "Labels": {},
+            }
+        image_ids = list(self.images) or ["sha256:" + "0" * 64]
+        # a volume and a network per compose project, and two nobody uses
+        self.volumes: Dict[str, dict] = {}
+        self.networks: Dict[str, dict] = {}
+        for name in [f"project-{i}" for i in range(10)] + ["unused"]:
+            self.volumes[f"{name}_data"] = {
+                "Name": f"{name}_data",
+                "Driver": "local",
+                "Mountpoint": f"/var/lib/docker/volumes/{name}_data/_data",
+                "CreatedAt": "2024-01-01T00:00:00Z",
+                "Labels": {},
+                "Scope": "local",
+            }
+            id = os.urandom(32).hex()
+            self.networks[id] = {
+                "Id": id,
+                "Name": f"{name}_default",
+                "Driver": "bridge",
+                "Scope": "local",
+                "Internal": False,
+                "Created": "2024-01-01T00:00:00Z",
+            }
+        self.containers: Dict[str, dict] = {}
+        for i in range(containers):
+            self.add_container(
+                f"bench-{i}",
+                image_ids[i % len(image_ids)],
+                "running" if i % 4 else "exited",
+                {"com.docker.compose.project": f"project-{i % 10}"},
+            )
+        # queues of the connected /events streams
+        self.listeners: List[asyncio.Queue] = []
+        # request count per path, for checking how many daemon calls a scenario made
+        self.calls: Dict[str, int] = {}
+        # query parameters of every image pull
+        self.pulls: List[dict] = []
+
+    def add_container(self, name: str, image: str, state: str, labels: dict) -> dict:
+        id = os.urandom(32).hex()
+        tags = self.images.get(image, {}).get("RepoTags") or [image]
+        project = labels.get("com.docker.compose.project")
+        volume = f"{project}_data"
+        network = next(
+            (n for n in self.networks.values() if n["Name"] == f"{project}_default"),
+            None,
+        )
+        container = {
+            "Id": id,
+            "Names": [f"/{name}"],
+            "Image": tags[0],
+            "ImageID": image,
+            "State": state,
+            "Status": "Up 1 hour" if state == "running" else "Exited (0) 1 hour ago",
+            "Ports": [],
+            "Labels": labels,
+            "Mounts": (
+                [{"Type": "volume", "Name": volume, "Destination": "/data"}]
+                if volume in self.volumes
+                else []
+            ),
+            "NetworkSettings": {
+                "Networks": (
+                    {network["Name"]: {"NetworkID": network["Id"]}} if network else {}
+                )
+            },
+            "Created": int(time.time()),
+        }
+        self.containers[id] = container
+        return container
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.middleware])
+        routes = app.router
+        routes.add_get(VERSION + "version", self.version)
+        routes.add_get(VERSION + "info", self.info)
+        routes.add_get(VERSION + "_ping", self.ping)
+        routes.add_get(VERSION + "containers/json", self.list_containers)
+        routes.add_post(VERSION + "containers/create", self.create_container)
+        routes.add_get(VERSION + "containers/{id}/json", self.inspect_container)
+        routes.add_get(VERSION + "containers/{id}/logs", self.logs)
+        routes.add_get(VERSION + "containers/{id}/stats", self.stats)
+        routes.add_post(VERSION + "containers/{id}/{action}", self.container_action)
+        routes.add_delete(VERSION + "containers/{id}", self.delete_container)
+        routes.add_get(VERSION + "images/json", self.list_images)
+        routes.add_post(VERSION + "images/create", self.pull)
+        routes.add_delete(VERSION + "images/{name:.+}", self.delete_image)
+        routes.add_get(VERSION + "events", self.events)
+        routes.add_post(VERSION + "{kind}/prune", self.prune)
+        routes.add_get(VERSION + "system/df", self.system_df)
+        routes.add_get(VERSION + "networks", self.list_networks)
+        routes.add_delete(VERSION + "networks/{id}", self.delete_network)
+        routes.add_get(VERSION + "volumes", self.list_volumes)
+        routes.add_delete(VERSION + "volumes/{name}", self.delete_volume)
+        return app
+
+    @web.middleware
+    async def middleware(self, req: web.Request, handler):
+        self.calls[req.path] = self.calls.get(req.path, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        try:
+            return await handler(req)
+        except DaemonError as e:
+            return error(e.status, e.message)
+
+    def find(self, id: str) -> dict:
+        for container in self.containers.values():
+            if container["Id"].startswith(id) or f"/{id}" in container["Names"]:
+                return container
+        raise DaemonError(404, f"No such container: {id}")
+
+    def now_ns(self) -> int:
+        return time.time_ns() + int(self.clock_offset * 10**9)
+
+    def emit(self, type: str, action: str, id: str, attributes: dict):
+        now = self.now_ns()
+        event = {
+            "Type": type,
+            "Action": action,
+            "status": action,
+            "id": id,
+            "Actor": {"ID": id, "Attributes": attributes},
+            "time": now // 10**9,
+            "timeNano": now,
+        }
+        self.recent.append(event)
+        for listener in self.listeners:
+            listener.put_nowait(event)
+
+    async def version(self, req: web.Request):
+        return web.json_response({"ApiVersion": "1.44", "Version": "bench"})
+
+    async def info(self, req: web.Request):
+        now = self.now_ns()
+        utc = datetime.datetime.utcfromtimestamp(now // 10**9)
+        system_time = f"{utc:%Y-%m-%dT%H:%M:%S}.{now % 10**9:09d}Z"
+        return web.json_response({"SystemTime": system_time, "Name": "bench"})
+
+    async def ping(self, req: web.Request):
+        return web.Response(text="OK")
+
+    async def list_containers(self, req: web.Request):
+        return web.json_response(list(self.containers.values()))
+
+    async def inspect_container(self, req: web.Request):
+        container = self.find(req.match_info["id"])
+        state = container["State"]
+        return web.json_response(
+            {
+                "Id": container["Id"],
+                "Name": container["Names"][0],
+                "Image": container["ImageID"],
+                "Config": {
+                    "Image": container["Image"],
+                    "Labels": container["Labels"],
+                    "Env": ["PATH=/usr/bin"],
+                    "Tty": False,
+                },
+                "State": {
+                    "Status": state,
+                    "Running": state in ("running", "paused", "restarting"),
+                    "Paused": state == "paused",
+                },
+                "HostConfig": {},
+                "NetworkSettings": {"Ports": {}},
+            }
+        )
+
+    def has_image(self, reference: str) -> bool:
+        # an id, or a name that is name:latest without a tag
+        if "@" not in reference and ":" not in reference.rpartition("/")[2]:
+            reference += ":latest"
+        return any(
+            id == reference or reference in image["RepoTags"]
+            for id, image in self.images.items()
+        )
+
+    async def create_container(self, req: web.Request):
+        body = await req.json()
+        if not self.has_image(body.get("Image", "")):
+            return error(404, f"No such image: {body.get('Image')}")
+        name = req.query.get("name") or f"created-{len(self.containers)}"
+        container = self.add_container(
+            name, body.get("Image", ""), "created", body.get("Labels") or {}
+        )
+        self.emit("container", "create", container["Id"], {"name": name})
+        return web.json_response({"Id": container["Id"], "Warnings": []}, status=201)
+
+    async def container_action(self, req: web.Request):
+        container = self.find(req.match_info["id"])
+        action = req.match_info["action"]
+        states = {
+            "start": "running",
+            "stop": "exited",
+            "kill": "exited",
+            "restart": "running",
+            "pause": "paused",
+            "unpause": "running",
+        }
+        container["State"] = states.get(action, container["State"])
+        name = container["Names"][0][1:]
+        self.emit("container", action, container["Id"], {"name": name})
+        return web.Response(status=204)
+
+    async def delete_container(self, req: web.Request):
+        container = self.find(req.match_info["id"])
+        del self.containers[container["Id"]]
+        self.emit("container", "destroy", container["Id"], {})
+        return web.Response(status=204)
+
+    async def logs(self, req: web.Request):
+        # multiplexed stdout frames, one line per 10ms while following
+        container = self.find(req.match_info["id"])
+        response = web.StreamResponse()
+        await response.prepare(req)
+
+        def frame(i: int) -> bytes:
+            now = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            data = f"{now} {container['Names'][0][1:]} line {i}\n".encode()
+            return struct.pack(">BxxxL", 1, len(data)) + data
+
+        tail = req.query.get("tail", "100")
+        lines = 100 if tail == "all" else int(tail)
+        for i in range(lines):
+            await response.write(frame(i))
+        if req.query.get("follow") in ("1", "true", "True"):
+            i = lines
+            while True:
+                await asyncio.sleep(0.01)
+                await response.write(frame(i))
+                i += 1
+        return response
+
+    async def stats(self, req: web.Request):
+        # one stats document per second like the daemon, zeroed while not running
+        container = self.find(req.match_info["id"])
+        response = web.StreamResponse()
+        response.content_type = "application/json"
+        await response.prepare(req)
+        total = system = 0
+        while True:
+            running = container["State"] == "running"
+            total += random.randint(1, 10**8) if running else 0
+            system += 10**9
+            usage = random.randint(1, 512) * 1024 * 1024 if running else 0
+            stats = {
+                "id": container["Id"],
+                "name": container["Names"][0],
+                "cpu_stats": {
+                    "cpu_usage": {"total_usage": total if running else 0},
+                    "system_cpu_usage": system if running else 0,
+                },
+                "memory_stats": {
+                    "usage": usage,
+                    "limit": 1024 * 1024 * 1024 if running else 0,
+                },
+            }
+            await response.write((json.dumps(stats) + "\n").encode())
+            if req.query.get("stream") in ("0", "false", "False"):
+                return response
+            await asyncio.sleep(1)
+            if container["Id"] not in self.containers:
+                return response
+
+    async def list_images(self, req: web.Request):
+        return web.json_response(list(self.images.values()))
+
+    async def pull(self, req: web.Request):
+        self.pulls.append(dict(req.query))
+        image = req.query.get("fromImage", "")
+        tag = req.query.get("tag", "latest")
+        response = web.StreamResponse()
+        await response.prepare(req)
+        for current in range(0, 101, 25):
+            progress = {
+                "status": "Downloading",
+                "id": "layer",
+                "progressDetail": {"current": current, "total": 100},
+            }
+            await response.write((json.dumps(progress) + "\n").encode())
+        id = f"sha256:{os.urandom(32).hex()}"
+        self.images[id] = {
+            "Id": id,
+            "RepoTags": [f"{image}:{tag}"],
+            "Created": int(time.time()),
+            "Size": 1,
+            "Labels": {},
+        }
+        self.emit("image", "pull", f"{image}:{tag}", {})
+        done = {"status": f"Downloaded newer image for {image}:{tag}"}
+        await response.write((json.dumps(done) + "\n").encode())
+        return response
+
+    async def delete_image(self, req: web.Request):
+        name = req.match_info["name"]
+        for id, image in list(self.images.items()):
+            matches = id.startswith(name) or id[7:].startswith(name)
+            if matches or name in image["RepoTags"]:
+                del self.images[id]
+                self.emit("image", "delete", id, {})
+                return web.json_response([{"Deleted": id}])
+        return error(404, f"No such image: {name}")
+
+    async def system_df(self, req: web.Request):
+        containers = [dict(c, SizeRw=4096) for c in self.containers.values()]
+        images = [
+            dict(image, SharedSize=0, Containers=-1) for image in self.images.values()
+        ]
+        volumes = [
+            dict(volume, UsageData={"Size": 1024 * 1024, "RefCount": -1})
+            for volume in self.volumes.values()
+        ]
+        return web.json_response(
+            {
+                "LayersSize": 0,
+                "Containers": containers,
+                "Images": images,
+                "Volumes": volumes,
+            }
+        )
+
+    async def list_networks(self, req: web.Request):
+        return web.json_response(list(self.networks.values()))
+
+    async def list_volumes(self, req: web.Request):
+        volumes = list(self.volumes.values())
+        return web.json_response({"Volumes": volumes, "Warnings": []})
+
+    async def delete_volume(self, req: web.Request):
+        name = req.match_info["name"]
+        users = [
+            c
+            for c in self.containers.values()
+            if any(m["Name"] == name for m in c["Mounts"])
+        ]
+        if name not in self.volumes or users:
+            return error(409 if users else 404, f"volume {name} is in use or missing")
+        del self.volumes[name]
+        self.emit("volume", "destroy", name, {})
+        return web.Response(status=204)
+
+    async def delete_network(self, req: web.Request):
+        id = req.match_info["id"]
+        if id not in self.networks:
+            return error(404, f"network {id} not found")
+        del self.networks[id]
+        self.emit("network", "destroy", id, {})
+        return web.Response(status=204)
+
+    async def prune(self, req: web.Request):
+        kind = req.path.rstrip("/").split("/")[-2]
+        deleted = []
+        if kind == "containers":
+            for id, container in list(self.containers.items()):
+                if container["State"] == "exited":
+                    del self.containers[id]
+                    self.emit("container", "destroy", id, {})
+                    deleted.append(id)
+        report = {f"{kind.capitalize()}Deleted": deleted or None}
+        if kind != "networks":
+            report["SpaceReclaimed"] = len(deleted) * 1024
+        return web.json_response(report)
+
+    async def events(self, req: web.Request):
+        response = web.StreamResponse()
+        response.content_type = "application/json"
+        await response.prepare(req)
+        listener = asyncio.Queue()
+        self.listeners.append(listener)
+        if "since" in req.query:
+            seconds, _, fraction = req.query["since"].partition(".")
+            since = int(seconds) * 10**9 + int(fraction[:9].ljust(9, "0") or 0)
+            for event in self.recent:
+                if event["timeNano"] >= since:
+                    listener.put_nowait(event)
+        try:
+            while True:
+                event = await listener.get()
+                await response.write((json.dumps(event) + "\n").encode())
+        finally:
+            self.listeners.remove(listener)
+
+
+# the os level name of the daemon thread, bench.run leaves it out of the server's cpu time
+THREAD_NAME = b"fake-docker"
+
+
+def _name_thread(name: bytes):
+    # linux only, elsewhere the daemon's cpu time counts as the server's
+    try:
+        ctypes.CDLL(None).prctl(15, name)  # PR_SET_NAME
+    except (AttributeError, OSError):
+        pass
+
+
+def serve(daemon: FakeDaemon, path: str) -> threading.Thread:
+    # runs the daemon on its own thread and event loop, like a separate process would
+    if os.path.exists(path):
+        os.unlink(path)
+    ready = threading.Event()
+
+    def run():
+        _name_thread(THREAD_NAME)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(daemon.app())
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.UnixSite(runner, path).start())
+        ready.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=run, name="fake-docker", daemon=True)
+    thread.start()
+    ready.wait()
+    return thread
+
+
+async def run(daemon: FakeDaemon, path: str, redis_url: str, interval: float):
+    if os.path.exists(path):
+        os.unlink(path)
+    runner = web.AppRunner(daemon.app())
+    await runner.setup()
+    await web.UnixSite(runner, path).start()
+    if redis_url:
+        from bench import publisher
+
+        await publisher.run(daemon, redis_url, interval)
+    else:
+        await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fake docker daemon")
+    parser.add_argument("--socket", required=True)
+    parser.add_argument("--containers", type=int, default=100)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per call")
+    parser.add_argument("--redis-url", default=None, help="publish like go publisher")
+    parser.add_argument("--publish-interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    daemon = FakeDaemon(args.containers, args.images, args.latency)
+    asyncio.run(run(daemon, args.socket, args.redis_url, args.publish_interval))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# fake_redis is an in-process stand-in for the aioredis client, covering the pubsub and
+# stream commands dpanel uses, so benchmarks measure the service and not a redis server
+
+import asyncio
+import time
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+Entry = Tuple[bytes, Dict[bytes, bytes]]
+
+
+def _stream_id(value) -> Tuple[int, int]:
+    if isinstance(value, bytes):
+        value = value.decode()
+    ms, _, seq = value.partition("-")
+    return int(ms), int(seq or 0)
+
+
+def _bytes(value) -> bytes:
+    return value.encode() if isinstance(value, str) else value
+
+
+class FakePubSub:
+    def __init__(self, redis: "FakeRedis"):
+        self.redis = redis
+        self.messages = asyncio.Queue()
+        self.channels: List[str] = []
+
+    async def subscribe(self, *channels: str):
+        for chan in channels:
+            self.redis.subscribers[chan].add(self)
+            self.channels.append(chan)
+            await self.messages.put({"type": "subscribe", "channel": chan, "data": 1})
+
+    async def listen(self):
+        while True:
+            yield await self.messages.get()
+
+    async def close(self):
+        for chan in self.channels:
+            self.redis.subscribers[chan].discard(self)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.subscribers: Dict[str, Set[FakePubSub]] = defaultdict(set)
+        self.streams: Dict[str, List[Entry]] = defaultdict(list)
+        self._last_id = (0, 0)
+        self._appended = asyncio.Condition()
+
+    def pubsub(self) -> FakePubSub:
+        return FakePubSub(self)
+
+    async def publish(self, chan: str, data) -> int:
+        data = _bytes(data)
+        subscribers = list(self.subscribers[chan])
+        for sub in subscribers:
+            sub.messages.put_nowait({"type": "message", "channel": chan, "data": data})
+        return len(subscribers)
+
+    async def xadd(self, key: str, fields: dict, id="*", maxlen=None, approximate=True):
+        ms = int(time.time() * 1000)
+        seq = self._last_id[1] + 1 if ms <= self._last_id[0] else 0
+        self._last_id = (max(ms, self._last_id[0]), seq)
+        entry_id = f"{self._last_id[0]}-{self._last_id[1]}".encode()
+        encoded = {_bytes(k): _bytes(v) for k, v in fields.items()}
+        self.streams[key].append((entry_id, encoded))
+        if maxlen:
+            del self.streams[key][:-maxlen]
+        async with self._appended:
+            self._appended.notify_all()
+        return entry_id
+
+    async def xrange(self, key: str, min="-", max="+", count=None) -> List[Entry]:
+        low = (0, 0) if min == "-" else _stream_id(min)
+        entries = [e for e in self.streams[key] if _stream_id(e[0]) >= low]
+        return entries[:count] if count else entries
+
+    async def xrevrange(self, key: str, max="+", min="-", count=None) -> List[Entry]:
+        entries = list(reversed(self.streams[key]))
+        return entries[:count] if count else entries
+
+    async def xread(self, streams: dict, count=None, block=None):
+        (key, last), = streams.items()
+
+        def newer() -> List[Entry]:
+            after = _stream_id(last)
+            entries = [e for e in self.streams[key] if _stream_id(e[0]) > after]
+            return entries[:count] if count else entries
+
+        if not newer() and block:
+            try:
+                async with self._appended:
+                    await asyncio.wait_for(
+                        self._appended.wait_for(lambda: bool(newer())), block / 1000
+                    )
+            except asyncio.TimeoutError:
+                return []
+        entries = newer()
+        return [[key.encode(), entries]] if entries else []
+
+    async def ping(self) -> bool:
+        return True
+
+    async def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+async def from_url(*args, **kwargs) -> FakeRedis:
+    return FakeRedis()
@@ -0,0 +1,82 @@
+# publisher stands in for the go publisher: the lists and stats frames it marshals from the
+# fake daemon's state, published to redis every interval; bench.server runs it in process
+# against the redis stand-in, bench.fake_docker in the daemon's process against a real redis
+
+import asyncio
+import json
+import random
+from bench.fake_docker import FakeDaemon
+
+
+def containers_list(daemon: FakeDaemon) -> str:
+    # the shape the go publisher marshals ContainerInfo into
+    return json.dumps(
+        [
+            {
+                "ID": c["Id"],
+                "Image": c["Image"],
+                "Status": c["Status"],
+                "State": c["State"],
+                "Names": c["Names"],
+                "Ports": c["Ports"],
+            }
+            for c in list(daemon.containers.values())
+        ]
+    )
+
+
+def images_list(daemon: FakeDaemon) -> str:
+    used: dict = {}
+    for c in list(daemon.containers.values()):
+        used[c["ImageID"]] = used.get(c["ImageID"], 0) + 1
+    images = []
+    for id, image in list(daemon.images.items()):
+        # the go publisher sends the full first tag as the name
+        name = image["RepoTags"][0]
+        images.append(
+            {
+                "ID": id[len("sha256:") :],
+                "Name": name,
+                "Tag": name.split(":")[1],
+                "Created": image["Created"],
+                "Size": image["Size"],
+                "NumContainers": min(used.get(id, 0), 255),
+            }
+        )
+    return json.dumps(images)
+
+
+async def publish(redis, daemon: FakeDaemon):
+    # one round of the go publisher's loop: both lists and a stats frame per container, the
+    # go publisher streams stats of stopped containers too, which the daemon sends zeroed
+    await redis.publish("containers_list", containers_list(daemon))
+    await redis.publish("images_list", images_list(daemon))
+    for c in list(daemon.containers.values()):
+        running = c["State"] == "running"
+        usage = random.randint(1, 512) * 1024 * 1024 if running else 0
+        limit = 1024 * 1024 * 1024 if running else 0
+        stats = {
+            "ID": c["Id"],
+            "Name": c["Names"][0][1:],
+            "CpuPercent": random.random() * 100 if running else 0.0,
+            "MemoryUsage": usage,
+            "MemoryLimit": limit,
+            "MemoryPercent": usage / limit * 100 if running else 0.0,
+        }
+        await redis.publish("container_metrics", json.dumps(stats))
+
+
+async def run(daemon: FakeDaemon, redis_url: str, interval: float):
+    # publishes to a real redis until cancelled, retrying while redis is not up yet
+    import aioredis
+
+    redis = aioredis.from_url(redis_url)
+    try:
+        while True:
+            try:
+                await publish(redis, daemon)
+            except (OSError, aioredis.RedisError):
+                pass
+            await asyncio.sleep(interval)
+    finally:
+        await redis.close()
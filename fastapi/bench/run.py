@@ -0,0 +1,520 @@
+# run starts bench.server in a child process and drives it with aiohttp clients,
+# reporting throughput, p50/p99 latency and the server's resident memory and cpu time
+# per scenario; run from the fastapi directory, e.g.
+#   python -m bench.run --scenario all --clients 200 --ids 50 --output results.json
+#   python -m bench.run --scenario idle --publisher embedded
+# --stack measures what a deployment runs: the fake daemon gets a process of its own and
+# is left out, and with the redis publisher a real redis-server is started and counted
+# with the app, the daemon's process publishing into it in place of the go publisher;
+# --measure publisher=PID adds a go publisher started by hand to the totals
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+import aiohttp
+from bench.fake_docker import THREAD_NAME
+
+STREAMS = [
+    "/api/streams/containerlist",
+    "/api/streams/containerlist?mode=page&limit=50",
+    "/api/streams/imagelist",
+    "/api/streams/containermetrics",
+    "/api/streams/servermessages",
+    "/api/streams/composefiles",
+    "/api/streams/composestatus",
+    "/api/streams/volumelist",
+    "/api/streams/networklist",
+]
+
+
+def percentile(values: List[float], p: float) -> float:
+    # nearest rank
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def summary(latencies: List[float], seconds: float, errors: int = 0) -> dict:
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / seconds if seconds else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+class Memory:
+    # samples the resident set of the measured processes from /proc while a scenario runs,
+    # and their cpu time, in total and per process
+    def __init__(self, pids: Dict[str, int]):
+        self.pids = pids
+        self.samples: List[int] = []
+        self.peaks: Dict[str, int] = {name: 0 for name in pids}
+        self.cpu_started = {name: self.cpu(pid) for name, pid in pids.items()}
+        self.started = time.perf_counter()
+
+    def cpu(self, pid: int) -> float:
+        # user and system cpu seconds of the process' threads so far, without the fake
+        # daemon's thread, whose work is dockerd's in a real install; 0 without /proc
+        ticks = 0
+        try:
+            tasks = os.listdir(f"/proc/{pid}/task")
+        except OSError:
+            return 0.0
+        for task in tasks:
+            try:
+                with open(f"/proc/{pid}/task/{task}/stat") as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            # the command name is in parentheses and may contain spaces
+            name, _, rest = stat.partition("(")[2].rpartition(")")
+            if name.encode() == THREAD_NAME:
+                continue
+            fields = rest.split()
+            ticks += int(fields[11]) + int(fields[12])
+        return ticks / os.sysconf("SC_CLK_TCK")
+
+    def rss(self, pid: int) -> int:
+        # kilobytes, 0 where /proc is not available
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return 0
+
+    def take(self):
+        total = 0
+        for name, pid in self.pids.items():
+            rss = self.rss(pid)
+            self.peaks[name] = max(self.peaks[name], rss)
+            total += rss
+        self.samples.append(total)
+
+    async def sample(self, interval: float = 0.1):
+        while True:
+            self.take()
+            await asyncio.sleep(interval)
+
+    def report(self) -> dict:
+        samples = self.samples or [0]
+        return {"start_kb": samples[0], "peak_kb": max(samples), "end_kb": samples[-1]}
+
+    def cpu_report(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        processes = {
+            name: self.cpu(pid) - self.cpu_started[name]
+            for name, pid in self.pids.items()
+        }
+        seconds = sum(processes.values())
+        return {"seconds": seconds, "percent": seconds / elapsed * 100 if elapsed else 0.0}
+
+    def processes(self) -> dict:
+        # only reported when more than the app is measured
+        elapsed = time.perf_counter() - self.started
+        result = {}
+        for name, pid in self.pids.items():
+            seconds = self.cpu(pid) - self.cpu_started[name]
+            result[name] = {
+                "peak_kb": self.peaks[name],
+                "cpu_seconds": seconds,
+                "cpu_percent": seconds / elapsed * 100 if elapsed else 0.0,
+            }
+        return result
+
+
+async def measured(pids: Dict[str, int], scenario) -> dict:
+    memory = Memory(pids)
+    sampler = asyncio.create_task(memory.sample())
+    try:
+        result = await scenario
+    finally:
+        sampler.cancel()
+    memory.take()
+    result["rss"] = memory.report()
+    result["cpu"] = memory.cpu_report()
+    if len(pids) > 1:
+        result["processes"] = memory.processes()
+    return result
+
+
+async def idle(duration: float) -> dict:
+    # no clients: what publishing the lists and stats alone costs the server
+    await asyncio.sleep(duration)
+    return {"seconds": duration}
+
+
+async def sse_client(session, url: str, duration: float, stats: dict):
+    # time to the first event and events received until the duration is over;
+    # quiet streams (compose files) may send nothing after the snapshot
+    started = time.perf_counter()
+    events = 0
+
+    async def read():
+        nonlocal events
+        async with session.get(url) as response:
+            async for line in response.content:
+                if line.startswith(b"data:") and line.strip() != b"data:":
+                    if not events:
+                        stats["first"].append(time.perf_counter() - started)
+                    events += 1
+
+    try:
+        await asyncio.wait_for(read(), duration)
+    except asyncio.TimeoutError:
+        pass
+    except aiohttp.ClientError:
+        stats["errors"] += 1
+    stats["events"] += events
+
+
+async def sse_fanout(session, base: str, clients: int, duration: float) -> dict:
+    results = {}
+    for path in STREAMS:
+        stats = {"first": [], "events": 0, "errors": 0}
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(
+                sse_client(session, base + path, duration, stats)
+                for _ in range(clients)
+            )
+        )
+        seconds = time.perf_counter() - started
+        results[path] = {
+            "clients": clients,
+            "connected": len(stats["first"]),
+            "errors": stats["errors"],
+            "events": stats["events"],
+            "events_per_sec": stats["events"] / seconds,
+            "first_event_p50_ms": percentile(stats["first"], 50) * 1000,
+            "first_event_p99_ms": percentile(stats["first"], 99) * 1000,
+        }
+    return results
+
+
+async def container_ids(session, base: str, count: int) -> List[str]:
+    async with session.get(f"{base}/api/containers?limit={max(count, 1)}") as r:
+        page = await r.json()
+    return [c["ID"] for c in page["items"]][:count]
+
+
+async def workers(concurrency: int, duration: float, request) -> dict:
+    # runs `request` back to back on each worker until the duration is over
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                ok = await request()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            elif ok is not None:
+                # None: the request counts neither as done nor as failed
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summary(latencies, time.perf_counter() - started, errors)
+
+
+async def actions(session, base: str, ids: int, concurrency: int, duration: float):
+    # POST /api/containers/restart with M ids, the path the bulk buttons take
+    # requests the scheduler refused with 429 are counted apart, they did no work
+    targets = await container_ids(session, base, ids)
+    rejected = 0
+
+    async def request():
+        nonlocal rejected
+        body = {"ids": targets}
+        async with session.post(f"{base}/api/containers/restart", json=body) as r:
+            await r.read()
+            if r.status == 429:
+                rejected += 1
+                await asyncio.sleep(float(r.headers.get("Retry-After", 1)))
+                return None
+            return r.status < 500
+
+    result = await workers(concurrency, duration, request)
+    result["rejected"] = rejected
+    result["ids"] = len(targets)
+    result["ids_per_sec"] = result["throughput"] * len(targets)
+    return result
+
+
+async def info(session, base: str, concurrency: int, duration: float):
+    targets = await container_ids(session, base, 500)
+
+    async def request():
+        id = random.choice(targets)
+        async with session.get(f"{base}/api/containers/info/{id}") as r:
+            await r.read()
+            return r.status == 200
+
+    return await workers(concurrency, duration, request)
+
+
+async def compose(session, base: str, concurrency: int, duration: float):
+    async def request():
+        async with session.get(f"{base}/api/compose/status") as r:
+            await r.read()
+            return r.status == 200
+
+    return await workers(concurrency, duration, request)
+
+
+async def prune_plan(session, base: str, concurrency: int, duration: float):
+    async def request():
+        async with session.get(f"{base}/api/system/prune/plan") as r:
+            await r.read()
+            return r.status == 200
+
+    return await workers(concurrency, duration, request)
+
+
+async def wait_ready(session, base: str, process, timeout: float = 30) -> dict:
+    # seconds from spawning the server until it answered /api/health, /api/ready,
+    # and served the first containers_list that went through the stream hub
+    started = time.perf_counter()
+    deadline = started + timeout
+    startup = {}
+    checks = [
+        ("health_s", "/api/health", lambda body: True),
+        ("ready_s", "/api/ready", lambda body: True),
+        ("first_list_s", "/api/containers?limit=1", lambda body: body["total"]),
+    ]
+    while checks and time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"bench server exited with {process.returncode}")
+        key, path, done = checks[0]
+        try:
+            async with session.get(base + path) as r:
+                if r.status == 200 and done(await r.json()):
+                    startup[key] = time.perf_counter() - started
+                    checks.pop(0)
+                    continue
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.02)
+    if checks:
+        raise RuntimeError("bench server did not become ready")
+    return startup
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(ready, process: subprocess.Popen, what: str, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while not ready():
+        if process.poll() is not None or time.monotonic() > deadline:
+            raise RuntimeError(f"{what} did not start")
+        time.sleep(0.02)
+
+
+def start_stack(args) -> Dict[str, subprocess.Popen]:
+    # the fake daemon in its own process, and for the redis publisher a real redis-server
+    # the daemon's process publishes into; sets args.server_args for the app to use both
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = os.path.join(tempfile.mkdtemp(prefix="dpanel-bench-"), "docker.sock")
+    processes = {}
+    args.server_args = ["--daemon-socket", path]
+    daemon = [
+        sys.executable,
+        "-m",
+        "bench.fake_docker",
+        "--socket",
+        path,
+        "--containers",
+        str(args.containers),
+        "--images",
+        str(args.images),
+        "--latency",
+        str(args.latency),
+        "--publish-interval",
+        str(args.publish_interval),
+    ]
+    if args.publisher == "redis":
+        port = free_port()
+        url = f"redis://127.0.0.1:{port}"
+        command = [args.redis_server, "--port", str(port), "--save", ""]
+        redis = processes["redis"] = subprocess.Popen(
+            command + ["--appendonly", "no"], stdout=subprocess.DEVNULL
+        )
+
+        def answers() -> bool:
+            try:
+                socket.create_connection(("127.0.0.1", port), 0.1).close()
+                return True
+            except OSError:
+                return False
+
+        wait_for(answers, redis, "redis-server")
+        daemon += ["--redis-url", url]
+        args.server_args += ["--redis-url", url]
+    processes["daemon"] = subprocess.Popen(daemon, cwd=cwd)
+    wait_for(lambda: os.path.exists(path), processes["daemon"], "fake daemon")
+    return processes
+
+
+def stop(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def start_server(args) -> subprocess.Popen:
+    command = [
+        sys.executable,
+        "-m",
+        "bench.server",
+        "--port",
+        str(args.port),
+        "--containers",
+        str(args.containers),
+        "--images",
+        str(args.images),
+        "--latency",
+        str(args.latency),
+        "--compose-files",
+        str(args.compose_files),
+        "--publish-interval",
+        str(args.publish_interval),
+        "--publisher",
+        args.publisher,
+        *args.server_args,
+    ]
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"))
+    return subprocess.Popen(command, cwd=cwd, env=env)
+
+
+async def run(args) -> dict:
+    base = f"http://127.0.0.1:{args.port}"
+    scenarios = (
+        ["idle", "sse", "actions", "info", "compose", "plan"]
+        if args.scenario == "all"
+        else [args.scenario]
+    )
+    args.server_args = []
+    stack = start_stack(args) if args.stack else {}
+    process = start_server(args)
+    # the processes whose memory and cpu count: the app, redis, and any given by hand
+    pids = {"app": process.pid}
+    if "redis" in stack:
+        pids["redis"] = stack["redis"].pid
+    for measure in args.measure:
+        name, _, pid = measure.partition("=")
+        pids[name] = int(pid)
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=args.duration + 10)
+    results: Dict[str, dict] = {}
+    startup: Dict[str, float] = {}
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as s:
+            startup = await wait_ready(s, base, process)
+            print("startup", json.dumps(startup, indent=2), flush=True)
+            for scenario in scenarios:
+                if scenario == "idle":
+                    work = idle(args.duration)
+                elif scenario == "sse":
+                    work = sse_fanout(s, base, args.clients, args.duration)
+                elif scenario == "actions":
+                    work = actions(s, base, args.ids, args.concurrency, args.duration)
+                elif scenario == "info":
+                    work = info(s, base, args.concurrency, args.duration)
+                elif scenario == "plan":
+                    work = prune_plan(s, base, args.concurrency, args.duration)
+                else:
+                    work = compose(s, base, args.concurrency, args.duration)
+                results[scenario] = await measured(pids, work)
+                print(scenario, json.dumps(results[scenario], indent=2), flush=True)
+    finally:
+        for started in [process, *stack.values()]:
+            stop(started)
+    return {
+        "meta": {
+            key: getattr(args, key)
+            for key in (
+                "clients",
+                "ids",
+                "concurrency",
+                "duration",
+                "containers",
+                "images",
+                "latency",
+                "compose_files",
+                "publish_interval",
+                "publisher",
+                "stack",
+            )
+        },
+        "startup": startup,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="dpanel load tests")
+    parser.add_argument(
+        "--scenario",
+        choices=["all", "idle", "sse", "actions", "info", "compose", "plan"],
+        default="all",
+    )
+    parser.add_argument("--clients", type=int, default=50, help="SSE clients")
+    parser.add_argument("--ids", type=int, default=20, help="ids per action")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--containers", type=int, default=100)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--compose-files", type=int, default=20)
+    parser.add_argument("--publish-interval", type=float, default=1.0)
+    parser.add_argument("--publisher", choices=["redis", "embedded"], default="redis")
+    parser.add_argument(
+        "--stack", action="store_true", help="fake daemon apart, real redis-server"
+    )
+    parser.add_argument("--redis-server", default="redis-server", help="for --stack")
+    parser.add_argument(
+        "--measure",
+        action="append",
+        default=[],
+        metavar="NAME=PID",
+        help="another process to count, e.g. a go publisher",
+    )
+    parser.add_argument("--output", default=None, help="write results as json")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
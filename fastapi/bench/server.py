@@ -0,0 +1,123 @@
+# server runs the dpanel app against the fake docker daemon and the in-process redis,
+# with a publisher task standing in for the go publisher, so bench.run can load it;
+# with --publisher embedded the app produces the lists and stats itself, without redis,
+# and with --hosts N it follows N fake daemons, the last one --slow-host seconds slower;
+# --daemon-socket and --redis-url use a daemon and a redis running in their own processes
+# run from the fastapi directory: python -m bench.server --port 5099 --containers 500
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import aioredis
+import uvicorn
+from bench import fake_redis, publisher
+from bench.fake_docker import FakeDaemon, serve
+
+COMPOSE_TEMPLATE = """services:
+  web:
+    image: bench/image-{i}:latest
+    ports:
+      - "{port}:80"
+  worker:
+    image: bench/image-{i}:latest
+"""
+
+
+def write_compose_files(count: int) -> str:
+    directory = tempfile.mkdtemp(prefix="dpanel-bench-compose-")
+    for i in range(count):
+        path = os.path.join(directory, f"project-{i}.yaml")
+        with open(path, "w") as f:
+            f.write(COMPOSE_TEMPLATE.format(i=i, port=20000 + i))
+    return directory
+
+
+async def publish(main, daemon: FakeDaemon, interval: float, messages: float):
+    # lists and per container stats every interval, like the go publisher's loop,
+    # and a toast every `messages` seconds; only the toasts without redis, or when the
+    # daemon runs in its own process and publishes itself
+    next_message = 0.0
+    loop = asyncio.get_running_loop()
+    while True:
+        redis = main.redis
+        # the app lists every host itself when it follows several
+        if redis is not None and main.embedded_publisher is None and daemon is not None:
+            await publisher.publish(redis, daemon)
+        if messages and loop.time() >= next_message:
+            next_message = loop.time() + messages
+            await main.message_log.publish("Benchmark tick", "info")
+        await asyncio.sleep(interval)
+
+
+async def run(args):
+    # main is imported inside the loop, its module level objects bind to this loop
+    import main
+
+    server = uvicorn.Server(
+        uvicorn.Config(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+    )
+    publishing = asyncio.create_task(
+        publish(main, args.daemon, args.publish_interval, args.message_interval)
+    )
+    try:
+        await server.serve()
+    finally:
+        publishing.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="dpanel against fake docker and redis")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--containers", type=int, default=100)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per call")
+    parser.add_argument("--compose-files", type=int, default=20)
+    parser.add_argument("--publish-interval", type=float, default=1.0)
+    parser.add_argument("--message-interval", type=float, default=5.0)
+    parser.add_argument("--socket", default=None)
+    parser.add_argument("--publisher", choices=["redis", "embedded"], default="redis")
+    parser.add_argument("--hosts", type=int, default=1, help="fake docker daemons")
+    parser.add_argument(
+        "--slow-host", type=float, default=0.0, help="extra latency of the last host"
+    )
+    parser.add_argument(
+        "--daemon-socket", default=None, help="a fake daemon serving in its own process"
+    )
+    parser.add_argument("--redis-url", default=None, help="a real redis")
+    args = parser.parse_args()
+
+    if args.daemon_socket:
+        # its process publishes the lists and stats, when there is a redis to publish to
+        socket = args.daemon_socket
+        args.daemon = None
+    else:
+        socket = args.socket or os.path.join(
+            tempfile.mkdtemp(prefix="dpanel-bench-"), "docker.sock"
+        )
+        args.daemon = FakeDaemon(args.containers, args.images, args.latency)
+        serve(args.daemon, socket)
+    os.environ["DOCKER_HOST"] = f"unix://{socket}"
+    if args.hosts > 1:
+        hosts = [f"local=unix://{socket}"]
+        for i in range(1, args.hosts):
+            latency = args.latency + (args.slow_host if i == args.hosts - 1 else 0)
+            path = f"{socket}.{i}"
+            serve(FakeDaemon(args.containers, args.images, latency), path)
+            hosts.append(f"host-{i}=unix://{path}")
+        os.environ["DOCKER_HOSTS"] = ",".join(hosts)
+    os.environ["COMPOSE_DIR"] = write_compose_files(args.compose_files)
+    os.environ["DPANEL_PUBLISHER"] = args.publisher
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+    else:
+        aioredis.from_url = fake_redis.from_url
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    compose_dir = os.environ["COMPOSE_DIR"]
+    print(f"docker socket {socket}, compose dir {compose_dir}", flush=True)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# blocking runs docker sdk and compose calls that have no async version on a dedicated thread pool,
+# so a slow pull or compose up never stalls the event loop serving the SSE streams
+
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable
+from logger import Logger
+import config
+
+
+class BlockingExecutor:
+    def __init__(
+        self,
+        workers: int = config.BLOCKING_POOL_SIZE,
+        max_pending: int = config.BLOCKING_MAX_PENDING,
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="docker-blocking"
+        )
+        # bounds calls waiting for or running on the pool, created on first use inside the loop
+        self._slots: asyncio.Semaphore = None
+        self.pending = 0
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        async with self._slots:
+            self.pending += 1
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    self._pool, functools.partial(fn, *args, **kwargs)
+                )
+            finally:
+                self.pending -= 1
+
+    async def iterate(
+        self, make_iter: Callable[[], Iterable], on_item: Callable[[Any], None]
+    ):
+        # consumes a blocking iterator on the pool, handing every item to on_item on the event loop
+        loop = asyncio.get_running_loop()
+
+        def consume():
+            for item in make_iter():
+                loop.call_soon_threadsafe(on_item, item)
+
+        await self.run(consume)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+
+class LoopLagMonitor:
+    # measures how late the event loop wakes up a task that sleeps for `interval`
+    def __init__(self, interval: float = config.LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._task: asyncio.Task = None
+        self.logger = Logger(__name__)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(time.monotonic() - started - self.interval, 0.0)
+            self.max_lag = max(self.max_lag, self.last_lag)
+            if self.last_lag > config.LOOP_LAG_WARNING:
+                self.logger.warning("Event loop lagged %.0f ms", self.last_lag * 1000)
@@ -0,0 +1,126 @@
+# bulk_actions runs one action over many objects with a bounded number of concurrent daemon calls
+# results come back one by one as each object finishes, and a failing object never fails the batch
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional
+from aiodocker.exceptions import DockerError
+import config
+
+# run's timeout when the caller gives none, the executor's own applies
+_DEFAULT_TIMEOUT = object()
+# ends the queue of a detached iterator
+_END = object()
+# tasks of detached iterators, referenced until they finish
+_detached = set()
+
+
+def _finished(task: asyncio.Task):
+    _detached.discard(task)
+    if not task.cancelled():
+        # retrieved here, the reader may be gone
+        task.exception()
+
+
+def detached(results: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    # runs results to its end on a task of its own and returns an iterator that reads
+    # along; a streaming client that goes away stops reading, not the work, so every
+    # action still finishes and a summary at the end of results is still published
+    queue = asyncio.Queue()
+
+    async def drain():
+        try:
+            async for result in results:
+                queue.put_nowait(result)
+        finally:
+            queue.put_nowait(_END)
+
+    task = asyncio.create_task(drain())
+    _detached.add(task)
+    task.add_done_callback(_finished)
+
+    async def read():
+        while True:
+            result = await queue.get()
+            if result is _END:
+                # raises what stopped results early
+                await task
+                return
+            yield result
+
+    return read()
+
+
+class BulkActionExecutor:
+    def __init__(
+        self,
+        concurrency: int = config.BULK_ACTION_CONCURRENCY,
+        timeout: float = config.BULK_ACTION_TIMEOUT,
+    ):
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    async def _run_one(
+        self,
+        item: Any,
+        fn: Callable[[Any], Awaitable[dict]],
+        object_id: str,
+        timeout: Optional[float],
+    ) -> dict:
+        try:
+            return await asyncio.wait_for(fn(item), timeout)
+        except asyncio.TimeoutError:
+            return {
+                "type": "error",
+                "objectId": object_id,
+                "statusCode": 504,
+                "message": f"{object_id[:12]}: timed out after {timeout}s",
+            }
+        except DockerError as e:
+            return {
+                "type": "error",
+                "objectId": object_id,
+                "statusCode": e.status,
+                "message": f"{object_id[:12]}: {e.message}",
+            }
+        except Exception as e:
+            return {
+                "type": "error",
+                "objectId": object_id,
+                "statusCode": 500,
+                "message": f"{object_id[:12]}: {e}",
+            }
+
+    async def run(
+        self,
+        items: List[Any],
+        fn: Callable[[Any], Awaitable[dict]],
+        object_id: Callable[[Any], str] = str,
+        timeout: Optional[float] = _DEFAULT_TIMEOUT,
+    ) -> AsyncIterator[dict]:
+        # yields the result of fn for every item in completion order
+        # timeout replaces the executor's for this run, None lets every call take its time
+        if timeout is _DEFAULT_TIMEOUT:
+            timeout = self.timeout
+        # a fixed set of workers pulls from the item queue, so at most `concurrency` calls are in flight
+        todo = asyncio.Queue()
+        for item in items:
+            todo.put_nowait(item)
+        done = asyncio.Queue()
+
+        async def worker():
+            while not todo.empty():
+                item = todo.get_nowait()
+                done.put_nowait(await self._run_one(item, fn, object_id(item), timeout))
+
+        workers = [
+            asyncio.create_task(worker())
+            for _ in range(min(self.concurrency, len(items)))
+        ]
+        try:
+            for _ in range(len(items)):
+                yield await done.get()
+        finally:
+            # only when the caller stops reading early, streams that must finish read
+            # through detached()
+            for task in workers:
+                task.cancel()
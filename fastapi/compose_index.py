@@ -0,0 +1,161 @@
+# compose_index keeps one in-memory index of the compose files for the whole process
+# the directory is watched with inotify when watchfiles is installed, otherwise one shared poller
+# compares mtimes; parsed metadata (services, images, ports) is cached per file until its mtime changes
+# and the compose_files channel only gets a frame when the index actually changed
+
+import asyncio
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+import yaml
+from blocking import BlockingExecutor
+from logger import Logger
+from stream_hub import StreamHub
+import config
+
+try:
+    import watchfiles
+except ImportError:
+    watchfiles = None
+
+COMPOSE_EXTENSIONS = (".yaml", ".yml")
+
+
+def parse_compose_file(path: str) -> dict:
+    # the bits of a compose file the UI shows without running compose config
+    with open(path) as f:
+        document = yaml.safe_load(f) or {}
+    services = document.get("services") or {}
+    images, ports = [], []
+    for service in services.values():
+        service = service or {}
+        if service.get("image"):
+            images.append(service["image"])
+        for port in service.get("ports") or []:
+            if isinstance(port, dict):
+                port = f"{port.get('published', '')}:{port.get('target', '')}"
+            ports.append(str(port))
+    return {"services": list(services), "images": images, "ports": ports}
+
+
+class ComposeFileIndex:
+    def __init__(
+        self,
+        hub: StreamHub,
+        blocking: BlockingExecutor,
+        directory: str = config.COMPOSE_DIR,
+        poll_interval: float = config.COMPOSE_POLL_INTERVAL,
+        chan: str = "compose_files",
+    ):
+        self.hub = hub
+        self.blocking = blocking
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.chan = chan
+        # project name -> (mtime, metadata)
+        self.files: Dict[str, Tuple[float, dict]] = {}
+        # project name -> the file it was read from, .yaml or .yml
+        self._paths: Dict[str, str] = {}
+        self._frame: str = None
+        self._task: asyncio.Task = None
+        self.logger = Logger(__name__)
+        hub.add_local_channel(chan, snapshot_provider=self._snapshot)
+
+    def path(self, name: str) -> str:
+        # the indexed file of a project, or where a new one is written
+        return self._paths.get(name) or os.path.join(self.directory, f"{name}.yaml")
+
+    def _snapshot(self) -> List[str]:
+        return [self._frame] if self._frame is not None else []
+
+    def names(self) -> List[str]:
+        return sorted(self.files)
+
+    def get(self, name: str) -> Optional[dict]:
+        entry = self.files.get(name)
+        return entry[1] if entry is not None else None
+
+    def frame(self) -> str:
+        names = self.names()
+        projects = [dict(name=name, **self.files[name][1]) for name in names]
+        return json.dumps({"files": names, "projects": projects})
+
+    async def start(self):
+        await self.rescan()
+        self._task = asyncio.create_task(self._watch())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _watch(self):
+        while True:
+            try:
+                if watchfiles is not None:
+                    async for _ in watchfiles.awatch(self.directory):
+                        await self.rescan()
+                else:
+                    await asyncio.sleep(self.poll_interval)
+                    await self.rescan()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error("Watching %s failed: %s", self.directory, e)
+                await asyncio.sleep(self.poll_interval)
+
+    def _scan(self) -> Dict[str, Tuple[float, str]]:
+        # project name -> (mtime, path), name.yaml wins over name.yml
+        files = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                name, ext = os.path.splitext(entry.name)
+                if ext not in COMPOSE_EXTENSIONS or not entry.is_file():
+                    continue
+                if ext == ".yaml" or name not in files:
+                    files[name] = (entry.stat().st_mtime, entry.path)
+        return files
+
+    def _load(self, name: str, path: str) -> dict:
+        try:
+            return parse_compose_file(path)
+        except Exception as e:
+            self.logger.warning("Could not parse %s: %s", path, e)
+            return {"services": [], "images": [], "ports": [], "error": str(e)}
+
+    async def rescan(self):
+        files = await self.blocking.run(self._scan)
+        changed = set(self.files) - set(files)
+        for name in changed:
+            del self.files[name]
+            self._paths.pop(name, None)
+        for name, (mtime, path) in files.items():
+            entry = self.files.get(name)
+            if entry is None or entry[0] != mtime or self._paths.get(name) != path:
+                await self._update(name, mtime, path)
+                changed.add(name)
+        if changed or self._frame is None:
+            self._publish()
+
+    async def _update(self, name: str, mtime: float = None, path: str = None):
+        path = path or self.path(name)
+        if mtime is None:
+            mtime = os.stat(path).st_mtime
+        self.files[name] = (mtime, await self.blocking.run(self._load, name, path))
+        self._paths[name] = path
+
+    async def refresh(self, name: str):
+        # called after the API wrote a file, so clients see it without waiting for the watcher
+        await self._update(name)
+        self._publish()
+
+    def remove(self, name: str):
+        self._paths.pop(name, None)
+        if self.files.pop(name, None) is not None:
+            self._publish()
+
+    def _publish(self):
+        frame = self.frame()
+        if frame != self._frame:
+            self._frame = frame
+            self.hub.publish_local(self.chan, frame)
@@ -0,0 +1,199 @@
+# compose_manager runs compose up/down for the projects in the compose index
+# runs of the same project are serialized by a per-project lock, different projects run in parallel
+# a run takes its background scheduler slot once it holds the lock, runs queued behind one busy
+# project wait without holding slots pulls and prunes need; a cancelled run keeps both until
+# its compose call returns
+# and the runtime status of every project is derived from container labels in the state index
+# python_on_whales is imported on the first compose run, it is slow to import and nothing
+# else in the service needs it
+
+import asyncio
+import json
+from typing import AsyncIterator, Awaitable, Callable, Dict, List
+from blocking import BlockingExecutor
+from bulk_actions import BulkActionExecutor
+from compose_index import ComposeFileIndex
+from scheduler import Scheduler
+from state_index import StateIndex
+from stream_hub import StreamHub
+import config
+
+PROJECT_LABEL = "com.docker.compose.project"
+SERVICE_LABEL = "com.docker.compose.service"
+
+
+class ComposeError(Exception):
+    # a failed compose run, with python_on_whales' message
+    pass
+
+
+async def _uncancelled(call: Awaitable):
+    # compose runs on a pool thread that cannot be stopped: a caller cancelled while it
+    # runs, e.g. by a client going away, keeps waiting with the project lock and its slot
+    # until the thread is done, so no other run of the project overlaps it
+    future = asyncio.ensure_future(call)
+    cancelled = False
+    while True:
+        try:
+            result = await asyncio.shield(future)
+            break
+        except asyncio.CancelledError:
+            if future.cancelled():
+                raise
+            cancelled = True
+    if cancelled:
+        raise asyncio.CancelledError()
+    return result
+
+
+class ComposeManager:
+    def __init__(
+        self,
+        index: ComposeFileIndex,
+        state_index: StateIndex,
+        blocking: BlockingExecutor,
+        hub: StreamHub,
+        scheduler: Scheduler = None,
+        chan: str = "compose_status",
+    ):
+        self.index = index
+        self.state_index = state_index
+        self.blocking = blocking
+        self.hub = hub
+        self.scheduler = scheduler or Scheduler()
+        self.chan = chan
+        self.bulk_executor = BulkActionExecutor(
+            concurrency=config.COMPOSE_CONCURRENCY, timeout=None
+        )
+        # project file -> python_on_whales DockerClient, built once per project
+        self._clients: Dict[str, object] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._frame: str = None
+        hub.add_local_channel(chan, snapshot_provider=self._snapshot)
+        # recompute on container events and when compose files come and go
+        state_index.add_listener(self._on_event)
+        hub.add_listener(index.chan, lambda frame: self.publish())
+
+    @staticmethod
+    def project_name(project_file: str) -> str:
+        # project name is the name of the file
+        return project_file.split(".")[0]
+
+    def client(self, project_file: str):
+        docker = self._clients.get(project_file)
+        if docker is None:
+            from python_on_whales import DockerClient
+
+            docker = self._clients[project_file] = DockerClient(
+                compose_files=[self.index.path(project_file)],
+                compose_project_name=self.project_name(project_file),
+            )
+        return docker
+
+    def lock(self, project_file: str) -> asyncio.Lock:
+        name = self.project_name(project_file)
+        if name not in self._locks:
+            self._locks[name] = asyncio.Lock()
+        return self._locks[name]
+
+    def busy(self, project_file: str) -> bool:
+        return self.lock(project_file).locked()
+
+    def forget(self, project_file: str):
+        # drops the cached client once the file is deleted
+        self._clients.pop(project_file, None)
+
+    async def run(
+        self,
+        project_file: str,
+        action: str,
+        on_line: Callable[[tuple], None] = None,
+    ):
+        # runs compose up or down, waiting for any run of the same project to finish first
+        # raises ComposeError when compose fails
+        from python_on_whales import DockerException
+
+        docker = self.client(project_file)
+        async with self.lock(project_file), self.scheduler.slot("background"):
+            # the status stream shows the project as busy while it runs
+            self.publish()
+            try:
+                if on_line is None:
+                    if action == "up":
+                        call = self.blocking.run(docker.compose.up, detach=True)
+                    else:
+                        call = self.blocking.run(docker.compose.down)
+                    await _uncancelled(call)
+                    return
+
+                def command():
+                    if action == "up":
+                        return docker.compose.up(detach=True, stream_logs=True)
+                    return docker.compose.down(stream_logs=True)
+
+                await _uncancelled(self.blocking.iterate(command, on_line))
+            except DockerException as e:
+                raise ComposeError(str(e)) from e
+            finally:
+                # the lock is still held here, publish once it is released
+                asyncio.get_running_loop().call_soon(self.publish)
+
+    async def bulk(self, action: str, project_files: List[str]) -> AsyncIterator[dict]:
+        # yields one result per project as they finish, at most COMPOSE_CONCURRENCY at a time
+        async def run_one(project_file: str) -> dict:
+            try:
+                await self.run(project_file, action)
+            except ComposeError as e:
+                return {
+                    "type": "error",
+                    "objectId": project_file,
+                    "statusCode": 400,
+                    "message": f"{project_file}: {e}",
+                }
+            return {"type": "success", "objectId": project_file}
+
+        async for result in self.bulk_executor.run(project_files, run_one):
+            yield result
+
+    def status(self) -> List[dict]:
+        projects: Dict[str, dict] = {}
+        file_projects = {self.project_name(f) for f in self.index.names()}
+        for name in file_projects:
+            projects[name] = {"name": name, "running": 0, "total": 0, "services": {}}
+        for state in self.state_index.containers.values():
+            name = state.labels.get(PROJECT_LABEL)
+            if not name:
+                continue
+            if name not in projects:
+                projects[name] = {"name": name, "running": 0, "total": 0, "services": {}}
+            project = projects[name]
+            project["total"] += 1
+            if state.running:
+                project["running"] += 1
+            service = state.labels.get(SERVICE_LABEL, state.name)
+            project["services"][service] = state.status
+        for name, project in projects.items():
+            if project["total"] == 0:
+                project["status"] = "down"
+            elif project["running"] == project["total"]:
+                project["status"] = "running"
+            elif project["running"]:
+                project["status"] = "partial"
+            else:
+                project["status"] = "exited"
+            project["hasFile"] = name in file_projects
+            project["busy"] = name in self._locks and self._locks[name].locked()
+        return [projects[name] for name in sorted(projects)]
+
+    def _snapshot(self) -> List[str]:
+        return [self._frame] if self._frame is not None else []
+
+    def _on_event(self, event: dict):
+        if event.get("Type") in ("container", "resync"):
+            self.publish()
+
+    def publish(self):
+        frame = json.dumps({"projects": self.status()})
+        if frame != self._frame:
+            self._frame = frame
+            self.hub.publish_local(self.chan, frame)
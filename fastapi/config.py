@@ -0,0 +1,146 @@
+# config holds tunables for the fastapi service, all overridable through environment variables
+
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://redis")
+
+# stream hub: frames buffered per SSE client before older frames are dropped
+STREAM_CLIENT_QUEUE_SIZE = _env_int("STREAM_CLIENT_QUEUE_SIZE", 16)
+# a client that keeps falling behind gets disconnected after this many dropped frames in a row
+STREAM_CLIENT_MAX_DROPS = _env_int("STREAM_CLIENT_MAX_DROPS", 64)
+# seconds to wait before resubscribing after the redis connection of a channel fails
+STREAM_RECONNECT_DELAY = _env_float("STREAM_RECONNECT_DELAY", 1.0)
+# seconds a redis subscription outlives the last client of a channel nobody else needs
+STREAM_READER_IDLE_TIMEOUT = _env_float("STREAM_READER_IDLE_TIMEOUT", 30.0)
+# SSE compression: "off", "auto" for gzip or deflate as the client accepts, "gzip" or
+# "deflate"; ?compress= overrides it per stream, the level trades cpu for bytes (1-9)
+STREAM_COMPRESSION = os.environ.get("STREAM_COMPRESSION", "off").lower()
+STREAM_COMPRESSION_LEVEL = _env_int("STREAM_COMPRESSION_LEVEL", 6)
+
+# delta streams: seconds between full keyframes sent in place of a delta
+DELTA_KEYFRAME_INTERVAL = _env_float("DELTA_KEYFRAME_INTERVAL", 30.0)
+
+# metrics history: ring buffer sizes per container, fine tier at 1s and coarse tier at COARSE_RESOLUTION seconds
+# the coarse tier takes 42 bytes a slot (~60 KB at the default), the fine tier 18 bytes a
+# slot (~65 KB) and only exists for containers whose history was asked for
+METRICS_HISTORY_FINE_SLOTS = _env_int("METRICS_HISTORY_FINE_SLOTS", 3600)
+METRICS_HISTORY_COARSE_SLOTS = _env_int("METRICS_HISTORY_COARSE_SLOTS", 1440)
+METRICS_HISTORY_COARSE_RESOLUTION = _env_int("METRICS_HISTORY_COARSE_RESOLUTION", 60)
+# containers tracked at most, the least recently updated history is evicted past this;
+# ~60 MB of coarse tiers when full
+METRICS_HISTORY_MAX_CONTAINERS = _env_int("METRICS_HISTORY_MAX_CONTAINERS", 1000)
+
+# seconds to wait before resubscribing to docker events and resyncing the state index
+DOCKER_EVENTS_RECONNECT_DELAY = _env_float("DOCKER_EVENTS_RECONNECT_DELAY", 2.0)
+
+# thread pool for blocking docker sdk and compose calls, and how many calls may wait for it
+BLOCKING_POOL_SIZE = _env_int("BLOCKING_POOL_SIZE", 4)
+BLOCKING_MAX_PENDING = _env_int("BLOCKING_MAX_PENDING", 32)
+# event loop lag probe: seconds between samples, and lag in seconds that gets logged
+LOOP_LAG_INTERVAL = _env_float("LOOP_LAG_INTERVAL", 0.5)
+LOOP_LAG_WARNING = _env_float("LOOP_LAG_WARNING", 0.25)
+
+# background jobs: finished jobs kept for /api/jobs, and progress events kept per job
+JOB_HISTORY = _env_int("JOB_HISTORY", 50)
+JOB_MAX_EVENTS = _env_int("JOB_MAX_EVENTS", 500)
+
+# bulk actions: daemon calls in flight per request, and seconds allowed per object
+BULK_ACTION_CONCURRENCY = _env_int("BULK_ACTION_CONCURRENCY", 16)
+BULK_ACTION_TIMEOUT = _env_float("BULK_ACTION_TIMEOUT", 60.0)
+
+# calls that change docker state: at most SCHEDULER_CONCURRENCY run at once, background
+# ones (pulls, prunes, compose runs) at most SCHEDULER_BACKGROUND_CONCURRENCY of them, and
+# one client at most SCHEDULER_CLIENT_CONCURRENCY; requests get 429 once SCHEDULER_MAX_QUEUE
+# calls of their priority or higher are waiting
+SCHEDULER_CONCURRENCY = _env_int("SCHEDULER_CONCURRENCY", 16)
+SCHEDULER_BACKGROUND_CONCURRENCY = _env_int("SCHEDULER_BACKGROUND_CONCURRENCY", 4)
+SCHEDULER_CLIENT_CONCURRENCY = _env_int("SCHEDULER_CLIENT_CONCURRENCY", 8)
+SCHEDULER_MAX_QUEUE = _env_int("SCHEDULER_MAX_QUEUE", 64)
+# comma separated addresses or networks of reverse proxies whose X-Forwarded-For names the
+# client, e.g. "127.0.0.1,172.16.0.0/12"; the header of any other peer is ignored
+TRUSTED_PROXIES = os.environ.get("TRUSTED_PROXIES", "")
+
+# container inspect cache behind /api/containers/info
+INSPECT_CACHE_SIZE = _env_int("INSPECT_CACHE_SIZE", 512)
+INSPECT_CACHE_TTL = _env_float("INSPECT_CACHE_TTL", 10.0)
+
+# compose file index, the poll interval only applies when watchfiles is not installed
+COMPOSE_DIR = os.environ.get("COMPOSE_DIR", "./composefiles")
+COMPOSE_POLL_INTERVAL = _env_float("COMPOSE_POLL_INTERVAL", 2.0)
+
+# compose runs, per-project runs are serialized and at most this many projects run at once;
+# they have no timeout, a compose call on its thread cannot be stopped
+COMPOSE_CONCURRENCY = _env_int("COMPOSE_CONCURRENCY", 4)
+
+# container logs, lines buffered per container and how long a merge waits for quiet containers
+LOGS_DEFAULT_TAIL = _env_int("LOGS_DEFAULT_TAIL", 100)
+LOGS_MAX_TAIL = _env_int("LOGS_MAX_TAIL", 10000)
+LOGS_QUEUE_SIZE = _env_int("LOGS_QUEUE_SIZE", 256)
+LOGS_MERGE_WINDOW = _env_float("LOGS_MERGE_WINDOW", 0.25)
+
+# server messages, kept in a capped redis stream and written in batches
+MESSAGE_LOG_KEY = os.environ.get("MESSAGE_LOG_KEY", "server_messages:log")
+MESSAGE_LOG_MAXLEN = _env_int("MESSAGE_LOG_MAXLEN", 1000)
+MESSAGE_BATCH_WINDOW = _env_float("MESSAGE_BATCH_WINDOW", 0.05)
+
+# paged list endpoints and streams
+LIST_PAGE_SIZE = _env_int("LIST_PAGE_SIZE", 50)
+LIST_PAGE_MAX = _env_int("LIST_PAGE_MAX", 500)
+LIST_PAGE_CACHE = _env_int("LIST_PAGE_CACHE", 256)
+
+# logging: LOG_ASYNC writes from a background thread, LOG_FORMAT is text or json,
+# and at most LOG_RATE_LIMIT records per message template are written per LOG_RATE_WINDOW
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+LOG_ASYNC = os.environ.get("LOG_ASYNC", "1").lower() not in ("0", "false", "no")
+LOG_QUEUE_SIZE = _env_int("LOG_QUEUE_SIZE", 10000)
+LOG_RATE_LIMIT = _env_int("LOG_RATE_LIMIT", 20)
+LOG_RATE_WINDOW = _env_float("LOG_RATE_WINDOW", 10.0)
+
+# docker client: daemon address, connection pool size and seconds idle connections are kept
+# open; log follows and the events stream each hold a connection for as long as they run
+DOCKER_HOST = os.environ.get("DOCKER_HOST", "unix:///var/run/docker.sock")
+DOCKER_POOL_SIZE = _env_int("DOCKER_POOL_SIZE", 64)
+DOCKER_KEEPALIVE = _env_float("DOCKER_KEEPALIVE", 60.0)
+# seconds /api/ready waits for the daemon to answer
+DOCKER_PING_TIMEOUT = _env_float("DOCKER_PING_TIMEOUT", 2.0)
+
+# disk usage: seconds to wait after docker events before refreshing `system df` once,
+# and the age at which the prune plan refreshes before answering
+DISK_USAGE_REFRESH_DELAY = _env_float("DISK_USAGE_REFRESH_DELAY", 5.0)
+DISK_USAGE_MAX_AGE = _env_float("DISK_USAGE_MAX_AGE", 300.0)
+
+# volume and network lists: seconds to wait for a burst of events to settle before relisting,
+# and seconds between background `system df` runs for volume sizes
+INVENTORY_REFRESH_DELAY = _env_float("INVENTORY_REFRESH_DELAY", 0.5)
+VOLUME_SIZE_REFRESH_INTERVAL = _env_float("VOLUME_SIZE_REFRESH_INTERVAL", 300.0)
+
+# where containers_list, images_list and container_metrics come from: "redis" for the go
+# publisher through redis, "embedded" to produce them in this process without redis, in
+# which case the server messages are kept in memory; the interval applies to embedded only
+PUBLISHER = os.environ.get("DPANEL_PUBLISHER", "redis").lower()
+PUBLISH_INTERVAL = _env_float("PUBLISH_INTERVAL", 1.0)
+
+# several docker daemons as name=url pairs, e.g.
+# "local=unix:///var/run/docker.sock,edge=tcp://10.0.0.5:2375"; unset means DOCKER_HOST alone
+# the first host is the default for calls that name none, and the only one compose, prune,
+# volumes and networks work on; the lists and stats of every host are merged, tagged with
+# the host, by the embedded publisher, which multiple hosts therefore always use
+DOCKER_HOSTS = os.environ.get("DOCKER_HOSTS", "")
+# seconds one host's list calls may take per publish tick before it counts as unreachable
+DOCKER_HOST_TIMEOUT = _env_float("DOCKER_HOST_TIMEOUT", 5.0)
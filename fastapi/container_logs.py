@@ -0,0 +1,146 @@
+# container_logs streams container logs from the daemon with server-side filtering
+# every container is read into a small bounded queue, so a chatty container waits for a slow client
+# instead of buffering its output here, and several containers are merged in timestamp order
+
+import asyncio
+import re
+import time
+from typing import AsyncIterator, Callable, Dict, List, Optional, Pattern, Tuple
+from aiodocker.containers import DockerContainer
+from docker_utils import DockerManager
+from helpers import parse_interval
+import config
+
+_DONE = object()
+
+
+def parse_since(value: str) -> Optional[float]:
+    # "10m", "30s", "500ms" go back from now, a plain number is a unix timestamp
+    if not value:
+        return None
+    if re.fullmatch(r"\s*\d+(?:\.\d+)?\s*", value):
+        return float(value)
+    seconds = parse_interval(value, minimum=0, maximum=float("inf"))
+    if seconds is None:
+        raise ValueError(f"Invalid since: {value}")
+    return time.time() - seconds
+
+
+def parse_filter(q: str, regex: bool) -> Optional[Callable[[str], bool]]:
+    # raises re.error for an invalid pattern
+    if not q:
+        return None
+    if regex:
+        pattern: Pattern = re.compile(q)
+        return lambda line: pattern.search(line) is not None
+    return lambda line: q in line
+
+
+def sort_key(timestamp: str) -> Tuple[str, str]:
+    # RFC3339Nano drops trailing zeros of the fraction, pad it so lines compare as strings
+    seconds, _, fraction = timestamp.rstrip("Z").partition(".")
+    return seconds, fraction.ljust(9, "0")
+
+
+class LogReader:
+    def __init__(
+        self,
+        docker_manager: DockerManager,
+        tail: int = config.LOGS_DEFAULT_TAIL,
+        since: float = None,
+        follow: bool = False,
+        match: Callable[[str], bool] = None,
+        queue_size: int = config.LOGS_QUEUE_SIZE,
+        merge_window: float = config.LOGS_MERGE_WINDOW,
+    ):
+        self.docker_manager = docker_manager
+        self.tail = max(0, min(tail, config.LOGS_MAX_TAIL))
+        self.since = since
+        self.follow = follow
+        self.match = match
+        self.queue_size = queue_size
+        self.merge_window = merge_window
+
+    async def lines(self, container: DockerContainer) -> AsyncIterator[dict]:
+        # splits the daemon's output chunks into lines, a line may span several chunks
+        state = self.docker_manager.find_state(container.id)
+        name = state.name if state is not None else container.id[:12]
+
+        def parse(line: str) -> Optional[dict]:
+            timestamp, _, text = line.rstrip("\r").partition(" ")
+            if self.match is not None and not self.match(text):
+                return None
+            return {"id": container.id[:12], "name": name, "time": timestamp, "line": text}
+
+        pending = ""
+        async for chunk in self.docker_manager.container_logs(
+            container, follow=self.follow, tail=self.tail, since=self.since
+        ):
+            pending += chunk
+            *lines, pending = pending.split("\n")
+            for line in lines:
+                parsed = parse(line)
+                if parsed is not None:
+                    yield parsed
+        if pending:
+            parsed = parse(pending)
+            if parsed is not None:
+                yield parsed
+
+    async def merge(self, containers: List[DockerContainer]) -> AsyncIterator[dict]:
+        # k-way merge by timestamp; while following, a line is held back at most merge_window
+        # waiting for quieter containers, so one idle container never stalls the others
+        queues: Dict[str, asyncio.Queue] = {
+            c.id: asyncio.Queue(maxsize=self.queue_size) for c in containers
+        }
+        ready = asyncio.Event()
+
+        async def produce(container: DockerContainer):
+            queue = queues[container.id]
+            try:
+                async for line in self.lines(container):
+                    await queue.put(line)
+                    ready.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await queue.put({"id": container.id[:12], "error": str(e)})
+            await queue.put(_DONE)
+            ready.set()
+
+        producers = [asyncio.create_task(produce(c)) for c in containers]
+        # container id -> (line, time it was taken off the queue)
+        heads: Dict[str, Tuple[dict, float]] = {}
+        done = set()
+        try:
+            while True:
+                ready.clear()
+                for id, queue in queues.items():
+                    if id in heads or id in done or queue.empty():
+                        continue
+                    line = queue.get_nowait()
+                    if line is _DONE:
+                        done.add(id)
+                    elif "error" in line:
+                        yield line
+                    else:
+                        heads[id] = (line, time.monotonic())
+                waiting = len(queues) - len(heads) - len(done)
+                if not heads and not waiting:
+                    return
+                if waiting:
+                    timeout = None
+                    if heads and self.follow:
+                        oldest = min(taken for _, taken in heads.values())
+                        timeout = self.merge_window - (time.monotonic() - oldest)
+                    if timeout is None or timeout > 0:
+                        try:
+                            await asyncio.wait_for(ready.wait(), timeout)
+                            continue
+                        except asyncio.TimeoutError:
+                            pass
+                id = min(heads, key=lambda id: sort_key(heads[id][0]["time"]))
+                yield heads.pop(id)[0]
+        finally:
+            for task in producers:
+                task.cancel()
@@ -0,0 +1,245 @@
+# disk_usage caches the daemon's `system df` and custom network list to estimate what a
+# prune of each object type would reclaim, without a daemon round trip per prune dialog
+# docker events patch the cache right away (removed containers, state changes, deleted
+# images, volumes and networks) and schedule one debounced full refresh for what events
+# don't carry, like the sizes of new containers and images
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Set
+from helpers import convert_from_bytes
+from state_index import EVENT_STATUS, IMAGE_ACTIONS
+from logger import Logger
+import config
+
+PRUNE_TYPES = ("containers", "images", "volumes", "networks")
+# container states `docker container prune` removes
+PRUNABLE_STATES = {"created", "exited", "dead"}
+# volume prune only removes anonymous volumes by default since API 1.42
+ANONYMOUS_ONLY_API = (1, 42)
+ANONYMOUS_LABEL = "com.docker.volume.anonymous"
+
+
+def _api_version(version: str) -> tuple:
+    try:
+        return tuple(int(part) for part in version.split("."))
+    except (AttributeError, ValueError):
+        return (0,)
+
+
+class DiskUsage:
+    def __init__(
+        self,
+        fetch: Callable[[], Awaitable[dict]],
+        refresh_delay: float = config.DISK_USAGE_REFRESH_DELAY,
+        max_age: float = config.DISK_USAGE_MAX_AGE,
+    ):
+        # fetch returns {"df": ..., "networks": custom networks, "apiVersion": ...}
+        self.fetch = fetch
+        self.refresh_delay = refresh_delay
+        self.max_age = max_age
+        self.loaded = False
+        self.updated_at = 0.0
+        self.api_version = (0,)
+        # id -> {"State", "SizeRw", "ImageID", "volumes", "networks"}
+        self.containers: Dict[str, dict] = {}
+        # id -> {"Size", "SharedSize", "dangling"}
+        self.images: Dict[str, dict] = {}
+        # name -> {"Size", "anonymous"}
+        self.volumes: Dict[str, dict] = {}
+        # id -> name, custom networks only
+        self.networks: Dict[str, str] = {}
+        self.refreshes = 0
+        self._listeners: List[Callable[[], None]] = []
+        self._refreshing: asyncio.Task = None
+        self._scheduled: asyncio.Task = None
+        self.logger = Logger(__name__)
+
+    def add_listener(self, listener: Callable[[], None]):
+        # called after every full refresh
+        self._listeners.append(listener)
+
+    async def current(self) -> "DiskUsage":
+        # refreshes first if nothing was loaded yet or the data is older than max_age
+        if not self.loaded or time.time() - self.updated_at > self.max_age:
+            await self.refresh()
+        return self
+
+    async def refresh(self):
+        # one daemon round at a time, concurrent callers wait for the same one
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self._refresh())
+        await asyncio.shield(self._refreshing)
+
+    async def _refresh(self):
+        data = await self.fetch()
+        df = data["df"]
+        containers = {}
+        for c in df.get("Containers") or []:
+            networks = (c.get("NetworkSettings") or {}).get("Networks") or {}
+            containers[c["Id"]] = {
+                "State": c.get("State", ""),
+                "SizeRw": c.get("SizeRw") or 0,
+                "ImageID": c.get("ImageID", ""),
+                "volumes": {
+                    m["Name"]
+                    for m in c.get("Mounts") or []
+                    if m.get("Type") == "volume" and m.get("Name")
+                },
+                "networks": set(networks),
+            }
+        images = {}
+        for image in df.get("Images") or []:
+            tags = image.get("RepoTags") or []
+            images[image["Id"]] = {
+                "Size": image.get("Size") or 0,
+                # -1 when the daemon did not compute it
+                "SharedSize": max(image.get("SharedSize") or 0, 0),
+                "dangling": not tags or tags == ["<none>:<none>"],
+            }
+        volumes = {}
+        for volume in df.get("Volumes") or []:
+            usage = volume.get("UsageData") or {}
+            volumes[volume["Name"]] = {
+                "Size": max(usage.get("Size") or 0, 0),
+                "anonymous": ANONYMOUS_LABEL in (volume.get("Labels") or {}),
+            }
+        self.containers = containers
+        self.images = images
+        self.volumes = volumes
+        self.networks = {n["Id"]: n["Name"] for n in data.get("networks") or []}
+        self.api_version = _api_version(data.get("apiVersion"))
+        self.updated_at = time.time()
+        self.loaded = True
+        self.refreshes += 1
+        for listener in self._listeners:
+            try:
+                listener()
+            except Exception as e:
+                self.logger.error("Disk usage listener failed: %s", e)
+
+    def refresh_soon(self):
+        # debounced: a burst of events costs one system df
+        if not self.loaded:
+            return
+        if self._scheduled is None or self._scheduled.done():
+            self._scheduled = asyncio.create_task(self._refresh_later())
+
+    async def _refresh_later(self):
+        await asyncio.sleep(self.refresh_delay)
+        try:
+            await self.refresh()
+        except Exception as e:
+            self.logger.error("Failed to refresh disk usage: %s", e)
+
+    def on_event(self, event: dict):
+        # state index listener
+        if not self.loaded:
+            return
+        type = event.get("Type")
+        action = event.get("Action", "")
+        actor = event.get("Actor", {})
+        id = actor.get("ID", "")
+        if type == "resync":
+            self.refresh_soon()
+        elif type == "container":
+            if action == "destroy":
+                self.containers.pop(id, None)
+            elif action == "create":
+                # size and mounts are unknown until the next df
+                self.containers[id] = {
+                    "State": "created",
+                    "SizeRw": 0,
+                    "ImageID": "",
+                    "volumes": set(),
+                    "networks": set(),
+                }
+                self.refresh_soon()
+            elif action in EVENT_STATUS and id in self.containers:
+                self.containers[id]["State"] = EVENT_STATUS[action]
+        elif type == "image":
+            if action == "delete":
+                self.images.pop(id, None)
+            elif action in IMAGE_ACTIONS:
+                self.refresh_soon()
+        elif type == "volume":
+            if action == "destroy":
+                self.volumes.pop(id, None)
+            elif action == "create":
+                self.refresh_soon()
+        elif type == "network":
+            if action == "destroy":
+                self.networks.pop(id, None)
+            elif action in ("create", "connect", "disconnect"):
+                self.refresh_soon()
+
+    def plan(self, objects: List[str]) -> dict:
+        # what pruning `objects` would remove and reclaim; containers are pruned first,
+        # so images, volumes and networks only they use count as reclaimable too
+        removed: Set[str] = set()
+        if "containers" in objects:
+            removed = {
+                id for id, c in self.containers.items() if c["State"] in PRUNABLE_STATES
+            }
+        remaining = [c for id, c in self.containers.items() if id not in removed]
+        used_images = {c["ImageID"] for c in remaining}
+        used_volumes = set().union(*(c["volumes"] for c in remaining))
+        used_networks = set().union(*(c["networks"] for c in remaining))
+
+        estimates = {}
+        if "containers" in objects:
+            estimates["containers"] = (
+                len(removed),
+                sum(self.containers[id]["SizeRw"] for id in removed),
+            )
+        if "images" in objects:
+            # prune removes dangling images no container uses
+            images = [
+                image
+                for id, image in self.images.items()
+                if image["dangling"] and id not in used_images
+            ]
+            estimates["images"] = (
+                len(images),
+                sum(max(i["Size"] - i["SharedSize"], 0) for i in images),
+            )
+        if "volumes" in objects:
+            anonymous_only = self.api_version >= ANONYMOUS_ONLY_API
+            volumes = [
+                volume
+                for name, volume in self.volumes.items()
+                if name not in used_volumes
+                and (volume["anonymous"] or not anonymous_only)
+            ]
+            estimates["volumes"] = (len(volumes), sum(v["Size"] for v in volumes))
+        if "networks" in objects:
+            networks = [n for n in self.networks.values() if n not in used_networks]
+            estimates["networks"] = (len(networks), 0)
+
+        total = sum(reclaimable for _, reclaimable in estimates.values())
+        return {
+            "objects": {
+                object_type: {
+                    "count": count,
+                    "reclaimable": reclaimable,
+                    "reclaimableHuman": convert_from_bytes(reclaimable),
+                }
+                for object_type, (count, reclaimable) in estimates.items()
+            },
+            "reclaimable": total,
+            "reclaimableHuman": convert_from_bytes(total),
+            "updatedAt": self.updated_at,
+            # a refresh is due, sizes of objects created since may be missing
+            "refreshPending": bool(self._scheduled and not self._scheduled.done()),
+        }
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "updatedAt": self.updated_at,
+            "refreshes": self.refreshes,
+            "containers": len(self.containers),
+            "images": len(self.images),
+            "volumes": len(self.volumes),
+            "networks": len(self.networks),
+        }
@@ -1,126 +1,362 @@
-# docker_utils holds async and sync clients as well as all actions being preformed
-# TODO: add python on whales
+# docker_utils holds the docker client as well as all actions being preformed
+# one aiodocker client with a pooled keep-alive connector talks to the daemon; it is created
+# in the startup hook, so importing the app neither opens a session nor needs the socket
+# with DOCKER_HOSTS set there is one such client and state index per named daemon, and
+# DockerManager routes every call to the host that owns the container or was asked for
 
+import asyncio
+import time
+import aiohttp
 import aiodocker
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from aiodocker.exceptions import DockerError
-import docker
 from aiodocker.docker import DockerContainer
+from aiodocker.networks import DockerNetwork
+from aiodocker.volumes import DockerVolume
 from logger import Logger
+from state_index import ContainerState, StateIndex
+from blocking import BlockingExecutor
+import config
 
 
-class DockerManager:
-    def __init__(self):
-        self.async_client = aiodocker.Docker()
-        self.sync_client = docker.from_env()
-        self.images_interface = aiodocker.docker.DockerImages(self.async_client)
+def parse_hosts(value: str) -> Dict[str, str]:
+    # "local=unix:///var/run/docker.sock,edge=tcp://10.0.0.5:2375" -> {name: url}, in order;
+    # empty means the one daemon of DOCKER_HOST, named "local"
+    hosts = {}
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        name, _, url = (part.strip() for part in entry.partition("="))
+        if not name or not url:
+            raise ValueError(f"Docker hosts are name=url pairs, got: {entry.strip()}")
+        hosts[name] = url
+    return hosts or {"local": config.DOCKER_HOST}
+
+
+def docker_client(
+    host: str = config.DOCKER_HOST, pool_size: int = config.DOCKER_POOL_SIZE
+) -> aiodocker.Docker:
+    # pool_size 0 is unlimited, for a client that holds one stream per container
+    if host.startswith("unix://"):
+        # aiodocker's own unix connector uses aiohttp's defaults (100 connections,
+        # 15s keep-alive); a passed connector needs a dummy host for building urls
+        connector = aiohttp.UnixConnector(
+            host[len("unix://") :],
+            limit=pool_size,
+            keepalive_timeout=config.DOCKER_KEEPALIVE,
+        )
+        return aiodocker.Docker(url="unix://localhost", connector=connector)
+    # tcp and npipe hosts, including DOCKER_TLS_VERIFY, are set up by aiodocker
+    return aiodocker.Docker(url=host)
+
+
+async def query_json(
+    client: aiodocker.Docker, path: str, method: str = "GET", params: dict = None
+):
+    # raw daemon json for endpoints aiodocker has no public call for (system df, prune)
+    # or wraps in objects (containers/json); _query_json is private, so it is only
+    # used here and aiodocker is pinned in requirements.txt
+    return await client._query_json(path, method=method, params=params)
+
+
+class InvalidConfig(ValueError):
+    # a run form container_config cannot translate, answered with 400
+    pass
+
+
+def split_image(image: str) -> Tuple[str, Optional[str]]:
+    # "registry:5000/web:1.2" -> ("registry:5000/web", "1.2"), a colon before the last
+    # slash is a registry port; digests and untagged names have no tag
+    if "@" in image:
+        return image, None
+    repo, colon, tag = image.rpartition(":")
+    if not colon or "/" in tag:
+        return image, None
+    return repo, tag
+
+
+def _port_key(port) -> str:
+    # 80 and "80" are "80/tcp", as in docker-py
+    port = str(port)
+    return port if "/" in port else f"{port}/tcp"
+
+
+def _port_binding(host) -> dict:
+    # docker-py's host side of a port: None (a random port), a port, (ip, port) or (ip,)
+    if host is None:
+        return {}
+    if isinstance(host, (list, tuple)):
+        if not 1 <= len(host) <= 2:
+            raise InvalidConfig(f"Invalid port binding: {host}")
+        binding = {"HostIp": str(host[0])}
+        if len(host) == 2 and host[1] is not None:
+            binding["HostPort"] = str(host[1])
+        return binding
+    return {"HostPort": str(host)}
+
+
+def _port_bindings(host) -> List[dict]:
+    # a list publishes the container port on every host port in it
+    if isinstance(host, list):
+        return [_port_binding(h) for h in host]
+    return [_port_binding(host)]
+
+
+def _bind(name: str, volume) -> str:
+    if not isinstance(volume, dict) or "bind" not in volume:
+        raise InvalidConfig(f"Invalid volume for {name}: {volume}")
+    return f"{name}:{volume['bind']}:{volume.get('mode', 'rw')}"
+
+
+def container_config(config: dict) -> dict:
+    # translates the run form (docker sdk style arguments) into a create request body,
+    # raises InvalidConfig for what docker-py's containers.run would not accept either
+    # ports: {"80/tcp": 8080, 443: ("127.0.0.1", 8443), "53/udp": [53, 5353], "22": None}
+    # volumes: {"name": {"bind": "/data", "mode": "rw"}} or ["name:/data:ro", "/src:/dst"]
+    # environment: ["KEY=value"] or {"KEY": "value"}
+    if not isinstance(config, dict) or not config.get("image"):
+        raise InvalidConfig("A container config needs an image")
+    ports = config.get("ports") or {}
+    if not isinstance(ports, dict):
+        raise InvalidConfig("ports must map container ports to host ports")
+    ports = {_port_key(port): host for port, host in ports.items()}
+    volumes = config.get("volumes") or {}
+    if isinstance(volumes, dict):
+        binds = [_bind(name, volume) for name, volume in volumes.items()]
+    elif isinstance(volumes, list) and all(isinstance(v, str) for v in volumes):
+        # docker-py passes the list form through as binds
+        binds = list(volumes)
+    else:
+        raise InvalidConfig("volumes must be a mapping or a list of binds")
+    environment = config.get("environment") or []
+    if isinstance(environment, dict):
+        environment = [f"{key}={value}" for key, value in environment.items()]
+    return {
+        "Image": config["image"],
+        "Env": environment,
+        "ExposedPorts": {port: {} for port in ports},
+        "HostConfig": {
+            "PortBindings": {
+                port: _port_bindings(host) for port, host in ports.items()
+            },
+            "Binds": binds,
+        },
+    }
+
+
+class DockerHost:
+    # one docker daemon: its client, its container states and the actions run against it
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = url
+        self.async_client: aiodocker.Docker = None
+        # container states kept current by docker events, replaces inspecting before every action
+        self.state_index = StateIndex()
         self.logger = Logger(__name__)
 
-    async def get_container_details(self, container: DockerContainer):
-        return await container.show()
+    async def start(self):
+        # a missing socket is not fatal here, the state index keeps retrying
+        # and /api/ready reports the daemon unreachable until it answers
+        self.async_client = docker_client(self.url)
+        self.state_index.client = self.async_client
+        await self.state_index.start()
+
+    async def close(self):
+        await self.state_index.close()
+        if self.async_client is not None:
+            await self.async_client.close()
+
+    async def ping(self) -> dict:
+        # daemon version, raises DockerError, OSError or TimeoutError when unreachable
+        if self.async_client is None:
+            raise ConnectionError("Docker client not started")
+        return await asyncio.wait_for(
+            self.async_client.version(), config.DOCKER_PING_TIMEOUT
+        )
+
+    async def get_container(self, id: str) -> DockerContainer:
+        # builds the container handle from the index without a round-trip to the daemon
+        state = self.state_index.get(id)
+        if state is None:
+            # unknown to the index, let the daemon resolve it (raises DockerError if missing)
+            return await self.async_client.containers.get(id)
+        return self.async_client.containers.container(state.id)
+
+    async def inspect_container(self, id: str) -> dict:
+        # same document as the sync client's container.attrs
+        return await self.async_client.containers.container(id).show()
+
+    async def container_logs(
+        self,
+        container: DockerContainer,
+        follow: bool = False,
+        tail: int = 100,
+        since: float = None,
+    ) -> AsyncIterator[str]:
+        # raw output chunks of stdout and stderr, every line prefixed with its timestamp
+        kwargs = {"stdout": True, "stderr": True, "timestamps": True, "tail": tail}
+        if since is not None:
+            kwargs["since"] = since
+        if follow:
+            async for chunk in container.log(follow=True, **kwargs):
+                yield chunk
+        else:
+            for chunk in await container.log(**kwargs):
+                yield chunk
+
+    async def get_container_state(self, container: DockerContainer) -> ContainerState:
+        state = self.state_index.get(container.id)
+        if state is None:
+            # not indexed yet, inspect once and remember the result
+            state = self.state_index.upsert_from_inspect(await container.show())
+        return state
 
     async def run_container(self, config):
-        # attempt to create and run a container based on the config
+        # attempt to create and run a container based on the config,
+        # pulling the image first if the daemon does not have it
+        body = container_config(config)
+        name = config.get("containerName")
+        containers = self.async_client.containers
         try:
-            # self.logger.info(f"Attempting to create and run new container")
-            container = self.sync_client.containers.run(
-                image=config["image"],
-                name=config.get("containerName"),
-                volumes=config.get("volumes"),
-                ports=config.get("ports"),
-                environment=config.get("environment"),
-                detach=True,
-            )
-            # self.logger.info(f"Created and ran new container: {container}")
+            try:
+                container = await containers.create(body, name=name)
+            except DockerError as e:
+                if e.status != 404:
+                    raise
+                # an untagged image is pulled as latest, not with every tag it has
+                repo, tag = split_image(body["Image"])
+                if tag is None and "@" not in repo:
+                    tag = "latest"
+                await self.async_client.images.pull(repo, tag=tag)
+                container = await containers.create(body, name=name)
+            await container.start()
         except DockerError as e:
             return {"type": "error", "statusCode": e.status, "message": e.message}
         return {"type": "success", "objectId": container.id}
 
+    async def disk_usage(self) -> dict:
+        # system df with container, image and volume sizes, which the daemon has to compute,
+        # plus the custom networks df leaves out
+        df, networks, version = await asyncio.gather(
+            query_json(self.async_client, "system/df"),
+            self.async_client.networks.list(filters={"type": "custom"}),
+            self.async_client.version(),
+        )
+        return {"df": df, "networks": networks, "apiVersion": version.get("ApiVersion")}
+
+    async def inventory(self) -> dict:
+        # volumes, networks and the containers using them, none of it computes sizes
+        volumes, networks, containers = await asyncio.gather(
+            self.async_client.volumes.list(),
+            self.async_client.networks.list(),
+            query_json(self.async_client, "containers/json", params={"all": "1"}),
+        )
+        return {
+            "volumes": volumes.get("Volumes") or [],
+            "networks": networks,
+            "containers": containers,
+        }
+
+    async def delete_volume(self, name: str):
+        # fails with 409 while a container uses the volume
+        try:
+            await DockerVolume(self.async_client, name).delete()
+        except DockerError as e:
+            return {"type": "error", "statusCode": e.status, "message": e.message}
+        return {"type": "success", "objectId": name}
+
+    async def delete_network(self, id: str):
+        # fails with 403 for the builtin networks and while containers are attached
+        try:
+            await DockerNetwork(self.async_client, id).delete()
+        except DockerError as e:
+            return {"type": "error", "statusCode": e.status, "message": e.message}
+        return {"type": "success", "objectId": id}
+
+    async def prune(self, object_type: str) -> dict:
+        # object_type is containers, images, volumes or networks; returns the daemon's report,
+        # e.g. {"ContainersDeleted": [...], "SpaceReclaimed": 0}
+        path = f"{object_type}/prune"
+        return await query_json(self.async_client, path, method="POST")
+
     async def pause_container(self, container: DockerContainer):
-        container_details = await self.get_container_details(container)
-        if container_details["State"]["Running"]:
+        state = await self.get_container_state(container)
+        if state.running and not state.paused:
             await container.pause()
-            return {"type": "success", "objectId": container_details["Id"]}
+            self.state_index.set_status(state.id, "paused")
+            return {"type": "success", "objectId": state.id}
         # already paused
-        return {"type": "error", "objectId": container_details["Id"]}
+        return {"type": "error", "objectId": state.id}
 
     async def resume_container(self, container: DockerContainer):
-        container_details = await self.get_container_details(container)
-        if container_details["State"]["Paused"]:
+        state = await self.get_container_state(container)
+        if state.paused:
             await container.unpause()
-            return {"type": "success", "objectId": container_details["Id"]}
+            self.state_index.set_status(state.id, "running")
+            return {"type": "success", "objectId": state.id}
         # already in a running state
-        return {"type": "error", "objectId": container_details["Id"]}
+        return {"type": "error", "objectId": state.id}
 
     async def start_container(self, container: DockerContainer):
-        container_details = await self.get_container_details(container)
-        if container_details["State"]["Status"] == "exited":
+        state = await self.get_container_state(container)
+        if state.status == "exited":
             await container.start()
-            return {"type": "success", "objectId": container.id}
+            self.state_index.set_status(state.id, "running")
+            return {"type": "success", "objectId": state.id}
         # already in a running state
-        return {"type": "error", "objectId": container.id}
+        return {"type": "error", "objectId": state.id}
 
     async def stop_container(self, container: DockerContainer):
-        container_details = await self.get_container_details(container)
-        if (
-            container_details["State"]["Running"]
-            or container_details["State"]["Paused"]
-        ):
+        state = await self.get_container_state(container)
+        if state.running or state.paused:
             await container.stop()
-            return {"type": "success", "objectId": container_details["Id"]}
+            self.state_index.set_status(state.id, "exited")
+            return {"type": "success", "objectId": state.id}
         # already exited
-        return {"type": "error", "objectId": container_details["Id"]}
+        return {"type": "error", "objectId": state.id}
 
     async def restart_container(self, container: DockerContainer):
         # The container must be in started state. This means that the container must be up and running for at least 10 seconds. This shall prevent docker from restarting the container unnecessarily in case it has not even started successfully.
-        container_details = await self.get_container_details(container)
-        if (
-            container_details["State"]["Running"]
-            or container_details["State"]["Paused"]
-        ):
+        state = await self.get_container_state(container)
+        if state.running or state.paused:
             await container.restart()
-            return {"type": "success", "objectId": container_details["Id"]}
+            self.state_index.set_status(state.id, "running")
+            return {"type": "success", "objectId": state.id}
         # not running or paused to restart
-        return {"type": "error", "objectId": container_details["Id"]}
+        return {"type": "error", "objectId": state.id}
 
     async def kill_container(self, container: DockerContainer):
         # container must be paused or running to be killed
-        container_details = await self.get_container_details(container)
-        if (
-            container_details["State"]["Running"]
-            or container_details["State"]["Paused"]
-        ):
+        state = await self.get_container_state(container)
+        if state.running or state.paused:
             await container.kill()
-            return {"type": "success", "objectId": container_details["Id"]}
+            self.state_index.set_status(state.id, "exited")
+            return {"type": "success", "objectId": state.id}
         # not running or paused to be killed
-        return {"type": "error", "objectId": container_details["Id"]}
+        return {"type": "error", "objectId": state.id}
 
     async def delete_container(self, container: DockerContainer):
         # delete shouldn't go off of status because it wouldn't exist!
+        state = await self.get_container_state(container)
         try:
             # self.logger.info(f"Attempting to delete container: {container}")
             # stop running container before deletion
-            container_details = await self.get_container_details(container)
-            if (
-                container_details["State"]["Running"]
-                or container_details["State"]["Paused"]
-            ):
-                if container_details["State"]["Status"] != "exited":
-                    self.logger.info(
-                        f"Attempting to stop running container: {container}"
-                    )
+            if state.running or state.paused:
+                if state.status != "exited":
+                    self.logger.info("Attempting to stop running container: %s", container)
                     await container.stop()
-                    self.logger.info(f"Stopped running container: {container}")
+                    self.logger.info("Stopped running container: %s", container)
             await container.delete()
             # self.logger.info(f"Deleted container: {container}")
         except DockerError as e:
             # already deleted
-            return {"type": "error", "objectId": container_details["Id"]}
-        return {"type": "success", "objectId": container_details["Id"]}
+            return {"type": "error", "objectId": state.id}
+        return {"type": "success", "objectId": state.id}
 
     async def delete_image(self, id: str):
         # delete any images forcefully
         try:
-            await self.images_interface.delete(name=id)
+            await self.async_client.images.delete(name=id)
         except DockerError as e:
             # already deleted
             return {"type": "error", "objectId": id}
@@ -131,8 +367,178 @@ class DockerManager:
         try:
             # if tag is an empty string, use latest
             tag = tag if tag else "latest"
-            res = await self.images_interface.pull(from_image=from_image, tag=tag)
+            res = await self.async_client.images.pull(from_image=from_image, tag=tag)
             # self.logger.info(res)
         except DockerError as e:
             return {"type": "error", "statusCode": e.status, "message": e.message}
         return {"type": "success", "message": res[-1]}
+
+    async def pull_image_stream(self, from_image: str, tag: str):
+        # yields the daemon's progress messages while pulling, per layer
+        tag = tag if tag else "latest"
+        async for progress in self.async_client.images.pull(
+            from_image=from_image, tag=tag, stream=True
+        ):
+            if "error" in progress:
+                # the daemon reports failures inside the stream with a 200 response
+                raise DockerError(500, {"message": progress["error"]})
+            yield progress
+
+
+class DockerManager:
+    def __init__(self, hosts: Dict[str, str] = None):
+        # name -> host, the first one is the default for calls that name no host
+        hosts = hosts or parse_hosts(config.DOCKER_HOSTS)
+        self.hosts = {name: DockerHost(name, url) for name, url in hosts.items()}
+        self.default = next(iter(self.hosts.values()))
+        # pool for compose calls, keeps them off the event loop
+        self.blocking = BlockingExecutor()
+        self.logger = Logger(__name__)
+
+    # the default host's, for what only follows one daemon (compose, disk usage, inventory)
+    @property
+    def async_client(self) -> aiodocker.Docker:
+        return self.default.async_client
+
+    @property
+    def state_index(self) -> StateIndex:
+        return self.default.state_index
+
+    async def start(self):
+        await asyncio.gather(*(host.start() for host in self.hosts.values()))
+
+    async def close(self):
+        await asyncio.gather(*(host.close() for host in self.hosts.values()))
+        self.blocking.shutdown()
+
+    def add_listener(self, listener):
+        # docker events of every host, for caches keyed by container id
+        for host in self.hosts.values():
+            host.state_index.add_listener(listener)
+
+    def host(self, name: str = None) -> DockerHost:
+        # raises KeyError for a name that is not configured
+        return self.hosts[name] if name else self.default
+
+    def host_of(self, id: str) -> DockerHost:
+        # the host whose index has the container, exact ids first since names and short ids
+        # may repeat across hosts; the default host lets the daemon resolve unknown ids
+        for host in self.hosts.values():
+            if id in host.state_index.containers:
+                return host
+        for host in self.hosts.values():
+            if host.state_index.get(id) is not None:
+                return host
+        return self.default
+
+    def find_state(self, id: str) -> Optional[ContainerState]:
+        # full ids only, cheap enough to run per row of the container list
+        for host in self.hosts.values():
+            state = host.state_index.containers.get(id)
+            if state is not None:
+                return state
+        return None
+
+    def _owner(self, container: DockerContainer) -> DockerHost:
+        # container handles carry the client they were built on
+        for host in self.hosts.values():
+            if container.docker is host.async_client:
+                return host
+        return self.default
+
+    async def ping(self) -> dict:
+        return await self.default.ping()
+
+    async def ping_hosts(self) -> List[dict]:
+        # every host at once, a slow or unreachable one costs at most DOCKER_PING_TIMEOUT
+        async def status(host: DockerHost) -> dict:
+            started = time.perf_counter()
+            try:
+                version = await host.ping()
+            except (
+                DockerError,
+                OSError,
+                aiohttp.ClientError,
+                asyncio.TimeoutError,
+            ) as e:
+                return {"name": host.name, "reachable": False, "error": repr(e)}
+            return {
+                "name": host.name,
+                "reachable": True,
+                "indexed": host.state_index.ready,
+                "containers": len(host.state_index.containers),
+                "apiVersion": version.get("ApiVersion"),
+                "latencyMs": round((time.perf_counter() - started) * 1000, 2),
+            }
+
+        return await asyncio.gather(*(status(host) for host in self.hosts.values()))
+
+    async def get_container(self, id: str, host: str = None) -> DockerContainer:
+        owner = self.host(host) if host else self.host_of(id)
+        return await owner.get_container(id)
+
+    async def inspect_container(self, id: str) -> dict:
+        return await self.host_of(id).inspect_container(id)
+
+    async def container_logs(
+        self,
+        container: DockerContainer,
+        follow: bool = False,
+        tail: int = 100,
+        since: float = None,
+    ) -> AsyncIterator[str]:
+        owner = self._owner(container)
+        async for chunk in owner.container_logs(container, follow, tail, since):
+            yield chunk
+
+    async def get_container_state(self, container: DockerContainer) -> ContainerState:
+        return await self._owner(container).get_container_state(container)
+
+    async def run_container(self, config, host: str = None):
+        return await self.host(host).run_container(config)
+
+    async def disk_usage(self) -> dict:
+        return await self.default.disk_usage()
+
+    async def inventory(self) -> dict:
+        return await self.default.inventory()
+
+    async def delete_volume(self, name: str, host: str = None):
+        return await self.host(host).delete_volume(name)
+
+    async def delete_network(self, id: str, host: str = None):
+        return await self.host(host).delete_network(id)
+
+    async def prune(self, object_type: str, host: str = None) -> dict:
+        return await self.host(host).prune(object_type)
+
+    async def pause_container(self, container: DockerContainer):
+        return await self._owner(container).pause_container(container)
+
+    async def resume_container(self, container: DockerContainer):
+        return await self._owner(container).resume_container(container)
+
+    async def start_container(self, container: DockerContainer):
+        return await self._owner(container).start_container(container)
+
+    async def stop_container(self, container: DockerContainer):
+        return await self._owner(container).stop_container(container)
+
+    async def restart_container(self, container: DockerContainer):
+        return await self._owner(container).restart_container(container)
+
+    async def kill_container(self, container: DockerContainer):
+        return await self._owner(container).kill_container(container)
+
+    async def delete_container(self, container: DockerContainer):
+        return await self._owner(container).delete_container(container)
+
+    async def delete_image(self, id: str, host: str = None):
+        return await self.host(host).delete_image(id)
+
+    async def pull_image(self, from_image: str, tag: str, host: str = None):
+        return await self.host(host).pull_image(from_image, tag)
+
+    async def pull_image_stream(self, from_image: str, tag: str, host: str = None):
+        async for progress in self.host(host).pull_image_stream(from_image, tag):
+            yield progress
@@ -0,0 +1,219 @@
+# embedded_publisher produces containers_list, images_list and container_metrics in this
+# process, for single-node installs that run without redis and the go publisher
+# one container list per tick feeds both lists and the set of stats streams, the streams
+# live on their own unpooled client so a stream per running container never starves the
+# pool of the request handlers; frames go straight to the hub's subscribers
+# every docker host has its own loop, rows and stats are tagged with the host, and the
+# lists are merged from each host's latest rows, so a slow host only delays its own rows
+
+import asyncio
+import json
+from typing import Dict, List, Set
+import aiodocker
+from docker_utils import DockerHost, DockerManager, docker_client, query_json
+from instrumentation import HUB_FANOUT
+from stream_hub import StreamHub
+from logger import Logger
+import config
+
+# container states the daemon reports stats for, the others get one zeroed frame
+STREAMED_STATES = {"running", "paused"}
+
+
+def _dumps(value) -> str:
+    # compact like the go publisher's json.Marshal
+    return json.dumps(value, separators=(",", ":"))
+
+
+def container_list(containers: list, host: str) -> List[dict]:
+    return [
+        {
+            "ID": c["Id"],
+            "Image": c.get("Image", ""),
+            "Status": c.get("Status", ""),
+            "State": c.get("State", ""),
+            "Names": c.get("Names") or [],
+            "Ports": c.get("Ports") or [],
+            "Host": host,
+        }
+        for c in containers
+    ]
+
+
+def image_list(images: list, containers: list, host: str) -> List[dict]:
+    used: Dict[str, int] = {}
+    for c in containers:
+        used[c.get("ImageID", "")] = used.get(c.get("ImageID", ""), 0) + 1
+    result = []
+    for image in images:
+        tags = image.get("RepoTags") or []
+        name = tags[0] if tags else "none"
+        split = name.split(":")
+        result.append(
+            {
+                "ID": image["Id"].split(":")[-1],
+                "Name": name,
+                "Tag": split[1] if tags and len(split) >= 2 else "none",
+                "Created": image.get("Created", 0),
+                "Size": image.get("Size", 0),
+                # a uint8 on the go side
+                "NumContainers": min(used.get(image["Id"], 0), 255),
+                "Host": host,
+            }
+        )
+    return result
+
+
+def container_stats(stats: dict, host: str) -> str:
+    # cpu as the share of the host's cpu time since the daemon started, like the go publisher
+    cpu = stats.get("cpu_stats") or {}
+    total = (cpu.get("cpu_usage") or {}).get("total_usage") or 0
+    system = cpu.get("system_cpu_usage") or 0
+    memory = stats.get("memory_stats") or {}
+    usage = memory.get("usage") or 0
+    limit = memory.get("limit") or 0
+    return _dumps(
+        {
+            "ID": stats.get("id", ""),
+            "Name": stats.get("name", ""),
+            "CpuPercent": total / system * 100 if total and system else 0.0,
+            "MemoryUsage": usage,
+            "MemoryLimit": limit,
+            "MemoryPercent": usage / limit * 100 if usage and limit else 0.0,
+            "Host": host,
+        }
+    )
+
+
+class EmbeddedPublisher:
+    def __init__(
+        self,
+        docker_manager: DockerManager,
+        hub: StreamHub,
+        interval: float = config.PUBLISH_INTERVAL,
+        timeout: float = config.DOCKER_HOST_TIMEOUT,
+    ):
+        self.docker_manager = docker_manager
+        self.hub = hub
+        self.interval = interval
+        self.timeout = timeout
+        # host -> client of its stats streams
+        self.stats_clients: Dict[str, aiodocker.Docker] = {}
+        self._tasks: List[asyncio.Task] = []
+        # id -> stats stream of a running container, ids are unique across hosts
+        self._streams: Dict[str, asyncio.Task] = {}
+        # host -> id -> state at the host's last tick
+        self._states: Dict[str, Dict[str, str]] = {}
+        # list channel -> host -> the host's rows as json without the brackets
+        self._parts: Dict[str, Dict[str, str]] = {
+            "containers_list": {},
+            "images_list": {},
+        }
+        self._frames: Dict[str, str] = {}
+        # hosts whose last tick failed, so the failure is logged once
+        self.failing: Set[str] = set()
+        self.logger = Logger(__name__)
+        for chan in ("containers_list", "images_list", "container_metrics"):
+            hub.add_local_channel(chan)
+
+    async def start(self):
+        for host in self.docker_manager.hosts.values():
+            self.stats_clients[host.name] = docker_client(host.url, pool_size=0)
+            self._tasks.append(asyncio.create_task(self._run(host)))
+
+    async def close(self):
+        tasks = self._tasks + list(self._streams.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._streams.clear()
+        await asyncio.gather(*(c.close() for c in self.stats_clients.values()))
+
+    async def _run(self, host: DockerHost):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            try:
+                await self.tick(host)
+                self.failing.discard(host.name)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if host.name not in self.failing:
+                    self.failing.add(host.name)
+                    self.logger.error("Failed to list %s: %r", host.name, e)
+                # its containers leave the lists until the host answers again
+                self._update(host.name, [], [])
+            await asyncio.sleep(max(self.interval - (loop.time() - started), 0))
+
+    async def tick(self, host: DockerHost):
+        containers, images = await asyncio.wait_for(self._list(host), self.timeout)
+        self._update(host.name, containers, images)
+
+    async def _list(self, host: DockerHost):
+        # awaited in a coroutine, a gather cancelled by wait_for is never left unretrieved
+        client = host.async_client
+        return await asyncio.gather(
+            query_json(client, "containers/json", params={"all": "1"}),
+            client.images.list(all="1"),
+        )
+
+    def _update(self, host: str, containers: list, images: list):
+        self._merge("containers_list", host, container_list(containers, host))
+        self._merge("images_list", host, image_list(images, containers, host))
+        self._update_streams(host, containers)
+
+    def _merge(self, chan: str, host: str, rows: List[dict]):
+        parts = self._parts[chan]
+        parts[host] = _dumps(rows)[1:-1]
+        merged = ",".join(
+            parts[name] for name in self.docker_manager.hosts if parts.get(name)
+        )
+        frame = f"[{merged}]"
+        # unchanged lists are not sent again, the hub still has them for new clients
+        if frame != self._frames.get(chan):
+            self._frames[chan] = frame
+            self._publish(chan, frame)
+
+    def _publish(self, chan: str, frame: str):
+        with HUB_FANOUT.time(chan):
+            self.hub.publish_local(chan, frame)
+
+    def _update_streams(self, host: str, containers: list):
+        current = {}
+        previous = self._states.get(host, {})
+        for c in containers:
+            id, state = c["Id"], c.get("State", "")
+            current[id] = state
+            stream = self._streams.get(id)
+            if state in STREAMED_STATES:
+                # also restarts streams that ended, e.g. on the session's timeout
+                if stream is None or stream.done():
+                    task = asyncio.create_task(self._stream_stats(host, id))
+                    self._streams[id] = task
+            elif stream is not None or previous.get(id) != state:
+                if stream is not None:
+                    self._streams.pop(id).cancel()
+                # the daemon reports zeros for stopped containers, send them once
+                name = (c.get("Names") or [""])[0]
+                zeros = container_stats({"id": id, "name": name}, host)
+                self._publish("container_metrics", zeros)
+        for id in previous.keys() - current.keys():
+            stream = self._streams.pop(id, None)
+            if stream is not None:
+                stream.cancel()
+            # removes the container's row from the metrics page and the hub's cache
+            deleted = {"ID": id, "Message": "deleted", "Host": host}
+            self._publish("container_metrics", _dumps(deleted))
+        self._states[host] = current
+
+    async def _stream_stats(self, host: str, id: str):
+        container = self.stats_clients[host].containers.container(id)
+        try:
+            async for stats in container.stats(stream=True):
+                self._publish("container_metrics", container_stats(stats, host))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # restarted on the next tick if the container is still running
+            self.logger.warning("Stats stream of %s ended: %s", id[:12], e)
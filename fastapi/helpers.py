@@ -1,14 +1,26 @@
 import json
-from aioredis import Redis
 from fastapi import Request
-import time
+from fastapi.responses import JSONResponse, Response
+from sse_starlette import EventSourceResponse
+from stream_hub import StreamHub
+from message_log import MessageLog
+from instrumentation import SSE_BYTES
+from typing import Callable, Optional, Tuple
+import asyncio
+import re
 import enum
+import zlib
+import config
+
+# zlib window bits of each content encoding, deflate is the zlib format per RFC 9110
+STREAM_ENCODINGS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
 
 
 class ObjectType(enum.Enum):
     CONTAINER = "container"
     IMAGE = "image"
     VOLUME = "volume"
+    NETWORK = "network"
 
 
 def convert_from_bytes(bytes) -> str:
@@ -19,22 +31,155 @@ def convert_from_bytes(bytes) -> str:
     )
 
 
-async def subscribe_to_channel(req: Request, chan: str, redis: Redis):
-    pubsub = redis.pubsub()
-    # will fail if you pass a channel that doesn't exist
-    await pubsub.subscribe(chan)
-    async for message in pubsub.listen():
-        if await req.is_disconnected():
-            await pubsub.close()
-            break
-        if message["type"] == "message" and message["data"] != 1:
-            yield f"{message['data'].decode('utf-8')}\n\n"
+async def subscribe_to_channel(
+    req: Request, chan: str, hub: StreamHub, resync: Callable[[], str] = None
+):
+    # messages come from the hub's shared subscription instead of a redis connection per client
+    # resync replaces the next frame after this client dropped frames, for incremental streams
+    sub = hub.subscribe(chan)
+    try:
+        async for data in sub:
+            if await req.is_disconnected():
+                break
+            if resync is not None and sub.take_missed():
+                data = resync()
+            yield f"{data}\n\n"
+    finally:
+        hub.unsubscribe(sub)
 
 
-async def publish_message_data(message: str, category: str, redis: Redis):
-    # gets consumed by frontend via toasts
-    # need to pass alert text, category (error, success), and time when the message is posted
-    await redis.publish(
-        "server_messages",
-        json.dumps({"text": message, "category": category, "timeSent": time.time()}),
+def stream_encoding(req: Request) -> Optional[str]:
+    # ?compress=off|auto|gzip|deflate, STREAM_COMPRESSION when absent; None for plain text
+    mode = req.query_params.get("compress", config.STREAM_COMPRESSION).lower()
+    wanted = ("gzip", "deflate") if mode == "auto" else (mode,)
+    accepted = {
+        encoding.split(";")[0].strip().lower()
+        for encoding in req.headers.get("accept-encoding", "").split(",")
+    }
+    return next((e for e in wanted if e in STREAM_ENCODINGS and e in accepted), None)
+
+
+class CompressedResponse(Response):
+    # wraps a streaming response, compressing every chunk and flushing it at once, so an
+    # event reaches the browser when it is sent while the shared window compresses
+    # the repeated keys and values of consecutive events
+    # the wrapped response's headers are this one's, and this one's are what is sent
+    def __init__(self, response: Response, encoding: str):
+        # set first, Response.__init__ assigns background through the property below
+        self.response = response
+        self.encoding = encoding
+        headers = {
+            name: value
+            for name, value in response.headers.items()
+            if name != "content-length"
+        }
+        headers["content-encoding"] = encoding
+        vary = headers.get("vary")
+        headers["vary"] = f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"
+        super().__init__(
+            status_code=response.status_code,
+            headers=headers,
+            media_type=response.media_type,
+            background=response.background,
+        )
+
+    @property
+    def background(self):
+        return self.response.background
+
+    @background.setter
+    def background(self, value):
+        self.response.background = value
+
+    async def __call__(self, scope, receive, send):
+        compressor = zlib.compressobj(
+            config.STREAM_COMPRESSION_LEVEL,
+            zlib.DEFLATED,
+            STREAM_ENCODINGS[self.encoding],
+        )
+        # sse pings are sent from another task, chunks must leave in compression order
+        lock = asyncio.Lock()
+
+        async def compressed_send(message):
+            async with lock:
+                if message["type"] == "http.response.start":
+                    message = dict(message, headers=self.raw_headers)
+                elif message["type"] == "http.response.body":
+                    raw = message.get("body", b"")
+                    more = message.get("more_body", False)
+                    body = compressor.compress(raw) + compressor.flush(
+                        zlib.Z_SYNC_FLUSH if more else zlib.Z_FINISH
+                    )
+                    SSE_BYTES.inc(self.encoding, "raw", amount=len(raw))
+                    SSE_BYTES.inc(self.encoding, "wire", amount=len(body))
+                    message = dict(message, body=body)
+                await send(message)
+
+        await self.response(scope, receive, compressed_send)
+
+
+def event_source(req: Request, content, **kwargs) -> Response:
+    # EventSourceResponse, compressed when the client asked for it and accepts it
+    response = EventSourceResponse(content, **kwargs)
+    encoding = stream_encoding(req)
+    return CompressedResponse(response, encoding) if encoding else response
+
+
+def parse_interval(value: str, minimum: float = 0.25, maximum: float = 60.0) -> Optional[float]:
+    # parses durations like "2s", "500ms", "1m" or plain seconds, clamped to [minimum, maximum]
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*(ms|s|m)?\s*", value or "")
+    if not match:
+        return None
+    seconds = float(match.group(1)) * {"ms": 0.001, "s": 1, "m": 60, None: 1}[match.group(2)]
+    return min(max(seconds, minimum), maximum)
+
+
+def parse_id_filter(value: str) -> Optional[Tuple[str, ...]]:
+    # comma separated container ids, short ids match as prefixes
+    ids = tuple(id.strip() for id in (value or "").split(",") if id.strip())
+    return ids or None
+
+
+async def batch_container_metrics(
+    req: Request,
+    hub: StreamHub,
+    interval: float,
+    ids: Tuple[str, ...] = None,
+    chan: str = "container_metrics",
+):
+    # one frame per interval with the latest stats of every container that reported since the last one
+    # deletions are collected the same way so they are never lost between frames
+    sub = hub.subscribe_coalesced(chan, ids)
+    try:
+        while not sub.closed:
+            stats, deleted = sub.take()
+            if stats or deleted:
+                if await req.is_disconnected():
+                    break
+                # stats are forwarded as published, without decoding them again
+                yield f'{{"Stats": [{",".join(stats)}], "Deleted": {json.dumps(deleted)}}}'
+            await asyncio.sleep(interval)
+    finally:
+        hub.unsubscribe(sub)
+
+
+def snapshot_response(req: Request, chan: str, hub: StreamHub) -> Response:
+    # serves the hub's cached state of a channel, answering 304 when the client's copy is current
+    body, etag = hub.snapshot(chan)
+    if body is None:
+        return JSONResponse(
+            content={"message": "No data received yet"},
+            status_code=503,
+            headers={"Retry-After": "1"},
+        )
+    if etag in req.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(
+        content=body, media_type="application/json", headers={"ETag": etag}
     )
+
+
+async def publish_message_data(message: str, category: str, messages: MessageLog):
+    # gets consumed by frontend via toasts
+    # need to pass alert text, category (error, success), the time it was posted is added by the log
+    await messages.publish(message, category)
@@ -0,0 +1,107 @@
+# inspect_cache caches container inspect results for the info endpoint
+# entries expire after a ttl, are dropped as soon as a docker event arrives for their container,
+# and the least recently used entry is evicted once the cache is full
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Set, Tuple
+import config
+
+
+class InspectCache:
+    def __init__(
+        self,
+        fetch: Callable[[str], Awaitable[dict]],
+        maxsize: int = config.INSPECT_CACHE_SIZE,
+        ttl: float = config.INSPECT_CACHE_TTL,
+    ):
+        self.fetch = fetch
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # full id -> (expiry, inspect result), least recently used first
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        # ids the entries were requested by (short ids, names) -> full id
+        self._aliases: Dict[str, str] = {}
+        # one daemon request per id at a time, concurrent misses wait for it
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # in-flight ids invalidated before their result arrived, their result is not stored
+        self._stale: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    async def get(self, id: str) -> dict:
+        full_id = self._aliases.get(id, id)
+        entry = self._entries.get(full_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            self._entries.move_to_end(full_id)
+            return entry[1]
+        self.misses += 1
+        task = self._inflight.get(id)
+        if task is None:
+            task = self._inflight[id] = asyncio.create_task(self._load(id))
+        # shielded so a client going away does not cancel the request others wait on
+        return await asyncio.shield(task)
+
+    async def _load(self, id: str) -> dict:
+        try:
+            attrs = await self.fetch(id)
+        finally:
+            self._inflight.pop(id, None)
+        if id in self._stale:
+            self._stale.discard(id)
+            return attrs
+        full_id = attrs["Id"]
+        self._entries[full_id] = (time.monotonic() + self.ttl, attrs)
+        self._entries.move_to_end(full_id)
+        if id != full_id:
+            self._aliases[id] = full_id
+        while len(self._entries) > self.maxsize:
+            evicted, _ = self._entries.popitem(last=False)
+            self._drop_aliases(evicted)
+            self.evictions += 1
+        return attrs
+
+    def _drop_aliases(self, full_id: str):
+        for alias in [a for a, target in self._aliases.items() if target == full_id]:
+            del self._aliases[alias]
+
+    def invalidate(self, full_id: str, names: Tuple[str, ...] = ()):
+        # names are the container's, loads requested by name are stale too
+        if self._entries.pop(full_id, None) is not None:
+            self.invalidations += 1
+        self._drop_aliases(full_id)
+        for id in self._inflight:
+            if full_id.startswith(id) or id.lstrip("/") in names:
+                self._stale.add(id)
+
+    def clear(self):
+        self._entries.clear()
+        self._aliases.clear()
+        self._stale.update(self._inflight)
+
+    def on_event(self, event: dict):
+        # state index listener: any event about a container changes what inspect returns
+        if event.get("Type") == "container":
+            actor = event.get("Actor", {})
+            attributes = actor.get("Attributes") or {}
+            # a rename carries the name the container had before
+            names = (attributes.get("name"), attributes.get("oldName"))
+            names = tuple(name.lstrip("/") for name in names if name)
+            self.invalidate(actor.get("ID", ""), names)
+        elif event.get("Type") == "resync":
+            self.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
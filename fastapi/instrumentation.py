@@ -0,0 +1,277 @@
+# instrumentation collects counters and latency histograms and renders them for /metrics
+# in the prometheus text format, without a client library: a series is a few ints in a dict,
+# recording is a bisect and an increment, and labels are limited to bounded values
+# (route templates, method names, channel names), never container ids
+
+import bisect
+import functools
+import inspect
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# seconds, from a fast cached lookup to a slow image pull
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (last one is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def time(self, *labels: str) -> "_Timer":
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = _labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            suffix = _labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Gauge:
+    # read when /metrics is scraped, so nothing is recorded on the hot path
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        collect: Callable[[], Dict[Tuple[str, ...], float]],
+        labelnames: Sequence[str] = (),
+    ):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.labelnames = tuple(labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in self.collect().items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_LATENCY = registry.register(
+    Histogram(
+        "dpanel_http_request_duration_seconds",
+        "Time until the response headers were sent, per route template",
+        ("method", "route", "status"),
+    )
+)
+DOCKER_LATENCY = registry.register(
+    Histogram(
+        "dpanel_docker_call_duration_seconds",
+        "Duration of DockerManager calls",
+        ("method",),
+    )
+)
+DOCKER_ERRORS = registry.register(
+    Counter(
+        "dpanel_docker_call_errors_total",
+        "DockerManager calls that raised",
+        ("method", "error"),
+    )
+)
+REDIS_LATENCY = registry.register(
+    Histogram(
+        "dpanel_redis_duration_seconds",
+        "Redis round trips: xadd and xrange of the message log, "
+        "and xread_delivery from a message's XADD until the reader received it",
+        ("operation",),
+    )
+)
+HUB_FANOUT = registry.register(
+    Histogram(
+        "dpanel_stream_fanout_duration_seconds",
+        "Time to hand one redis message to every subscriber of a channel",
+        ("channel",),
+        buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1),
+    )
+)
+
+SSE_BYTES = registry.register(
+    Counter(
+        "dpanel_sse_bytes_total",
+        "Bytes of compressed SSE streams, as produced (raw) and as sent (wire)",
+        ("encoding", "stage"),
+    )
+)
+SCHEDULER_WAIT = registry.register(
+    Histogram(
+        "dpanel_scheduler_wait_seconds",
+        "Time a docker-mutating call waited for a scheduler slot",
+        ("priority",),
+    )
+)
+SCHEDULER_REJECTED = registry.register(
+    Counter(
+        "dpanel_scheduler_rejected_total",
+        "Requests refused with 429 because the scheduler queue was full",
+        ("priority",),
+    )
+)
+
+
+def instrument(
+    obj, histogram: Histogram = DOCKER_LATENCY, errors: Counter = DOCKER_ERRORS
+):
+    # wraps the public coroutine and async generator methods of obj with timing and error counts
+    for name, method in inspect.getmembers(obj, inspect.ismethod):
+        if name.startswith("_"):
+            continue
+        if inspect.isasyncgenfunction(method):
+            setattr(obj, name, _timed_generator(method, name, histogram, errors))
+        elif inspect.iscoroutinefunction(method):
+            setattr(obj, name, _timed_coroutine(method, name, histogram, errors))
+    return obj
+
+
+def _timed_coroutine(method, name: str, histogram: Histogram, errors: Counter):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        except Exception as e:
+            errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started, name)
+
+    return wrapper
+
+
+def _timed_generator(method, name: str, histogram: Histogram, errors: Counter):
+    # times the whole stream, from the call until it is exhausted or closed
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            async for item in method(*args, **kwargs):
+                yield item
+        except Exception as e:
+            errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started, name)
+
+    return wrapper
+
+
+class MetricsMiddleware:
+    # plain ASGI middleware, so streaming responses pass through untouched
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict[Callable, str] = {}
+
+    def _route(self, scope) -> str:
+        # the route template the router matched, e.g. /api/containers/info/{container_id}
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if endpoint not in self._routes:
+            router = scope.get("router")
+            # mounts like /static report the mounted app as their endpoint
+            self._routes[endpoint] = next(
+                (
+                    route.path
+                    for route in getattr(router, "routes", ())
+                    if endpoint is getattr(route, "endpoint", None)
+                    or endpoint is getattr(route, "app", None)
+                ),
+                getattr(endpoint, "__name__", "unknown"),
+            )
+        return self._routes[endpoint]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                HTTP_LATENCY.observe(
+                    time.perf_counter() - started,
+                    scope["method"],
+                    self._route(scope),
+                    str(message["status"]),
+                )
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
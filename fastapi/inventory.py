@@ -0,0 +1,155 @@
+# inventory publishes the volume and network lists on local hub channels for list streams
+# the lists come from cheap list calls, relisted once a burst of volume, network or
+# container events settles; volume sizes come from the disk usage cache, whose `system df`
+# runs in the background, so a slow size scan only delays the sizes, never the list
+
+import asyncio
+import json
+from typing import Awaitable, Callable, Dict, List
+from disk_usage import ANONYMOUS_LABEL, DiskUsage
+from stream_hub import StreamHub
+from logger import Logger
+import config
+
+BUILTIN_NETWORKS = {"bridge", "host", "none"}
+# container events that change which volumes and networks are in use
+CONTAINER_ACTIONS = {"create", "destroy", "rename"}
+
+
+class Inventory:
+    def __init__(
+        self,
+        fetch: Callable[[], Awaitable[dict]],
+        disk_usage: DiskUsage,
+        hub: StreamHub,
+        volume_chan: str = "volumes_list",
+        network_chan: str = "networks_list",
+    ):
+        # fetch returns {"volumes": [...], "networks": [...], "containers": [...]}
+        self.fetch = fetch
+        self.disk_usage = disk_usage
+        self.hub = hub
+        self.volume_chan = volume_chan
+        self.network_chan = network_chan
+        self.volumes: List[dict] = []
+        self.networks: List[dict] = []
+        self.listed = False
+        self._frames: Dict[str, str] = {}
+        self._task: asyncio.Task = None
+        self._relist: asyncio.Task = None
+        self.logger = Logger(__name__)
+        # the hub keeps the last frame of each for new clients and the snapshot endpoints
+        hub.add_local_channel(volume_chan)
+        hub.add_local_channel(network_chan)
+        # new sizes after every system df
+        disk_usage.add_listener(self.publish)
+
+    async def start(self):
+        # the list is published as soon as it is fetched, sizes follow from the loop
+        self._task = asyncio.create_task(self._sizes())
+        try:
+            await self.refresh()
+        except Exception as e:
+            # the daemon may not be up yet, the next event or size refresh retries
+            self.logger.error("Failed to list volumes and networks: %s", e)
+
+    async def close(self):
+        for task in (self._task, self._relist):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(
+            *[t for t in (self._task, self._relist) if t is not None],
+            return_exceptions=True,
+        )
+
+    async def _sizes(self):
+        # system df walks every volume, so it runs on its own schedule
+        while True:
+            try:
+                await self.disk_usage.refresh()
+                if not self.listed:
+                    # the first list failed, the daemon was not up yet
+                    await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error("Failed to refresh volume sizes: %s", e)
+            await asyncio.sleep(config.VOLUME_SIZE_REFRESH_INTERVAL)
+
+    async def refresh(self):
+        data = await self.fetch()
+        # container name -> volumes it mounts and networks it is attached to
+        mounts: Dict[str, List[str]] = {}
+        attached: Dict[str, List[str]] = {}
+        for c in data["containers"]:
+            name = (c.get("Names") or ["/"])[0].lstrip("/")
+            for mount in c.get("Mounts") or []:
+                if mount.get("Type") == "volume" and mount.get("Name"):
+                    mounts.setdefault(mount["Name"], []).append(name)
+            networks = (c.get("NetworkSettings") or {}).get("Networks") or {}
+            for network in networks.values():
+                attached.setdefault(network.get("NetworkID", ""), []).append(name)
+        self.volumes = [
+            {
+                "Name": v["Name"],
+                "Driver": v.get("Driver", ""),
+                "Mountpoint": v.get("Mountpoint", ""),
+                "CreatedAt": v.get("CreatedAt", ""),
+                "Anonymous": ANONYMOUS_LABEL in (v.get("Labels") or {}),
+                "Containers": sorted(mounts.get(v["Name"], [])),
+            }
+            for v in sorted(data["volumes"], key=lambda v: v["Name"])
+        ]
+        self.networks = [
+            {
+                "ID": n["Id"],
+                "Name": n["Name"],
+                "Driver": n.get("Driver", ""),
+                "Scope": n.get("Scope", ""),
+                "Internal": n.get("Internal", False),
+                "Builtin": n["Name"] in BUILTIN_NETWORKS,
+                "Created": n.get("Created", ""),
+                "Containers": sorted(attached.get(n["Id"], [])),
+            }
+            for n in sorted(data["networks"], key=lambda n: n["Name"])
+        ]
+        self.listed = True
+        self.publish()
+
+    def publish(self):
+        # sizes are null until the first system df finished, RefCount is always current
+        sizes = self.disk_usage.volumes
+        volumes = [
+            dict(
+                v,
+                Size=sizes[v["Name"]]["Size"] if v["Name"] in sizes else None,
+                RefCount=len(v["Containers"]),
+            )
+            for v in self.volumes
+        ]
+        self._send(self.volume_chan, json.dumps(volumes))
+        self._send(self.network_chan, json.dumps(self.networks))
+
+    def _send(self, chan: str, frame: str):
+        if frame != self._frames.get(chan):
+            self._frames[chan] = frame
+            self.hub.publish_local(chan, frame)
+
+    def on_event(self, event: dict):
+        # state index listener
+        type = event.get("Type")
+        if (
+            type in ("volume", "network", "resync")
+            or type == "container"
+            and event.get("Action") in CONTAINER_ACTIONS
+        ):
+            if self._relist is None or self._relist.done():
+                self._relist = asyncio.create_task(self._refresh_later())
+
+    async def _refresh_later(self):
+        # one relist per burst of events
+        await asyncio.sleep(config.INVENTORY_REFRESH_DELAY)
+        try:
+            await self.refresh()
+        except Exception as e:
+            self.logger.error("Failed to list volumes and networks: %s", e)
@@ -0,0 +1,157 @@
+# jobs runs long docker operations (image pulls, compose up/down) in the background
+# the POST returns a job id right away and /api/jobs/{id}/stream follows the progress events
+# jobs with the same key share one run while it is active (single-flight)
+
+import asyncio
+import re
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from logger import Logger
+import config
+
+# compose v2 progress lines, e.g. " Container wordpress-db-1  Started" or " db Pulled"
+COMPOSE_LINE = re.compile(
+    r"^\s*(?:(Container|Network|Volume|Image)\s+)?(\S+)\s+(.+?)\s*$"
+)
+
+
+class Job:
+    def __init__(self, kind: str, key: str, description: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.key = key
+        self.description = description
+        self.status = "queued"
+        self.created = time.time()
+        self.finished: float = None
+        self.error: str = None
+        self.result: Any = None
+        # progress events numbered from 1, only the most recent ones are kept
+        self.events = deque(maxlen=config.JOB_MAX_EVENTS)
+        self._seq = 0
+        # set and replaced on every event, wakes the streams following the job
+        self._wakeup = asyncio.Event()
+        self.task: asyncio.Task = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def emit(self, **event):
+        self._seq += 1
+        event["seq"] = self._seq
+        self.events.append(event)
+        wakeup, self._wakeup = self._wakeup, asyncio.Event()
+        wakeup.set()
+
+    def set_status(self, status: str, error: str = None, result: Any = None):
+        self.status = status
+        self.error = error
+        self.result = result
+        if self.done:
+            self.finished = time.time()
+        self.emit(type="status", status=status, error=error)
+
+    async def follow(self, after: int = 0):
+        # yields the kept events with seq > after, then new ones until the job is done
+        while True:
+            pending = [event for event in self.events if event["seq"] > after]
+            for event in pending:
+                after = event["seq"]
+                yield event
+            if self.done and after >= self._seq:
+                return
+            if not pending:
+                await self._wakeup.wait()
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "description": self.description,
+            "status": self.status,
+            "created": self.created,
+            "finished": self.finished,
+            "error": self.error,
+            "result": self.result,
+            "lastEvent": self.events[-1] if self.events else None,
+        }
+
+
+class JobManager:
+    def __init__(self, history: int = config.JOB_HISTORY):
+        self.history = history
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        # key -> job still queued or running, for single-flight
+        self._active: Dict[str, Job] = {}
+        self.logger = Logger(__name__)
+
+    def get(self, id: str) -> Optional[Job]:
+        return self.jobs.get(id)
+
+    def submit(
+        self,
+        kind: str,
+        key: str,
+        description: str,
+        runner: Callable[[Job], Awaitable[Any]],
+    ) -> Tuple[Job, bool]:
+        # returns the job running for key and False if there is one, else a new job and True
+        active = self._active.get(key)
+        if active is not None:
+            return active, False
+        job = Job(kind, key, description)
+        self.jobs[job.id] = job
+        self._active[key] = job
+        job.task = asyncio.create_task(self._run(job, runner))
+        return job, True
+
+    async def _run(self, job: Job, runner: Callable[[Job], Awaitable[Any]]):
+        job.set_status("running")
+        try:
+            result = await runner(job)
+            job.set_status("succeeded", result=result)
+        except Exception as e:
+            self.logger.error("Job %s (%s) failed: %s", job.id, job.description, e)
+            job.set_status("failed", error=str(e))
+        finally:
+            self._active.pop(job.key, None)
+            self._trim()
+
+    def _trim(self):
+        # keeps at most `history` finished jobs, dropping the oldest first
+        finished = [id for id, job in self.jobs.items() if job.done]
+        for id in finished[: max(len(finished) - self.history, 0)]:
+            del self.jobs[id]
+
+    async def close(self):
+        tasks = [job.task for job in self._active.values() if job.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def pull_progress(progress: dict) -> dict:
+    # one event per progress message of the docker pull stream, keyed by layer
+    detail = progress.get("progressDetail") or {}
+    return {
+        "type": "progress",
+        "layer": progress.get("id"),
+        "status": progress.get("status"),
+        "current": detail.get("current"),
+        "total": detail.get("total"),
+    }
+
+
+def compose_progress(source: str, line: bytes) -> dict:
+    # one event per output line of docker compose, with the object it is about when recognised
+    text = line.decode("utf-8", errors="replace").rstrip()
+    event = {"type": "progress", "stream": source, "line": text}
+    match = COMPOSE_LINE.match(text)
+    if match:
+        event["object"] = match.group(1) or "Service"
+        event["name"] = match.group(2)
+        event["status"] = match.group(3)
+    return event
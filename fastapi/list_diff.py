@@ -0,0 +1,79 @@
+# list_diff turns the full lists published every second into add/update/remove deltas
+# the diff runs once per channel in the hub, clients on ?mode=delta only receive what changed
+
+import json
+import time
+from typing import Dict, List, Optional
+from stream_hub import StreamHub
+import config
+
+
+def delta_channel(chan: str) -> str:
+    return f"{chan}:delta"
+
+
+def row_key(item: dict, key: str = "ID") -> str:
+    # rows of lists merged from several docker hosts are told apart by their host,
+    # the same image is listed once per host that has it
+    host = item.get("Host")
+    return f"{host}/{item[key]}" if host else item[key]
+
+
+class ListDiffer:
+    def __init__(
+        self, key: str = "ID", keyframe_interval: float = config.DELTA_KEYFRAME_INTERVAL
+    ):
+        self.key = key
+        self.keyframe_interval = keyframe_interval
+        self._entries: Dict[str, dict] = {}
+        self._items: List[dict] = []
+        self._last_keyframe = 0.0
+        self.ready = False
+
+    def keyframe(self) -> dict:
+        return {"type": "full", "items": self._items}
+
+    def update(self, items: List[dict]) -> Optional[dict]:
+        # returns the frame to send for this list, or None when nothing changed
+        entries = {row_key(item, self.key): item for item in items}
+        added, updated = [], []
+        for key, item in entries.items():
+            previous = self._entries.get(key)
+            if previous is None:
+                added.append(item)
+            elif previous != item:
+                updated.append(item)
+        removed = [key for key in self._entries if key not in entries]
+        first = not self.ready
+        self._entries = entries
+        self._items = items
+        self.ready = True
+
+        if not (first or added or updated or removed):
+            return None
+        # a change past the keyframe interval is sent as a keyframe, so clients
+        # that missed a delta converge without the stream ever sending idle frames
+        now = time.monotonic()
+        if first or now - self._last_keyframe >= self.keyframe_interval:
+            self._last_keyframe = now
+            return self.keyframe()
+        return {"type": "delta", "added": added, "updated": updated, "removed": removed}
+
+
+def attach_delta_channel(hub: StreamHub, chan: str, differ: ListDiffer):
+    # feeds every message of chan through the differ and publishes the result on its delta channel
+    def on_message(frame: str):
+        try:
+            # the publisher marshals an empty list as null
+            items = json.loads(frame) or []
+        except ValueError:
+            return
+        delta = differ.update(items)
+        if delta is not None:
+            hub.publish_local(delta_channel(chan), json.dumps(delta))
+
+    def snapshot() -> List[str]:
+        return [json.dumps(differ.keyframe())] if differ.ready else []
+
+    hub.add_local_channel(delta_channel(chan), snapshot_provider=snapshot)
+    hub.add_listener(chan, on_message)
@@ -0,0 +1,207 @@
+# list_index keeps the latest containers_list / images_list payload as an indexed in-memory view
+# so the API can serve one page (offset, limit, sort, q and filters) instead of the whole list
+# secondary indexes map filter values to ids, a sorted name index answers prefix searches,
+# and page results are cached per query until the next list that actually changed
+
+import bisect
+import json
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from compose_manager import PROJECT_LABEL
+from list_diff import row_key
+from state_index import ContainerState
+from stream_hub import StreamHub
+from stream_views import parse_fields, project
+import config
+
+
+def page_channel(chan: str) -> str:
+    return f"{chan}:pages"
+
+
+class ListIndex:
+    def __init__(
+        self,
+        hub: StreamHub,
+        chan: str,
+        name: Callable[[dict], str],
+        filters: Dict[str, Callable[[dict], str]],
+        sort_keys: Dict[str, Callable[[dict], object]],
+        key: str = "ID",
+    ):
+        self.hub = hub
+        self.chan = chan
+        self.name = name
+        self.filters = filters
+        self.sort_keys = sort_keys
+        self.key = key
+        self.version = 0
+        self.rows: Dict[str, dict] = {}
+        # filter -> value -> ids
+        self._by_value: Dict[str, Dict[str, Set[str]]] = {}
+        # (lowercased name, row) and (id, row) pairs, both sorted, for prefix searches
+        self._names: List[Tuple[str, str]] = []
+        self._ids: List[Tuple[str, str]] = []
+        # sort -> ids in that order, built on first use per version
+        self._sorted: Dict[str, List[str]] = {}
+        # query -> (page, page as json), dropped when the list changes
+        self._pages: Dict[tuple, Tuple[dict, str]] = {}
+        self._frame: str = None
+        # version bumps are published so page streams recompute only when the list changed
+        hub.add_local_channel(page_channel(chan))
+        hub.add_listener(chan, self.update)
+
+    def update(self, frame: str):
+        if frame == self._frame:
+            return
+        try:
+            # the publisher marshals an empty list as null
+            items = json.loads(frame) or []
+        except ValueError:
+            return
+        self._frame = frame
+        self.rows = {row_key(item, self.key): item for item in items}
+        self._by_value = {field: {} for field in self.filters}
+        for id, item in self.rows.items():
+            for field, extract in self.filters.items():
+                self._by_value[field].setdefault(extract(item), set()).add(id)
+        self._names = sorted(
+            (self.name(item).lower(), id) for id, item in self.rows.items()
+        )
+        self._ids = sorted((item[self.key], id) for id, item in self.rows.items())
+        self._sorted = {}
+        self._pages = {}
+        self.version += 1
+        self.hub.publish_local(page_channel(self.chan), str(self.version))
+
+    def _prefix(self, q: str) -> Set[str]:
+        # ids whose name or id starts with q
+        q = q.lower()
+        matches = set()
+        start = bisect.bisect_left(self._names, (q, ""))
+        for name, id in self._names[start:]:
+            if not name.startswith(q):
+                break
+            matches.add(id)
+        start = bisect.bisect_left(self._ids, (q, ""))
+        for key, id in self._ids[start:]:
+            if not key.startswith(q):
+                break
+            matches.add(id)
+        return matches
+
+    def _order(self, sort: str) -> List[str]:
+        if sort not in self._sorted:
+            field = sort.lstrip("-")
+            key = self.sort_keys[field]
+            self._sorted[sort] = sorted(
+                self.rows,
+                key=lambda id: key(self.rows[id]),
+                reverse=sort.startswith("-"),
+            )
+        return self._sorted[sort]
+
+    def query(self, **params) -> dict:
+        return self._page(**params)[0]
+
+    def page_frame(self, **params) -> str:
+        # the page as json, serialized once per query and list version
+        return self._page(**params)[1]
+
+    def _page(
+        self,
+        offset: int = 0,
+        limit: int = config.LIST_PAGE_SIZE,
+        sort: str = "name",
+        q: str = "",
+        fields: str = "",
+        **filters: Optional[str],
+    ) -> Tuple[dict, str]:
+        # raises ValueError for an unknown sort or filter
+        # fields projects the rows of the page, the key fields are always included
+        if sort.lstrip("-") not in self.sort_keys:
+            raise ValueError(f"Unknown sort: {sort}")
+        filters = {field: value for field, value in filters.items() if value}
+        for field in filters:
+            if field not in self.filters:
+                raise ValueError(f"Unknown filter: {field}")
+        offset = max(offset, 0)
+        limit = max(1, min(limit, config.LIST_PAGE_MAX))
+        fields = parse_fields(fields)
+        query = (offset, limit, sort, q, fields, tuple(sorted(filters.items())))
+        cached = self._pages.get(query)
+        if cached is not None:
+            return cached
+
+        # intersect the smallest candidate sets first, then walk the sort order
+        candidates = [
+            self._by_value[field].get(value, set()) for field, value in filters.items()
+        ]
+        if q:
+            candidates.append(self._prefix(q))
+        candidates.sort(key=len)
+        order = self._order(sort)
+        if candidates:
+            matching = set.intersection(*candidates)
+            order = [id for id in order if id in matching]
+        page = {
+            "total": len(order),
+            "offset": offset,
+            "limit": limit,
+            "items": [
+                project(self.rows[id], fields, (self.key, "Host"))
+                for id in order[offset : offset + limit]
+            ],
+        }
+        if len(self._pages) >= config.LIST_PAGE_CACHE:
+            self._pages.clear()
+        self._pages[query] = page, json.dumps(page)
+        return self._pages[query]
+
+
+def container_list_index(
+    hub: StreamHub, find_state: Callable[[str], Optional[ContainerState]]
+) -> ListIndex:
+    def project(container: dict) -> str:
+        # the list carries no labels, the state index of the container's host has them
+        state = find_state(container["ID"])
+        return state.labels.get(PROJECT_LABEL, "") if state is not None else ""
+
+    def name(container: dict) -> str:
+        return (container.get("Names") or ["/"])[0].lstrip("/")
+
+    return ListIndex(
+        hub,
+        "containers_list",
+        name=name,
+        filters={
+            "state": lambda c: c["State"],
+            "image": lambda c: c["Image"],
+            "project": project,
+            "host": lambda c: c.get("Host", ""),
+        },
+        sort_keys={
+            "name": lambda c: name(c).lower(),
+            "state": lambda c: (c["State"], name(c).lower()),
+            "image": lambda c: (c["Image"], name(c).lower()),
+            "status": lambda c: c["Status"],
+        },
+    )
+
+
+def image_list_index(hub: StreamHub) -> ListIndex:
+    return ListIndex(
+        hub,
+        "images_list",
+        name=lambda i: i["Name"],
+        filters={
+            "tag": lambda i: i["Tag"],
+            "state": lambda i: "used" if i["NumContainers"] else "unused",
+            "host": lambda i: i.get("Host", ""),
+        },
+        sort_keys={
+            "name": lambda i: i["Name"].lower(),
+            "created": lambda i: i["Created"],
+            "size": lambda i: i["Size"],
+            "containers": lambda i: i["NumContainers"],
+        },
+    )
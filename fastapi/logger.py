@@ -1,27 +1,247 @@
+# logger wraps the standard logging module for the service
+# records go through a bounded queue to one background writer thread, so a slow stdout never
+# blocks the event loop; %-style arguments are only formatted by that thread, output is plain
+# text or json (LOG_FORMAT), repeated messages are rate limited and environment values redacted
+
+import atexit
+import json
 import logging
+import queue
+import re
 import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Tuple
+import config
+
+# keys whose values never reach the log
+SECRET_KEY = re.compile(r"(?i)(password|passwd|secret|token|api[_-]?key|credential)")
+ENV_KEYS = {"env", "environment"}
+# KEY=value pairs with a secret looking key inside already formatted messages
+SECRET_PAIR = re.compile(
+    r"(?i)\b([\w.-]*(?:password|passwd|secret|token|api[_-]?key|credential)[\w.-]*)"
+    r"=([^\s,'\"\]]+)"
+)
+
+
+def redact(value: Any, depth: int = 0) -> Any:
+    # copies dicts and lists with environment values and secret looking keys masked
+    if depth > 8:
+        return value
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            name = str(key)
+            if name.lower() in ENV_KEYS:
+                result[key] = _redact_env(item)
+            elif SECRET_KEY.search(name):
+                result[key] = "***"
+            else:
+                result[key] = redact(item, depth + 1)
+        return result
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(item, depth + 1) for item in value)
+    return value
+
+
+def _redact_env(env: Any) -> Any:
+    # docker takes ["KEY=value", ...], compose also accepts {"KEY": "value"}
+    if isinstance(env, dict):
+        return {key: "***" for key in env}
+    if isinstance(env, (list, tuple)):
+        return [f"{str(item).split('=', 1)[0]}=***" for item in env]
+    return "***"
+
+
+class RedactingFormatter(logging.Formatter):
+    # runs on the writer thread, so redaction and formatting cost the request nothing
+    def __init__(self, json_output: bool = False):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        self.json_output = json_output
+
+    def message(self, record: logging.LogRecord) -> str:
+        args = record.args
+        if args:
+            # a single dict argument is used for %(name)s style messages
+            args = redact(args)
+            try:
+                message = str(record.msg) % args
+            except (TypeError, ValueError):
+                message = f"{record.msg} {args}"
+        else:
+            message = str(record.msg)
+        message = SECRET_PAIR.sub(r"\1=***", message)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            message += f" ({suppressed} similar messages suppressed)"
+        return message
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.message = self.message(record)
+        if self.json_output:
+            entry = {
+                "time": record.created,
+                "level": record.levelname,
+                "logger": record.name,
+                "message": record.message,
+            }
+            if record.exc_text:
+                entry["exception"] = record.exc_text
+            return json.dumps(entry, default=str)
+        record.asctime = self.formatTime(record)
+        text = self._fmt % record.__dict__
+        if record.exc_text:
+            text += "\n" + record.exc_text
+        return text
+
+
+class RateLimitFilter(logging.Filter):
+    # lets at most `limit` records with the same logger and message template through per window;
+    # the first record of the next window reports how many were suppressed in between
+    def __init__(self, limit: int, window: float):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        # (logger, template) -> [window start, records passed, records suppressed]
+        self._counts: Dict[Tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.limit <= 0:
+            return True
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None or now - counts[0] >= self.window:
+                if len(self._counts) > 10000:
+                    # templates are bounded in practice, f-string messages are not
+                    self._counts.clear()
+                suppressed = counts[2] if counts is not None else 0
+                self._counts[key] = [now, 1, 0]
+                record.suppressed = suppressed
+                return True
+            if counts[1] < self.limit:
+                counts[1] += 1
+                return True
+            counts[2] += 1
+            return False
+
+
+class DroppingQueueHandler(QueueHandler):
+    # never blocks the caller: when the writer falls behind, new records are counted and dropped
+    # the writer thread is started again by the first record after stop, loggers keep this
+    # handler when the app shuts down and starts again in the same process
+    def __init__(self, records: queue.Queue, output: logging.Handler):
+        super().__init__(records)
+        self.output = output
+        self.listener = QueueListener(records, output)
+        self.running = False
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def start(self) -> bool:
+        with self._lock:
+            if not self.running:
+                try:
+                    self.listener.start()
+                except RuntimeError:
+                    # no new threads once the interpreter is shutting down
+                    return False
+                self.running = True
+        return True
+
+    def stop(self):
+        # writes out what is still queued
+        with self._lock:
+            if self.running:
+                self.listener.stop()
+                self.running = False
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # unlike QueueHandler.prepare the message is not formatted here, only the traceback
+        # (which references live frames); args are formatted later on the writer thread,
+        # so pass values rather than objects that are mutated right after logging
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if not self.running and not self.start():
+            # nothing would ever write it from the queue
+            self.output.handle(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _output_handler() -> logging.Handler:
+    handler = logging.StreamHandler(sys.stdout)  # Output to console
+    handler.setFormatter(RedactingFormatter(json_output=config.LOG_FORMAT == "json"))
+    return handler
+
+
+class _Pipeline:
+    # the handler every Logger shares, started on first use
+    def __init__(self):
+        self.handler: logging.Handler = None
+        self._lock = threading.Lock()
+
+    def get(self) -> logging.Handler:
+        with self._lock:
+            if self.handler is None:
+                if config.LOG_ASYNC:
+                    records = queue.Queue(config.LOG_QUEUE_SIZE)
+                    self.handler = DroppingQueueHandler(records, _output_handler())
+                    self.handler.start()
+                    atexit.register(self.stop)
+                else:
+                    self.handler = _output_handler()
+                self.handler.addFilter(
+                    RateLimitFilter(config.LOG_RATE_LIMIT, config.LOG_RATE_WINDOW)
+                )
+        return self.handler
+
+    def stop(self):
+        if isinstance(self.handler, DroppingQueueHandler):
+            self.handler.stop()
+
+
+_pipeline = _Pipeline()
+
+
+def shutdown_logging():
+    _pipeline.stop()
+
+
+def dropped_records() -> int:
+    # records dropped because the writer thread fell behind
+    return getattr(_pipeline.handler, "dropped", 0)
 
 
 class Logger:
     def __init__(self, name):
         self.logger = logging.getLogger(name)
-        self.logger.setLevel(logging.INFO)
-        handler = logging.StreamHandler(sys.stdout)  # Output to console
-        formatter = logging.Formatter(
-            "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-        )
-        handler.setFormatter(formatter)
+        self.logger.setLevel(config.LOG_LEVEL)
+        self.logger.propagate = False
         if not self.logger.handlers:
-            self.logger.addHandler(handler)
+            self.logger.addHandler(_pipeline.get())
+
+    # messages take %-style arguments, which are only formatted if the record is written,
+    # e.g. logger.info("Pulled %s in %.1fs", image, seconds)
 
-    def info(self, message):
-        self.logger.info(message)
+    def info(self, message, *args, **kwargs):
+        self.logger.info(message, *args, **kwargs)
 
-    def warning(self, message):
-        self.logger.warning(message)
+    def warning(self, message, *args, **kwargs):
+        self.logger.warning(message, *args, **kwargs)
 
-    def error(self, message):
-        self.logger.error(message)
+    def error(self, message, *args, **kwargs):
+        self.logger.error(message, *args, **kwargs)
 
-    def debug(self, message):
-        self.logger.debug(message)
+    def debug(self, message, *args, **kwargs):
+        self.logger.debug(message, *args, **kwargs)
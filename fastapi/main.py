@@ -1,33 +1,125 @@
 from fastapi import FastAPI, Request
-from sse_starlette import EventSourceResponse
 from fastapi.requests import Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import aioredis
 from aioredis import Redis
 from aiodocker.exceptions import DockerError
-from typing import Callable, List
-from python_on_whales import DockerClient, DockerException
+from typing import Callable, List, Optional
+import aiohttp
 import asyncio
 import aiofiles
 import os
 import json
+import re
+import time
 from helpers import (
     convert_from_bytes,
+    event_source,
     subscribe_to_channel,
+    batch_container_metrics,
+    parse_interval,
+    parse_id_filter,
+    snapshot_response,
     publish_message_data,
     ObjectType,
 )
-from logger import Logger
-from docker_utils import DockerManager
+from logger import Logger, dropped_records, shutdown_logging
+from instrumentation import Gauge, MetricsMiddleware, instrument, registry
+from docker_utils import DockerManager, InvalidConfig, container_config
+from blocking import LoopLagMonitor
+from jobs import Job, JobManager, compose_progress, pull_progress
+from bulk_actions import BulkActionExecutor, detached
+from inspect_cache import InspectCache
+from disk_usage import DiskUsage, PRUNE_TYPES
+from inventory import Inventory
+from embedded_publisher import EmbeddedPublisher
+from compose_index import ComposeFileIndex
+from compose_manager import ComposeError, ComposeManager, PROJECT_LABEL
+from container_logs import LogReader, parse_filter, parse_since
+from stream_hub import StreamHub
+from list_diff import ListDiffer, attach_delta_channel, delta_channel
+from list_index import ListIndex, container_list_index, image_list_index, page_channel
+from metrics_history import MetricsHistory
+from stream_views import StreamViews, follow_view, metrics_filters
+from scheduler import (
+    DOCKER_PRIORITIES,
+    PRIORITIES,
+    ClientMiddleware,
+    Overloaded,
+    Scheduler,
+    schedule,
+)
+from message_log import MessageLog
+import config
 
 # Define global variables
 redis: Redis = None
 logger = Logger(__name__)
 docker_manager = DockerManager()
+# timing and error counts per DockerManager method, see /metrics
+instrument(docker_manager)
+# calls that change docker state wait for a slot of their priority, see scheduler
+scheduler = Scheduler()
+schedule(docker_manager, scheduler, DOCKER_PRIORITIES)
+# one redis subscription per channel, shared by every SSE client
+# container_metrics carries one message per container, so its cache is kept per container ID
+hub = StreamHub(keyed_channels={"container_metrics": "ID"})
+# diff the full lists once per tick for clients streaming with ?mode=delta
+container_differ = ListDiffer()
+image_differ = ListDiffer()
+attach_delta_channel(hub, "containers_list", container_differ)
+attach_delta_channel(hub, "images_list", image_differ)
+# indexed views of the same lists for paged, sorted and filtered queries
+container_index = container_list_index(hub, docker_manager.find_state)
+image_index = image_list_index(hub)
+# the lists and stats come from the go publisher through redis, or from this process,
+# which is the only way to follow several docker hosts
+embedded_publisher = (
+    EmbeddedPublisher(docker_manager, hub)
+    if config.PUBLISHER == "embedded" or len(docker_manager.hosts) > 1
+    else None
+)
+# toasts for the frontend, kept in a capped redis stream so reconnecting tabs can catch up
+message_log = MessageLog(hub)
+# cpu and memory history per container, fed by every container_metrics message
+metrics_history = MetricsHistory()
+hub.add_listener("container_metrics", metrics_history.record)
+# samples event loop lag, blocking work belongs on docker_manager.blocking instead
+loop_monitor = LoopLagMonitor()
+# background pulls and compose runs, followed through /api/jobs/{id}/stream
+job_manager = JobManager()
+# bounds concurrent daemon calls of perform_action, per request
+bulk_executor = BulkActionExecutor()
+# inspect results for the info endpoint, dropped on any docker event for the container
+inspect_cache = InspectCache(docker_manager.inspect_container)
+docker_manager.add_listener(inspect_cache.on_event)
+# system df for prune estimates, patched by docker events and refreshed once they settle
+disk_usage = DiskUsage(docker_manager.disk_usage)
+docker_manager.state_index.add_listener(disk_usage.on_event)
+# volume and network lists for their streams, volume sizes from the disk usage cache
+inventory = Inventory(docker_manager.inventory, disk_usage, hub)
+docker_manager.state_index.add_listener(inventory.on_event)
+# projected and filtered variants of the streams, one per distinct ?fields= and filters
+stream_views = StreamViews(hub)
+stream_views.add_source("containers_list", container_index.filters)
+stream_views.add_source("images_list", image_index.filters)
+stream_views.add_source(
+    "container_metrics", metrics_filters(docker_manager.find_state), keyed=True
+)
+stream_views.add_source(inventory.volume_chan, key="Name")
+stream_views.add_source(inventory.network_chan)
+# compose files and their parsed metadata, pushed on compose_files only when they change
+compose_index = ComposeFileIndex(hub, docker_manager.blocking)
+# compose up/down with a lock per project, and project status from container labels
+compose_manager = ComposeManager(
+    compose_index, docker_manager.state_index, docker_manager.blocking, hub, scheduler
+)
 
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ClientMiddleware)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 app.add_middleware(
@@ -39,231 +131,978 @@ app.add_middleware(
 )
 
 
+registry.register(
+    Gauge(
+        "dpanel_sse_clients",
+        "Connected SSE clients per hub channel",
+        lambda: {
+            (chan,): count for chan, count in stream_views.client_counts().items()
+        },
+        ("channel",),
+    )
+)
+registry.register(
+    Gauge(
+        "dpanel_stream_views",
+        "Projected or filtered views with clients, per source channel",
+        lambda: {(chan,): count for chan, count in stream_views.view_counts().items()},
+        ("channel",),
+    )
+)
+registry.register(
+    Gauge(
+        "dpanel_scheduler_queued",
+        "Docker-mutating calls waiting for a scheduler slot, per priority",
+        lambda: {(p,): len(scheduler.queues[p]) for p in PRIORITIES},
+        ("priority",),
+    )
+)
+registry.register(
+    Gauge(
+        "dpanel_scheduler_running",
+        "Docker-mutating calls holding a scheduler slot, per priority",
+        lambda: {(p,): scheduler.running[p] for p in PRIORITIES},
+        ("priority",),
+    )
+)
+registry.register(
+    Gauge(
+        "dpanel_metrics_history_containers",
+        "Containers with metrics history, per tier",
+        lambda: {
+            ("coarse",): len(metrics_history),
+            ("fine",): metrics_history.fine_count(),
+        },
+        ("tier",),
+    )
+)
+registry.register(
+    Gauge(
+        "dpanel_event_loop_lag_seconds",
+        "Event loop lag of the last sample",
+        lambda: {(): loop_monitor.last_lag},
+    )
+)
+registry.register(
+    Gauge(
+        "dpanel_event_loop_lag_max_seconds",
+        "Largest event loop lag since startup",
+        lambda: {(): loop_monitor.max_lag},
+    )
+)
+registry.register(
+    Gauge(
+        "dpanel_log_records_dropped",
+        "Log records dropped because the log writer fell behind",
+        lambda: {(): dropped_records()},
+    )
+)
+registry.register(
+    Gauge(
+        "dpanel_blocking_pending",
+        "Calls waiting for or running on the blocking pool",
+        lambda: {(): docker_manager.blocking.pending},
+    )
+)
+
+
 # Function to setup aioredis
 async def setup_redis():
     global redis
-    redis = await aioredis.from_url("redis://redis")
+    if config.PUBLISHER == "embedded":
+        # no redis at all, the message log keeps its entries in memory
+        await message_log.start()
+        return
+    redis = await aioredis.from_url(config.REDIS_URL)
+    hub.set_redis(redis)
+    message_log.set_redis(redis)
+    await message_log.start()
+    # start consuming the publisher's channels so the first client gets a snapshot immediately
+    hub.start(["containers_list", "images_list", "container_metrics"])
 
 
 # Function to close the Redis connection pool
 async def close_redis():
     global redis
+    await message_log.close()
+    await hub.close()
     if redis:
         await redis.close()
         await redis.wait_closed()
 
 
+async def startup_began():
+    app.state.startup_began = time.perf_counter()
+
+
+async def startup_finished():
+    # the docker client and redis connection are created in the hooks, not at import
+    logger.info(
+        "Startup hooks finished in %.3fs",
+        time.perf_counter() - app.state.startup_began,
+    )
+
+
 # Register startup event handler
+app.add_event_handler("startup", startup_began)
 app.add_event_handler("startup", setup_redis)
+app.add_event_handler("startup", docker_manager.start)
+if embedded_publisher is not None:
+    app.add_event_handler("startup", embedded_publisher.start)
+app.add_event_handler("startup", inventory.start)
+app.add_event_handler("startup", loop_monitor.start)
+app.add_event_handler("startup", compose_index.start)
+app.add_event_handler("startup", startup_finished)
 # Register shutdown event handler
 app.add_event_handler("shutdown", close_redis)
+app.add_event_handler("shutdown", inventory.close)
+if embedded_publisher is not None:
+    app.add_event_handler("shutdown", embedded_publisher.close)
+app.add_event_handler("shutdown", docker_manager.close)
+app.add_event_handler("shutdown", loop_monitor.close)
+app.add_event_handler("shutdown", job_manager.close)
+app.add_event_handler("shutdown", compose_index.close)
+# last, so the other handlers' log records are written out
+app.add_event_handler("shutdown", shutdown_logging)
 
 
 # ======== HELPERS =========
 
 
+def overloaded(e: Overloaded) -> JSONResponse:
+    return JSONResponse(
+        content={"message": str(e)},
+        status_code=429,
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+class BulkSummary:
+    # collects per-object results of perform_action into the toast messages
+    def __init__(self):
+        self.error_ids_msgs = []
+        self.success_ids_msgs = []
+
+    def add(self, res: dict):
+        if res["type"] == "error":
+            if "statusCode" in res:
+                # get message from DockerError
+                self.error_ids_msgs.append(res["message"])
+            else:
+                # get short id of object's full id
+                self.error_ids_msgs.append(res["objectId"][:12])
+        elif res["type"] == "success":
+            if "message" in res and "status" in res["message"]:
+                # append result from pulling an image
+                self.success_ids_msgs.append(res["message"]["status"])
+            else:
+                self.success_ids_msgs.append(res["objectId"][:12])
+
+    def counts(self) -> dict:
+        return {
+            "succeeded": len(self.success_ids_msgs),
+            "failed": len(self.error_ids_msgs),
+        }
+
+    async def publish(self, success_msg: str, error_msg: str):
+        publish_tasks = []
+        if self.success_ids_msgs:
+            publish_tasks.append(
+                publish_message_data(
+                    f"{success_msg} ({len(self.success_ids_msgs)}):  {self.success_ids_msgs}",
+                    "Success",
+                    messages=message_log,
+                )
+            )
+
+        if self.error_ids_msgs:
+            publish_tasks.append(
+                publish_message_data(
+                    f"{error_msg}: {self.error_ids_msgs}", "Error", messages=message_log
+                )
+            )
+
+        await asyncio.gather(*publish_tasks)
+
+
 async def perform_action(
     req: Request,
     action: Callable,
     object_type: ObjectType,
     success_msg: str,
     error_msg: str,
+    priority: str = None,
+    timeout: Optional[float] = config.BULK_ACTION_TIMEOUT,
 ):
+    # ?stream=ndjson or ?stream=sse sends each object's result as soon as it finishes,
+    # otherwise one combined response is returned once every object is done
+    # the priority defaults to the scheduler priority of the action, timeout is per
+    # object, None for actions that take as long as they take
+    stream = req.query_params.get("stream")
     try:
+        scheduler.admit(priority or getattr(action, "priority", "normal"))
         data = await req.json()
         ids = data.get("ids", [])
+        # the docker host of images, volumes, networks and new containers, containers are
+        # found on whichever host has them unless one is given
+        host = data.get("host")
+        docker_manager.host(host)
         from_image = data.get("image", "")
         tag = data.get("tag", "")
-        config = data.get("config", "")
-        error_ids_msgs = []
-        success_ids_msgs = []
+        run_config = data.get("config", "")
+        # only counts at info, the body (with container configs) is formatted at debug level
+        # on the logging thread, with environment values redacted
         logger.info(
-            f"\nRequest Data: {data}\nIds: {ids}\nImage to pull: {from_image}\nImage tag: {tag}\n"
+            "%s: %d ids, image to pull: %s, image tag: %s",
+            req.url.path,
+            len(ids),
+            from_image,
+            tag,
         )
+        logger.debug("%s request data: %s", req.url.path, data)
 
-        async def perform_action_and_handle_error(
-            id: str, publish_image: str = None, tag: str = None
-        ):
+        async def perform_action_and_handle_error(item):
+            id, publish_image = item
             if object_type == ObjectType.CONTAINER:
                 # if create a new container, have to pass config from request
-                if config:
-                    res = await action(config)
+                if run_config and id is None:
+                    res = await action(run_config, host=host)
                     # logger.info(f"Result from creating new container")
                 else:
-                    container = await docker_manager.async_client.containers.get(id)
+                    container = await docker_manager.get_container(id, host)
                     res = await action(container)
             elif object_type == ObjectType.IMAGE:
                 # for pulling an image
                 if publish_image:
-                    res = await action(publish_image, tag)
+                    res = await action(publish_image, tag, host=host)
                 else:
                     # for deleting an image
-                    res = await action(id)
+                    res = await action(id, host=host)
+            elif object_type in (ObjectType.VOLUME, ObjectType.NETWORK):
+                # deleting by volume name or network id
+                res = await action(id, host=host)
             return res
 
-        tasks = []
-        # create list of tasks and use asyncio.gather to run them concurrently
-        if ids:
-            tasks.extend([perform_action_and_handle_error(id) for id in ids])
-        if config:
-            tasks.append(perform_action_and_handle_error(None))
+        # one work item per object: (id, image to pull)
+        items = [(id, None) for id in ids]
+        if run_config:
+            # an invalid config is refused before any action starts
+            container_config(run_config)
+            items.append((None, None))
         if from_image:
-            tasks.append(perform_action_and_handle_error(None, from_image, tag))
+            items.append((None, from_image))
 
-        # the * is list unpacking
-        results = await asyncio.gather(*tasks)
+        def object_id(item) -> str:
+            id, publish_image = item
+            return id or publish_image or "new container"
 
-        for res in results:
-            if res["type"] == "error":
-                if "statusCode" in res:
-                    # get message from DockerError
-                    error_ids_msgs.append(res["message"])
-                else:
-                    # get short id of object's full id
-                    error_ids_msgs.append(res["objectId"][:12])
-            elif res["type"] == "success":
-                if "message" in res and "status" in res["message"]:
-                    # append result from pulling an image
-                    success_ids_msgs.append(res["message"]["status"])
-                else:
-                    success_ids_msgs.append(res["objectId"][:12])
+        results = bulk_executor.run(
+            items, perform_action_and_handle_error, object_id, timeout
+        )
+    except Overloaded as e:
+        return overloaded(e)
+    except KeyError as e:
+        return JSONResponse(
+            content={"message": f"Unknown docker host: {e}"}, status_code=400
+        )
+    except InvalidConfig as e:
+        return JSONResponse(content={"message": str(e)}, status_code=400)
+    except Exception as e:
+        await publish_message_data(
+            f"API error, please try again: {e}", "Error", messages=message_log
+        )
+        return JSONResponse(content={"message": "API error"}, status_code=400)
 
-        publish_tasks = []
-        if success_ids_msgs:
-            publish_tasks.append(
-                publish_message_data(
-                    f"{success_msg} ({len(success_ids_msgs)}):  {success_ids_msgs}",
-                    "Success",
-                    redis=redis,
-                )
-            )
+    if stream in ("ndjson", "sse"):
+
+        async def result_stream():
+            summary = BulkSummary()
+            async for res in results:
+                summary.add(res)
+                yield res
+            await summary.publish(success_msg, error_msg)
+            yield {"type": "summary", **summary.counts()}
+
+        # the actions and the summary toast finish if the client goes away
+        streamed = detached(result_stream())
+        if stream == "sse":
+            return event_source(req, (json.dumps(res) async for res in streamed))
+        return StreamingResponse(
+            (f"{json.dumps(res)}\n" async for res in streamed),
+            media_type="application/x-ndjson",
+        )
 
-        if error_ids_msgs:
-            publish_tasks.append(
-                publish_message_data(
-                    f"{error_msg}: {error_ids_msgs}", "Error", redis=redis
-                )
-            )
+    summary = BulkSummary()
+    async for res in results:
+        summary.add(res)
+    await summary.publish(success_msg, error_msg)
+    if summary.error_ids_msgs:
+        return JSONResponse(
+            content={"message": f"{error_msg}: {summary.error_ids_msgs}"},
+            status_code=400,
+        )
+    return JSONResponse(content={"message": f"{success_msg}"}, status_code=200)
+
+
+def submit_pull_job(from_image: str, tag: str, host: str = None):
+    # concurrent pulls of the same image:tag to the same host share one job,
+    # raises KeyError for an unknown host
+    tag = tag if tag else "latest"
+    host = docker_manager.host(host).name
+    description = f"Pull {from_image}:{tag}"
+    if len(docker_manager.hosts) > 1:
+        description += f" on {host}"
+
+    async def run(job: Job):
+        last = None
+        async for progress in docker_manager.pull_image_stream(from_image, tag, host):
+            job.emit(**pull_progress(progress))
+            last = progress
+        return last
+
+    return job_manager.submit(
+        "pull", f"pull:{host}:{from_image}:{tag}", description, run
+    )
 
-        await asyncio.gather(*publish_tasks)
 
-        if error_ids_msgs:
-            return JSONResponse(
-                content={"message": f"{error_msg}: {error_ids_msgs}"}, status_code=400
+async def pull_image_job(from_image: str, tag: str, host: str = None):
+    # perform_action action for /api/images/pull, waits on the shared pull job
+    job, _ = submit_pull_job(from_image, tag, host)
+    await asyncio.wait([job.task])
+    if job.status == "failed":
+        return {"type": "error", "statusCode": 500, "message": job.error}
+    return {"type": "success", "message": job.result or {"status": job.description}}
+
+
+def submit_compose_job(project_file: str, action: str):
+    async def run(job: Job):
+        try:
+            await compose_manager.run(
+                project_file,
+                action,
+                on_line=lambda item: job.emit(**compose_progress(*item)),
             )
-        else:
-            return JSONResponse(content={"message": f"{success_msg}"}, status_code=200)
-    except Exception as e:
+        except ComposeError as e:
+            await publish_message_data(
+                f"API error, please try again: {e}", "Error", messages=message_log
+            )
+            raise
         await publish_message_data(
-            f"API error, please try again: {e}", "Error", redis=redis
+            f"Compose {action} successful: {project_file}",
+            "Success",
+            messages=message_log,
         )
-        return JSONResponse(content={"message": "API error"}, status_code=400)
+
+    return job_manager.submit(
+        "compose",
+        f"compose-{action}:{project_file}",
+        f"Compose {action} {project_file}",
+        run,
+    )
+
+
+def job_accepted(job: Job, created: bool) -> JSONResponse:
+    return JSONResponse(
+        content={"jobId": job.id, "shared": not created, "status": job.status},
+        status_code=202,
+    )
 
 
 # ======== ENDPOINTS =========
 
 
+@app.get("/metrics")
+async def metrics():
+    return Response(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/health")
+async def health():
+    # liveness: the process is up and serving, nothing else is checked
+    return {"status": "ok"}
+
+
+@app.get("/api/ready")
+async def ready():
+    # readiness: the docker daemon answers and the state index has been seeded from it
+    started = time.perf_counter()
+    try:
+        version = await docker_manager.ping()
+    except (DockerError, OSError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return JSONResponse(
+            content={
+                "message": f"Docker daemon unreachable: {e!r}",
+                "docker": False,
+                "indexed": docker_manager.state_index.ready,
+            },
+            status_code=503,
+        )
+    indexed = docker_manager.state_index.ready
+    return JSONResponse(
+        content={
+            "message": "Ready" if indexed else "Indexing containers",
+            "docker": True,
+            "indexed": indexed,
+            "apiVersion": version.get("ApiVersion"),
+            "latencyMs": round((time.perf_counter() - started) * 1000, 2),
+        },
+        status_code=200 if indexed else 503,
+    )
+
+
+@app.get("/api/hosts")
+async def hosts():
+    # every configured docker host, pinged concurrently, the first one is the default
+    return {
+        "default": docker_manager.default.name,
+        "hosts": await docker_manager.ping_hosts(),
+    }
+
+
 @app.get("/")
 async def read_root():
     return FileResponse("static/index.html")
 
 
 @app.get("/api/streams/composefiles")
-async def list_files():
-    async def event_stream():
-        while True:
-            files = os.listdir("./composefiles")
-            files = [os.path.splitext(file)[0] for file in files]
-            yield f"{json.dumps({'files': files})}\n\n"
-            await asyncio.sleep(1)
+async def list_files(req: Request):
+    return event_source(req, subscribe_to_channel(req, compose_index.chan, hub))
 
-    return EventSourceResponse(event_stream())
+
+async def page_stream(req: Request, index: ListIndex, params: dict):
+    # sends the page this client watches, again only when the list changed and the page with it
+    sub = hub.subscribe(page_channel(index.chan), replay=False)
+    last = None
+    try:
+        if index.version:
+            last = index.page_frame(**params)
+            yield f"{last}\n\n"
+        async for _ in sub:
+            if await req.is_disconnected():
+                break
+            frame = index.page_frame(**params)
+            if frame != last:
+                last = frame
+                yield f"{frame}\n\n"
+    finally:
+        hub.unsubscribe(sub)
+
+
+def list_page(index: ListIndex, params: dict):
+    try:
+        return index.query(**params)
+    except ValueError as e:
+        return JSONResponse(content={"message": str(e)}, status_code=400)
+
+
+def list_stream(
+    req: Request,
+    chan: str,
+    differ: ListDiffer,
+    mode: str,
+    index: ListIndex = None,
+    params: dict = None,
+):
+    # mode=full sends the whole list every tick, mode=delta sends a keyframe then only changes,
+    # mode=page sends one page of the indexed list (offset, limit, sort, q and filters)
+    # fields= and the filters apply to every mode, full and delta streams of the same
+    # fields and filters share one view of the list
+    try:
+        if mode == "page":
+            index.query(**params)
+            return event_source(req, page_stream(req, index, params))
+        filters = {
+            field: value
+            for field, value in params.items()
+            if field not in ("offset", "limit", "sort", "q", "fields")
+        }
+        shape = stream_views.shape(
+            chan, params["fields"], delta=mode == "delta", **filters
+        )
+    except ValueError as e:
+        return JSONResponse(content={"message": str(e)}, status_code=400)
+    if shape is not None:
+
+        def stream(view):
+            resync = view.keyframe if view.differ is not None else None
+            return subscribe_to_channel(req, view.chan, hub, resync=resync)
+
+        return event_source(req, follow_view(stream_views, shape, stream))
+    if mode == "delta":
+        return event_source(
+            req,
+            subscribe_to_channel(
+                req,
+                delta_channel(chan),
+                hub,
+                resync=lambda: json.dumps(differ.keyframe()),
+            ),
+        )
+    return event_source(req, subscribe_to_channel(req, chan, hub))
 
 
 @app.get("/api/streams/containerlist")
-async def container_list(req: Request):
+async def container_list(
+    req: Request,
+    mode: str = "full",
+    offset: int = 0,
+    limit: int = config.LIST_PAGE_SIZE,
+    sort: str = "name",
+    q: str = "",
+    fields: str = "",
+    state: str = "",
+    image: str = "",
+    project: str = "",
+    host: str = "",
+):
     # passes subscribe_to_channel async generator to consume the messages it yields
-    return EventSourceResponse(subscribe_to_channel(req, "containers_list", redis))
+    params = dict(
+        offset=offset,
+        limit=limit,
+        sort=sort,
+        q=q,
+        fields=fields,
+        state=state,
+        image=image,
+        project=project,
+        host=host,
+    )
+    return list_stream(
+        req, "containers_list", container_differ, mode, container_index, params
+    )
 
 
 @app.get("/api/streams/servermessages")
-async def server_messages(req: Request):
-    # passes subscribe_to_channel async generator to consume the messages it yields
-    return EventSourceResponse(subscribe_to_channel(req, "server_messages", redis))
+async def server_messages(req: Request, lastEventId: str = None):
+    # every event is a json array of messages published together,
+    # a reconnecting EventSource sends Last-Event-ID and gets what it missed first
+    # (?lastEventId= does the same for a new EventSource, which cannot set the header)
+    last_id = req.headers.get("last-event-id") or lastEventId
+    return event_source(req, message_log.follow(req, last_id))
 
 
 @app.get("/api/streams/imagelist")
-async def image_list(req: Request):
-    return EventSourceResponse(subscribe_to_channel(req, "images_list", redis))
+async def image_list(
+    req: Request,
+    mode: str = "full",
+    offset: int = 0,
+    limit: int = config.LIST_PAGE_SIZE,
+    sort: str = "name",
+    q: str = "",
+    fields: str = "",
+    state: str = "",
+    tag: str = "",
+    host: str = "",
+):
+    params = dict(
+        offset=offset,
+        limit=limit,
+        sort=sort,
+        q=q,
+        fields=fields,
+        state=state,
+        tag=tag,
+        host=host,
+    )
+    return list_stream(req, "images_list", image_differ, mode, image_index, params)
 
 
 @app.get("/api/streams/containermetrics")
-async def container_stat(req: Request):
-    return EventSourceResponse(subscribe_to_channel(req, "container_metrics", redis))
+async def container_stat(
+    req: Request,
+    interval: str = None,
+    ids: str = None,
+    fields: str = "",
+    state: str = "",
+    image: str = "",
+    host: str = "",
+):
+    # without parameters every published stats message is its own event
+    # interval and/or ids switch to one batched frame per interval, e.g. ?interval=2s&ids=abc,def
+    # fields, state, image and host read a view of the stats shared by the same query
+    try:
+        shape = stream_views.shape(
+            "container_metrics", fields, state=state, image=image, host=host
+        )
+    except ValueError as e:
+        return JSONResponse(content={"message": str(e)}, status_code=400)
+    if interval is None and ids is None:
+
+        def stream(chan: str):
+            return subscribe_to_channel(req, chan, hub)
+
+    else:
+        seconds = parse_interval(interval or "1s")
+        if seconds is None:
+            return JSONResponse(
+                content={"message": f"Invalid interval: {interval}"}, status_code=400
+            )
+
+        def stream(chan: str):
+            return batch_container_metrics(
+                req, hub, seconds, parse_id_filter(ids), chan
+            )
+
+    if shape is None:
+        return event_source(req, stream("container_metrics"))
+    return event_source(
+        req, follow_view(stream_views, shape, lambda view: stream(view.chan))
+    )
+
+
+@app.get("/api/containers")
+async def containers_page(
+    offset: int = 0,
+    limit: int = config.LIST_PAGE_SIZE,
+    sort: str = "name",
+    q: str = "",
+    fields: str = "",
+    state: str = "",
+    image: str = "",
+    project: str = "",
+    host: str = "",
+):
+    # one page of the container list, q matches name or id prefixes, sort=-field reverses
+    params = dict(
+        offset=offset,
+        limit=limit,
+        sort=sort,
+        q=q,
+        fields=fields,
+        state=state,
+        image=image,
+        project=project,
+        host=host,
+    )
+    return list_page(container_index, params)
+
+
+@app.get("/api/images")
+async def images_page(
+    offset: int = 0,
+    limit: int = config.LIST_PAGE_SIZE,
+    sort: str = "name",
+    q: str = "",
+    fields: str = "",
+    state: str = "",
+    tag: str = "",
+    host: str = "",
+):
+    # state is used or unused, depending on whether any container runs the image
+    params = dict(
+        offset=offset,
+        limit=limit,
+        sort=sort,
+        q=q,
+        fields=fields,
+        state=state,
+        tag=tag,
+        host=host,
+    )
+    return list_page(image_index, params)
+
+
+def inventory_stream(req: Request, chan: str, fields: str):
+    shape = stream_views.shape(chan, fields)
+    if shape is None:
+        return event_source(req, subscribe_to_channel(req, chan, hub))
+    return event_source(
+        req,
+        follow_view(
+            stream_views,
+            shape,
+            lambda view: subscribe_to_channel(req, view.chan, hub),
+        ),
+    )
+
+
+@app.get("/api/streams/volumelist")
+async def volume_list(req: Request, fields: str = ""):
+    # volumes with the containers mounting them, sizes follow once the background df ran
+    return inventory_stream(req, inventory.volume_chan, fields)
+
+
+@app.get("/api/streams/networklist")
+async def network_list(req: Request, fields: str = ""):
+    return inventory_stream(req, inventory.network_chan, fields)
+
+
+@app.get("/api/snapshots/containerlist")
+async def container_list_snapshot(req: Request):
+    return snapshot_response(req, "containers_list", hub)
+
+
+@app.get("/api/snapshots/imagelist")
+async def image_list_snapshot(req: Request):
+    return snapshot_response(req, "images_list", hub)
+
+
+@app.get("/api/snapshots/volumelist")
+async def volume_list_snapshot(req: Request):
+    return snapshot_response(req, inventory.volume_chan, hub)
+
+
+@app.get("/api/snapshots/networklist")
+async def network_list_snapshot(req: Request):
+    return snapshot_response(req, inventory.network_chan, hub)
+
+
+@app.get("/api/snapshots/containermetrics")
+async def container_stat_snapshot(req: Request):
+    return snapshot_response(req, "container_metrics", hub)
+
+
+@app.get("/api/containers/{container_id}/metrics/history")
+async def container_metrics_history(
+    container_id: str, seconds: int = 3600, points: int = 120
+):
+    # min/max/avg of the recorded stats over the last `seconds`, downsampled to `points` buckets
+    if seconds <= 0 or not 0 < points <= 3600:
+        return JSONResponse(
+            content={"message": "seconds must be positive and points in 1..3600"},
+            status_code=400,
+        )
+    history = metrics_history.query(container_id, seconds, points)
+    if history is None:
+        return JSONResponse(
+            content={"message": f"No metrics history for {container_id}"},
+            status_code=404,
+        )
+    return history
+
+
+def log_reader(
+    tail: int, since: str, follow: bool, q: str, regex: bool
+) -> LogReader:
+    # raises ValueError for an invalid since and re.error for an invalid pattern
+    return LogReader(
+        docker_manager,
+        tail=tail,
+        since=parse_since(since),
+        follow=follow,
+        match=parse_filter(q, regex),
+    )
+
+
+def log_response(req: Request, lines, format: str):
+    # format=sse for EventSource clients, format=ndjson for fetch() and curl
+    if format == "ndjson":
+        return StreamingResponse(
+            (f"{json.dumps(line)}\n" async for line in lines),
+            media_type="application/x-ndjson",
+        )
+    return event_source(req, (json.dumps(line) async for line in lines))
+
+
+@app.get("/api/containers/logs")
+async def multi_container_logs(
+    req: Request,
+    ids: str = "",
+    project: str = "",
+    tail: int = config.LOGS_DEFAULT_TAIL,
+    since: str = "",
+    follow: bool = False,
+    q: str = "",
+    regex: bool = False,
+    format: str = "sse",
+):
+    # logs of several containers (?ids=a,b or every container of ?project=) interleaved by timestamp
+    if project:
+        ids = [
+            state.id
+            for host in docker_manager.hosts.values()
+            for state in host.state_index.containers.values()
+            if state.labels.get(PROJECT_LABEL) == project
+        ]
+    else:
+        ids = parse_id_filter(ids) or []
+    if not ids:
+        return JSONResponse(
+            content={"message": "No containers to read logs from"}, status_code=404
+        )
+    try:
+        reader = log_reader(tail, since, follow, q, regex)
+        containers = [await docker_manager.get_container(id) for id in ids]
+    except (ValueError, re.error) as e:
+        return JSONResponse(content={"message": str(e)}, status_code=400)
+    except DockerError as e:
+        return JSONResponse(content={"message": e.message}, status_code=e.status)
+    return log_response(req, reader.merge(containers), format)
+
+
+@app.get("/api/containers/{container_id}/logs")
+async def container_logs(
+    req: Request,
+    container_id: str,
+    tail: int = config.LOGS_DEFAULT_TAIL,
+    since: str = "",
+    follow: bool = False,
+    q: str = "",
+    regex: bool = False,
+    format: str = "sse",
+):
+    try:
+        reader = log_reader(tail, since, follow, q, regex)
+        container = await docker_manager.get_container(container_id)
+    except (ValueError, re.error) as e:
+        return JSONResponse(content={"message": str(e)}, status_code=400)
+    except DockerError as e:
+        return JSONResponse(content={"message": e.message}, status_code=e.status)
+    return log_response(req, reader.lines(container), format)
 
 
 @app.get("/api/containers/info/{container_id}")
-def info(container_id: str):
-    # get container information
-    # this function does not need to be async because get() is not asynchronous
-    return docker_manager.sync_client.containers.get(container_id=container_id).attrs
+async def info(container_id: str):
+    # get container information, served from the inspect cache when fresh
+    try:
+        return await inspect_cache.get(container_id)
+    except DockerError as e:
+        return JSONResponse(content={"message": e.message}, status_code=e.status)
+
+
+@app.get("/api/system/inspectcache")
+async def inspect_cache_stats():
+    return inspect_cache.stats()
+
+
+@app.get("/api/system/scheduler")
+async def scheduler_stats():
+    # slots in use and calls waiting per priority, and requests refused with 429
+    return scheduler.stats()
+
+
+@app.get("/api/system/loop")
+async def loop_stats():
+    # event loop lag in seconds and load on the blocking pool
+    return {
+        "lag": loop_monitor.last_lag,
+        "maxLag": loop_monitor.max_lag,
+        "blockingPending": docker_manager.blocking.pending,
+        "blockingWorkers": docker_manager.blocking.workers,
+    }
+
+
+@app.get("/api/system/diskusage")
+async def disk_usage_stats():
+    return disk_usage.stats()
+
+
+@app.get("/api/system/prune/plan")
+async def prune_plan(objects: str = ",".join(PRUNE_TYPES)):
+    # dry run: what pruning the given object types would remove, from the cached system df
+    to_prune = [obj for obj in objects.split(",") if obj]
+    unknown = [obj for obj in to_prune if obj not in PRUNE_TYPES]
+    if unknown:
+        return JSONResponse(
+            content={"message": f"Unknown object types: {unknown}"}, status_code=400
+        )
+    try:
+        await disk_usage.current()
+    except DockerError as e:
+        return JSONResponse(content={"message": e.message}, status_code=e.status)
+    except (OSError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return JSONResponse(
+            content={"message": f"Docker daemon unreachable: {e!r}"}, status_code=503
+        )
+    return disk_usage.plan(to_prune)
 
 
 @app.post("/api/system/prune")
 async def prune_system(req: Request):
-    data = await req.json()
-    objects_to_prune: List[str] = data["objectsToPrune"]
-    # logger.info(f"Objects: {objects_to_prune}")
+    # containers are pruned first, removing them frees images, volumes and networks for the
+    # other prunes, which then run concurrently
+    # ?stream=ndjson or ?stream=sse sends each object type's result as soon as it finishes
+    stream = req.query_params.get("stream")
     try:
-        res = {}
-        for obj in objects_to_prune:
-            if obj == "containers":
-                pruned_containers = docker_manager.sync_client.containers.prune()
-                res["Containers"] = pruned_containers
-            elif obj == "images":
-                pruned_images = docker_manager.sync_client.images.prune()
-                res["Images"] = pruned_images
-            elif obj == "volumes":
-                pruned_volumes = docker_manager.sync_client.volumes.prune()
-                res["Volumes"] = pruned_volumes
-            elif obj == "networks":
-                pruned_networks = docker_manager.sync_clientT.networks.prune()
-                res["Networks"] = pruned_networks
-                break
-
-        # res['containers'] -> list or None ['ContainersDeleted], ['SpaceReclaimed']
-        # res['images'] -> list or None ['ImagesDeleted'], ['SpaceReclaimed']
-        # res['volumes'] -> list or None ['VolumesDelete'], ['SpaceReclaimed']
-        # res['networks'] -> list or None ['NetworksDeleted']
-        async def schedule_messages(object_type: str, res: dict, redis):
-            # get number of objects deleted
-            # logger.info(f"Scheduling message for object: {object_type} after pruning")
-            num_deleted = (
-                0
-                if res[object_type][f"{object_type}Deleted"] is None
-                else len(res[object_type][f"{object_type}Deleted"])
-            )
-            space_reclaimed = (
-                0
-                if object_type == "Networks"
-                else convert_from_bytes(res[object_type]["SpaceReclaimed"])
-            )
+        scheduler.admit("background")
+    except Overloaded as e:
+        return overloaded(e)
+    data = await req.json()
+    objects_to_prune = [obj for obj in PRUNE_TYPES if obj in data["objectsToPrune"]]
+
+    async def prune(obj: str) -> dict:
+        # the report has e.g. ContainersDeleted (list or None) and SpaceReclaimed,
+        # networks only NetworksDeleted
+        object_type = obj.capitalize()
+        try:
+            report = await docker_manager.prune(obj)
+        except (DockerError, OSError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # an unreachable daemon fails each prune on its own, like a daemon error
+            if isinstance(e, DockerError):
+                status, message = e.status, e.message
+            else:
+                status, message = 503, f"Docker daemon unreachable: {e!r}"
             await publish_message_data(
-                f"{object_type} pruned successfully: {num_deleted} deleted, {space_reclaimed} space reclaimed",
-                "Success",
-                redis=redis,
+                f"{object_type} prune failed: {message}",
+                "Error",
+                messages=message_log,
             )
+            return {
+                "type": "error",
+                "objectType": obj,
+                "statusCode": status,
+                "message": message,
+            }
+        num_deleted = len(report.get(f"{object_type}Deleted") or [])
+        space_reclaimed = report.get("SpaceReclaimed") or 0
+        await publish_message_data(
+            f"{object_type} pruned successfully: {num_deleted} deleted, "
+            f"{convert_from_bytes(space_reclaimed)} space reclaimed",
+            "Success",
+            messages=message_log,
+        )
+        return {
+            "type": "success",
+            "objectType": obj,
+            "deleted": num_deleted,
+            "spaceReclaimed": space_reclaimed,
+        }
+
+    async def results():
+        try:
+            if "containers" in objects_to_prune:
+                yield await prune("containers")
+            others = [
+                asyncio.create_task(prune(obj))
+                for obj in objects_to_prune
+                if obj != "containers"
+            ]
+            for done in asyncio.as_completed(others):
+                yield await done
+        finally:
+            disk_usage.refresh_soon()
+
+    if stream in ("ndjson", "sse"):
+
+        async def result_stream():
+            failed = 0
+            async for res in results():
+                failed += res["type"] == "error"
+                yield res
+            yield {
+                "type": "summary",
+                "succeeded": len(objects_to_prune) - failed,
+                "failed": failed,
+            }
+
+        # every prune, the container one too, keeps running if the client goes away
+        streamed = detached(result_stream())
+        if stream == "sse":
+            return event_source(req, (json.dumps(res) async for res in streamed))
+        return StreamingResponse(
+            (f"{json.dumps(res)}\n" async for res in streamed),
+            media_type="application/x-ndjson",
+        )
 
-        # schedules message sending based on keys in result dict from pruning
-        tasks = [schedule_messages(key, res, redis) for key in res.keys()]
-        await asyncio.gather(*tasks)
-
+    pruned = [res async for res in results()]
+    if any(res["type"] == "error" for res in pruned):
         return JSONResponse(
-            content={"message": "System prune successfull"}, status_code=200
+            content={"message": "API error", "results": pruned}, status_code=400
         )
-    except DockerError as e:
-        await publish_message_data("API error, please try again", "Error", redis=redis)
-        return JSONResponse(content={"message": "API error"}, status_code=400)
+    return JSONResponse(
+        content={"message": "System prune successfull", "results": pruned},
+        status_code=200,
+    )
 
 
 @app.post("/api/containers/run")
@@ -365,14 +1204,39 @@ async def delete_images(req: Request):
     )
 
 
+@app.post("/api/volumes/delete")
+async def delete_volumes(req: Request):
+    return await perform_action(
+        req,
+        docker_manager.delete_volume,
+        ObjectType.VOLUME,
+        success_msg="Volumes deleted",
+        error_msg="Error, check if containers use the volumes",
+    )
+
+
+@app.post("/api/networks/delete")
+async def delete_networks(req: Request):
+    return await perform_action(
+        req,
+        docker_manager.delete_network,
+        ObjectType.NETWORK,
+        success_msg="Networks deleted",
+        error_msg="Error, check if containers are attached to the networks",
+    )
+
+
 @app.post("/api/images/pull")
 async def pull_images(req: Request):
     return await perform_action(
         req,
-        docker_manager.pull_image,
+        pull_image_job,
         ObjectType.IMAGE,
         success_msg="Image pulled",
         error_msg="Error",
+        priority="background",
+        # a pull runs until the shared pull job is done, however large the image
+        timeout=None,
     )
 
 
@@ -384,13 +1248,12 @@ async def upload_file(req: Request):
         yaml_contents = data.get("yamlContents")
 
         # Create a new file with the project name as the filename and .yml as the extension
-        async with aiofiles.open(
-            f"./composefiles/{project_name}.yaml", "w"
-        ) as out_file:
+        async with aiofiles.open(compose_index.path(project_name), "w") as out_file:
             await out_file.write(yaml_contents)
+        await compose_index.refresh(project_name)
 
         await publish_message_data(
-            f"Uploaded: {project_name}.yaml", "Success", redis=redis
+            f"Uploaded: {project_name}.yaml", "Success", messages=message_log
         )
         return JSONResponse(
             content={"message": f"Successfully uploaded {project_name}.yaml"},
@@ -398,7 +1261,7 @@ async def upload_file(req: Request):
         )
     except Exception as e:
         await publish_message_data(
-            f"API error, please try again: {e}", "Error", redis=redis
+            f"API error, please try again: {e}", "Error", messages=message_log
         )
         return JSONResponse(
             content={"message": "Error processing uploaded file"}, status_code=400
@@ -411,9 +1274,11 @@ async def delete_compose_file(req: Request):
     # logger.info(f"File to delete: {data}")
     file_to_delete = data.get("projectName")
     try:
-        os.remove(f"./composefiles/{file_to_delete}.yaml")
+        os.remove(compose_index.path(file_to_delete))
+        compose_index.remove(file_to_delete)
+        compose_manager.forget(file_to_delete)
         await publish_message_data(
-            f"Successfully deleted {file_to_delete}", "Success", redis=redis
+            f"Successfully deleted {file_to_delete}", "Success", messages=message_log
         )
         return JSONResponse(
             content={"message": f"Successfully deleted {file_to_delete}"},
@@ -421,7 +1286,7 @@ async def delete_compose_file(req: Request):
         )
     except Exception as e:
         await publish_message_data(
-            f"API error, please try again: {e}", "Error", redis=redis
+            f"API error, please try again: {e}", "Error", messages=message_log
         )
         return JSONResponse(
             content={"message": f"Error deleting file: {e}"}, status_code=400
@@ -433,26 +1298,22 @@ async def run_compose_file(req: Request):
     data = await req.json()
     # get path of file to run
     file_to_run = data.get("projectName")
-    file_path = f"./composefiles/{file_to_run}.yaml"
-    # project name is the name of the file
-    project_name = file_to_run.split(".")[0]
     try:
-        # create docker client
-        # logger.info("Attempting to compose up")
-        docker = DockerClient(
-            compose_files=[file_path], compose_project_name=project_name
-        )
-        docker.compose.up(detach=True)
+        # waits for a run of the same project that is already in progress
+        scheduler.admit("background")
+        await compose_manager.run(file_to_run, "up")
         await publish_message_data(
-            f"Compose up successful: {file_to_run}", "Success", redis=redis
+            f"Compose up successful: {file_to_run}", "Success", messages=message_log
         )
         return JSONResponse(
             content={"message": f"Compose up successful: {file_to_run}"},
             status_code=200,
         )
-    except DockerException as e:
+    except Overloaded as e:
+        return overloaded(e)
+    except ComposeError as e:
         await publish_message_data(
-            f"API error, please try again: {e}", "Error", redis=redis
+            f"API error, please try again: {e}", "Error", messages=message_log
         )
         return JSONResponse(
             content={"message": f"Docker compose error: {e}"}, status_code=400
@@ -464,28 +1325,134 @@ async def compose_down(req: Request):
     data = await req.json()
     # get path of file to run
     file_to_run = data.get("projectName")
-    file_path = f"./composefiles/{file_to_run}.yaml"
-    # project name is the name of the file
-    project_name = file_to_run.split(".")[0]
-    # read the project name from the Docker Compose file
     try:
-        # create docker client
-        # logger.info("Attempting to compose up")
-        docker = DockerClient(
-            compose_files=[file_path], compose_project_name=project_name
-        )
-        docker.compose.down()
+        # waits for a run of the same project that is already in progress
+        scheduler.admit("background")
+        await compose_manager.run(file_to_run, "down")
         await publish_message_data(
-            f"Compose down successful: {file_to_run}", "Success", redis=redis
+            f"Compose down successful: {file_to_run}", "Success", messages=message_log
         )
         return JSONResponse(
             content={"message": f"Compose down successful: {file_to_run}"},
             status_code=200,
         )
-    except DockerException as e:
+    except Overloaded as e:
+        return overloaded(e)
+    except ComposeError as e:
         await publish_message_data(
-            f"API error, please try again: {e}", "Error", redis=redis
+            f"API error, please try again: {e}", "Error", messages=message_log
         )
         return JSONResponse(
             content={"message": f"Docker compose error: {e}"}, status_code=400
         )
+
+
+@app.post("/api/jobs/pull")
+async def pull_image_background(req: Request):
+    data = await req.json()
+    from_image = data.get("image")
+    if not from_image:
+        return JSONResponse(content={"message": "image is required"}, status_code=400)
+    try:
+        scheduler.admit("background")
+        job = submit_pull_job(from_image, data.get("tag", ""), data.get("host"))
+    except Overloaded as e:
+        return overloaded(e)
+    except KeyError as e:
+        return JSONResponse(
+            content={"message": f"Unknown docker host: {e}"}, status_code=400
+        )
+    return job_accepted(*job)
+
+
+@app.post("/api/compose/bulk")
+async def compose_bulk(req: Request):
+    # runs up or down for several projects in parallel, one result per project
+    data = await req.json()
+    action = data.get("action")
+    project_files = data.get("projectNames", [])
+    if action not in ("up", "down"):
+        return JSONResponse(
+            content={"message": f"Unknown compose action: {action}"}, status_code=400
+        )
+    try:
+        scheduler.admit("background")
+    except Overloaded as e:
+        return overloaded(e)
+    results = [res async for res in compose_manager.bulk(action, project_files)]
+    succeeded = [res["objectId"] for res in results if res["type"] == "success"]
+    failed = [res["message"] for res in results if res["type"] == "error"]
+    if succeeded:
+        await publish_message_data(
+            f"Compose {action} successful ({len(succeeded)}): {succeeded}",
+            "Success",
+            messages=message_log,
+        )
+    if failed:
+        await publish_message_data(
+            f"Compose {action} failed: {failed}", "Error", messages=message_log
+        )
+    return JSONResponse(
+        content={"results": results, "succeeded": len(succeeded), "failed": len(failed)},
+        status_code=400 if failed else 200,
+    )
+
+
+@app.get("/api/compose/status")
+async def compose_status():
+    return {"projects": compose_manager.status()}
+
+
+@app.get("/api/streams/composestatus")
+async def stream_compose_status(req: Request):
+    return event_source(req, subscribe_to_channel(req, compose_manager.chan, hub))
+
+
+@app.post("/api/jobs/compose/{action}")
+async def compose_background(action: str, req: Request):
+    if action not in ("up", "down"):
+        return JSONResponse(
+            content={"message": f"Unknown compose action: {action}"}, status_code=404
+        )
+    data = await req.json()
+    project_file = data.get("projectName")
+    if not project_file:
+        return JSONResponse(
+            content={"message": "projectName is required"}, status_code=400
+        )
+    try:
+        scheduler.admit("background")
+    except Overloaded as e:
+        return overloaded(e)
+    return job_accepted(*submit_compose_job(project_file, action))
+
+
+@app.get("/api/jobs")
+async def list_jobs():
+    return [job.to_dict() for job in job_manager.jobs.values()]
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(content={"message": "Job not found"}, status_code=404)
+    return job.to_dict()
+
+
+@app.get("/api/jobs/{job_id}/stream")
+async def stream_job(job_id: str, req: Request):
+    job = job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(content={"message": "Job not found"}, status_code=404)
+
+    async def event_stream():
+        # resumes after the last event the client saw when the browser reconnects
+        last_event_id = req.headers.get("last-event-id", "")
+        after = int(last_event_id) if last_event_id.isdigit() else 0
+        async for event in job.follow(after):
+            if await req.is_disconnected():
+                break
+            yield {"id": str(event["seq"]), "data": json.dumps(event)}
+
+    return event_source(req, event_stream())
@@ -0,0 +1,173 @@
+# message_log keeps the toasts shown by the frontend in a capped redis stream instead of pubsub
+# messages published within a short window are written as one batch entry, a single XREAD reader
+# hands new entries to the hub, and clients reconnecting with Last-Event-ID catch up with XRANGE
+# without redis (the embedded publisher mode) entries are kept in a capped deque instead,
+# with ids of the same shape, so catching up works the same within one process lifetime
+
+import asyncio
+import json
+import re
+import time
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+from aioredis import Redis
+from fastapi.requests import Request
+from instrumentation import REDIS_LATENCY
+from logger import Logger
+from stream_hub import StreamHub
+import config
+
+STREAM_ID = re.compile(r"^(\d+)-(\d+)$")
+
+
+def parse_stream_id(value: str) -> Optional[Tuple[int, int]]:
+    match = STREAM_ID.match(value or "")
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+class MessageLog:
+    def __init__(
+        self,
+        hub: StreamHub,
+        key: str = config.MESSAGE_LOG_KEY,
+        maxlen: int = config.MESSAGE_LOG_MAXLEN,
+        batch_window: float = config.MESSAGE_BATCH_WINDOW,
+        chan: str = "server_messages",
+    ):
+        self.hub = hub
+        self.key = key
+        self.maxlen = maxlen
+        self.batch_window = batch_window
+        self.chan = chan
+        self.redis: Redis = None
+        # entries as (id, data) while running without redis
+        self._entries: Deque[Tuple[str, str]] = deque(maxlen=maxlen)
+        self._appended_id = (0, 0)
+        # messages waiting for the current batch window to close
+        self._pending: List[dict] = []
+        self._flush_task: asyncio.Task = None
+        self._task: asyncio.Task = None
+        self.logger = Logger(__name__)
+        hub.add_local_channel(chan)
+
+    def set_redis(self, redis: Redis):
+        self.redis = redis
+
+    async def start(self):
+        if self.redis is not None:
+            self._task = asyncio.create_task(self._read())
+
+    async def close(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            # write what is still pending instead of dropping it
+            self._flush_task.cancel()
+            await self._flush()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def publish(self, message: str, category: str):
+        self._pending.append(
+            {"text": message, "category": category, "timeSent": time.time()}
+        )
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.batch_window)
+        await self._flush()
+
+    async def _flush(self):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        if self.redis is None:
+            self._append(json.dumps(batch))
+            return
+        try:
+            with REDIS_LATENCY.time("xadd"):
+                await self.redis.xadd(
+                    self.key, {"data": json.dumps(batch)}, maxlen=self.maxlen
+                )
+        except Exception as e:
+            self.logger.error("Failed to write %d server messages: %s", len(batch), e)
+
+    def _append(self, data: str):
+        # XADD's id scheme: ms clock, sequence within the ms, never going backwards
+        ms = int(time.time() * 1000)
+        last_ms, seq = self._appended_id
+        self._appended_id = (ms, 0) if ms > last_ms else (last_ms, seq + 1)
+        id = f"{self._appended_id[0]}-{self._appended_id[1]}"
+        self._entries.append((id, data))
+        self.hub.publish_local(self.chan, {"id": id, "data": data})
+
+    async def since(self, last_id: str) -> List[Tuple[str, str]]:
+        # entries after last_id, oldest first, as (id, json array of messages)
+        if self.redis is None:
+            after = parse_stream_id(last_id)
+            return [(id, d) for id, d in self._entries if parse_stream_id(id) > after]
+        with REDIS_LATENCY.time("xrange"):
+            entries = await self.redis.xrange(self.key, min=last_id, max="+")
+        return [
+            (id.decode(), fields[b"data"].decode())
+            for id, fields in entries
+            if id.decode() != last_id
+        ]
+
+    async def _last_id(self) -> str:
+        entries = await self.redis.xrevrange(self.key, max="+", min="-", count=1)
+        return entries[0][0].decode() if entries else "0-0"
+
+    async def _read(self):
+        # the one XREAD loop of the process, every client follows it through the hub
+        last_id = None
+        while True:
+            try:
+                if last_id is None:
+                    last_id = await self._last_id()
+                response = await self.redis.xread(
+                    {self.key: last_id}, count=100, block=5000
+                )
+                for _, entries in response or []:
+                    for id, fields in entries:
+                        last_id = id.decode()
+                        # the id starts with the redis clock in ms at XADD
+                        REDIS_LATENCY.observe(
+                            max(time.time() - parse_stream_id(last_id)[0] / 1000, 0),
+                            "xread_delivery",
+                        )
+                        self.hub.publish_local(
+                            self.chan, {"id": last_id, "data": fields[b"data"].decode()}
+                        )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error("Reading %s failed, retrying: %s", self.key, e)
+                await asyncio.sleep(config.STREAM_RECONNECT_DELAY)
+
+    async def follow(self, req: Request, last_id: str = None):
+        # SSE events for one client; a client that reconnects with Last-Event-ID, or that fell
+        # behind and had frames dropped, is caught up from the stream itself
+        sub = self.hub.subscribe(self.chan, replay=False)
+        try:
+            if parse_stream_id(last_id) is not None:
+                for id, data in await self.since(last_id):
+                    last_id = id
+                    yield {"id": id, "data": data}
+            else:
+                last_id = None
+            async for frame in sub:
+                if await req.is_disconnected():
+                    break
+                if sub.take_missed() and last_id is not None:
+                    for id, data in await self.since(last_id):
+                        last_id = id
+                        yield {"id": id, "data": data}
+                if last_id is not None and parse_stream_id(
+                    frame["id"]
+                ) <= parse_stream_id(last_id):
+                    continue
+                last_id = frame["id"]
+                yield frame
+        finally:
+            self.hub.unsubscribe(sub)
@@ -0,0 +1,181 @@
+# metrics_history keeps recent container stats in fixed-size ring buffers backed by arrays
+# every container gets a coarse tier (min/max/avg per slot), and a fine tier (1s slots) once
+# a client asks for its history, until nobody asked for a whole fine window; so memory per
+# container is fixed no matter how long it runs, and only charted containers pay for 1s slots
+
+import json
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import config
+
+# stats fields recorded from the container_metrics messages
+FIELDS = ("CpuPercent", "MemoryPercent", "MemoryUsage")
+
+
+class _Tier:
+    # slot i holds the bucket starting at ts[i], a slot whose ts is stale is reused in place
+    def __init__(self, slots: int, resolution: int, keep_extremes: bool):
+        self.slots = slots
+        self.resolution = resolution
+        self.ts = array("I", bytes(4 * slots))
+        self.count = array("H", bytes(2 * slots))
+        self.avg = [array("f", bytes(4 * slots)) for _ in FIELDS]
+        # the fine tier only stores the average of its slot, min and max are derived from it
+        self.min = [array("f", bytes(4 * slots)) for _ in FIELDS] if keep_extremes else None
+        self.max = [array("f", bytes(4 * slots)) for _ in FIELDS] if keep_extremes else None
+
+    def add(self, now: int, values: List[float]):
+        bucket = now - now % self.resolution
+        i = (bucket // self.resolution) % self.slots
+        if self.ts[i] != bucket:
+            self.ts[i] = bucket
+            self.count[i] = 0
+        n = self.count[i] = min(self.count[i] + 1, 0xFFFF)
+        for f, value in enumerate(values):
+            # running mean so a slot never needs more than one value per field
+            if n == 1:
+                self.avg[f][i] = value
+            else:
+                self.avg[f][i] += (value - self.avg[f][i]) / n
+            if self.min is not None:
+                if n == 1 or value < self.min[f][i]:
+                    self.min[f][i] = value
+                if n == 1 or value > self.max[f][i]:
+                    self.max[f][i] = value
+
+    def window(self) -> int:
+        return self.slots * self.resolution
+
+    def samples(self, start: int, end: int):
+        # yields (ts, count, index) for every filled slot in [start, end]
+        for i in range(self.slots):
+            ts = self.ts[i]
+            if self.count[i] and start <= ts <= end:
+                yield ts, self.count[i], i
+
+
+class ContainerHistory:
+    def __init__(self):
+        self.coarse = _Tier(
+            config.METRICS_HISTORY_COARSE_SLOTS,
+            config.METRICS_HISTORY_COARSE_RESOLUTION,
+            keep_extremes=True,
+        )
+        self.fine: Optional[_Tier] = None
+        # the first coarse slot boundary after the fine tier was created, it holds
+        # everything from there on, and when a client last asked for the history
+        self.fine_since = 0
+        self.viewed_at = 0
+
+    def view(self, now: int):
+        # called for every query, starts recording at 1s from now on
+        self.viewed_at = now
+        if self.fine is None:
+            self.fine = _Tier(config.METRICS_HISTORY_FINE_SLOTS, 1, keep_extremes=False)
+            resolution = self.coarse.resolution
+            self.fine_since = now - now % resolution + resolution
+
+    def add(self, now: int, values: List[float]):
+        if self.fine is not None:
+            if now - self.viewed_at > self.fine.window():
+                # unviewed for longer than it remembers
+                self.fine = None
+            else:
+                self.fine.add(now, values)
+        self.coarse.add(now, values)
+
+    def downsample(self, seconds: int, points: int, now: int) -> dict:
+        # min/max/avg of every field over `points` equal buckets covering the last `seconds`
+        start = now - seconds
+        if self.fine is not None and seconds <= self.fine.window():
+            # what came before the fine tier existed comes from the coarse tier
+            resolution = self.fine.resolution
+            segments = [
+                (self.coarse, start, self.fine_since - 1),
+                (self.fine, max(start, self.fine_since), now),
+            ]
+        else:
+            resolution = self.coarse.resolution
+            segments = [(self.coarse, start, now)]
+        width = max(seconds / points, resolution)
+        buckets: Dict[int, list] = {}
+        for tier, low_ts, high_ts in segments:
+            for ts, count, i in tier.samples(low_ts, high_ts):
+                b = min(int((max(ts, start) - start) // width), points - 1)
+                bucket = buckets.get(b)
+                if bucket is None:
+                    # per field: min, max, weighted sum, plus the total sample count
+                    bucket = buckets[b] = [
+                        [float("inf"), float("-inf"), 0.0] for _ in FIELDS
+                    ] + [0]
+                for f in range(len(FIELDS)):
+                    avg = tier.avg[f][i]
+                    low = tier.min[f][i] if tier.min is not None else avg
+                    high = tier.max[f][i] if tier.max is not None else avg
+                    stat = bucket[f]
+                    stat[0] = min(stat[0], low)
+                    stat[1] = max(stat[1], high)
+                    stat[2] += avg * count
+                bucket[-1] += count
+        result = []
+        for b in sorted(buckets):
+            bucket = buckets[b]
+            point = {"time": start + b * width}
+            for f, field in enumerate(FIELDS):
+                low, high, total = bucket[f]
+                point[field] = {"min": low, "max": high, "avg": total / bucket[-1]}
+            result.append(point)
+        return {"resolution": width, "points": result}
+
+
+class MetricsHistory:
+    def __init__(self, max_containers: int = config.METRICS_HISTORY_MAX_CONTAINERS):
+        self.max_containers = max_containers
+        # least recently updated first, so eviction pops from the front
+        self._containers: "OrderedDict[str, ContainerHistory]" = OrderedDict()
+
+    def record(self, frame: str):
+        # hub listener for container_metrics messages
+        try:
+            stats = json.loads(frame)
+            id = stats["ID"]
+        except (ValueError, TypeError, KeyError):
+            return
+        if "Message" in stats:
+            # container deleted, free its buffers
+            self._containers.pop(id, None)
+            return
+        history = self._containers.get(id)
+        if history is None:
+            if len(self._containers) >= self.max_containers:
+                self._containers.popitem(last=False)
+            history = self._containers[id] = ContainerHistory()
+        else:
+            self._containers.move_to_end(id)
+        history.add(int(time.time()), [float(stats.get(field) or 0) for field in FIELDS])
+
+    def find(self, id: str) -> Optional[str]:
+        # resolves a full or short container id to the id the history is kept under
+        if id in self._containers:
+            return id
+        return next((key for key in self._containers if key.startswith(id)), None)
+
+    def query(self, id: str, seconds: int, points: int) -> Optional[dict]:
+        key = self.find(id)
+        if key is None:
+            return None
+        history = self._containers[key]
+        now = int(time.time())
+        history.view(now)
+        result = history.downsample(seconds, points, now)
+        result["id"] = key
+        return result
+
+    def __len__(self):
+        return len(self._containers)
+
+    def fine_count(self) -> int:
+        # containers recording at 1s, those somebody charted in the last fine window
+        return sum(h.fine is not None for h in self._containers.values())
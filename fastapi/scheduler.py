@@ -0,0 +1,273 @@
+# scheduler admits the calls that change docker state (container actions, deletes, pulls,
+# prunes and compose runs) in priority order, so the bulk actions and pulls of a few users
+# cannot saturate the daemon and hold up everybody's interactive start and stop
+# at most `concurrency` calls run at once, background ones at most `background` of them so
+# interactive calls find a free slot soon, and one client at most `per_client`; a request
+# is refused with a retry delay once `max_queue` calls would run before its first one
+# the client of a call is taken from the request that made it, jobs started by a request
+# inherit it
+
+import asyncio
+import contextlib
+import functools
+import inspect
+import ipaddress
+import math
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Union
+from instrumentation import SCHEDULER_REJECTED, SCHEDULER_WAIT
+import config
+
+# a trusted reverse proxy's address or network
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+# highest first
+PRIORITIES = ("interactive", "normal", "background")
+# DockerManager methods that change docker state, by priority class
+DOCKER_PRIORITIES = {
+    "start_container": "interactive",
+    "stop_container": "interactive",
+    "restart_container": "interactive",
+    "kill_container": "interactive",
+    "pause_container": "interactive",
+    "resume_container": "interactive",
+    "run_container": "normal",
+    "delete_container": "normal",
+    "delete_image": "normal",
+    "delete_volume": "normal",
+    "delete_network": "normal",
+    "pull_image": "background",
+    "pull_image_stream": "background",
+    "prune": "background",
+}
+
+# the client the current request came from, calls outside requests share one client
+CLIENT: ContextVar[str] = ContextVar("scheduler_client", default="internal")
+
+
+class Overloaded(Exception):
+    # too many calls queued for a priority, answered with 429 and Retry-After
+    def __init__(self, priority: str, retry_after: int):
+        super().__init__(
+            f"Too many {priority} docker operations queued, retry in {retry_after}s"
+        )
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("client", "future", "queued_at")
+
+    def __init__(self, client: str, future: asyncio.Future):
+        self.client = client
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class Scheduler:
+    def __init__(
+        self,
+        concurrency: int = config.SCHEDULER_CONCURRENCY,
+        background: int = config.SCHEDULER_BACKGROUND_CONCURRENCY,
+        per_client: int = config.SCHEDULER_CLIENT_CONCURRENCY,
+        max_queue: int = config.SCHEDULER_MAX_QUEUE,
+    ):
+        self.concurrency = concurrency
+        self.per_client = per_client
+        self.max_queue = max_queue
+        self.limits = {
+            "interactive": concurrency,
+            "normal": concurrency,
+            "background": min(background, concurrency),
+        }
+        self.running: Dict[str, int] = {priority: 0 for priority in PRIORITIES}
+        # client -> calls it has running
+        self.clients: Dict[str, int] = {}
+        self.queues: Dict[str, Deque[_Waiter]] = {p: deque() for p in PRIORITIES}
+        self.admitted: Dict[str, int] = {priority: 0 for priority in PRIORITIES}
+        self.rejected: Dict[str, int] = {priority: 0 for priority in PRIORITIES}
+        # moving average of seconds a call holds its slot, for the retry delay
+        self._hold: Dict[str, float] = {priority: 1.0 for priority in PRIORITIES}
+
+    def ahead(self, priority: str, client: str) -> int:
+        # calls waiting that run before a new call of this priority from client: its own,
+        # and those of other clients below their limit, the rest wait for their own calls
+        rank = PRIORITIES.index(priority)
+        return sum(
+            waiter.client == client
+            or self.clients.get(waiter.client, 0) < self.per_client
+            for p in PRIORITIES[: rank + 1]
+            for waiter in self.queues[p]
+        )
+
+    def admit(self, priority: str, client: str = None):
+        # checked once per request before any work, raises Overloaded when the queue is full
+        ahead = self.ahead(priority, client if client is not None else CLIENT.get())
+        if ahead < self.max_queue:
+            return
+        self.rejected[priority] += 1
+        SCHEDULER_REJECTED.inc(priority)
+        seconds = ahead / self.limits[priority] * self._hold[priority]
+        raise Overloaded(priority, min(max(math.ceil(seconds), 1), 60))
+
+    def _can_run(self, priority: str, client: str) -> bool:
+        return (
+            sum(self.running.values()) < self.concurrency
+            and self.running[priority] < self.limits[priority]
+            and self.clients.get(client, 0) < self.per_client
+        )
+
+    def _dispatch(self):
+        # starts waiting calls by priority, then age, skipping clients at their limit
+        for priority in PRIORITIES:
+            queue = self.queues[priority]
+            for waiter in list(queue):
+                if sum(self.running.values()) >= self.concurrency:
+                    return
+                if waiter.future.done():
+                    # cancelled while waiting
+                    queue.remove(waiter)
+                elif self._can_run(priority, waiter.client):
+                    queue.remove(waiter)
+                    self._take(priority, waiter.client)
+                    waiter.future.set_result(None)
+
+    def _take(self, priority: str, client: str):
+        self.running[priority] += 1
+        self.clients[client] = self.clients.get(client, 0) + 1
+        self.admitted[priority] += 1
+
+    def _release(self, priority: str, client: str, held: float):
+        self.running[priority] -= 1
+        self.clients[client] -= 1
+        if not self.clients[client]:
+            del self.clients[client]
+        self._hold[priority] = 0.8 * self._hold[priority] + 0.2 * held
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: str, client: str = None):
+        client = client if client is not None else CLIENT.get()
+        waiter = _Waiter(client, asyncio.get_running_loop().create_future())
+        self.queues[priority].append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # the slot was granted right before the cancellation
+                self._release(priority, client, 0.0)
+            elif waiter in self.queues[priority]:
+                self.queues[priority].remove(waiter)
+            raise
+        started = time.monotonic()
+        SCHEDULER_WAIT.observe(started - waiter.queued_at, priority)
+        try:
+            yield
+        finally:
+            self._release(priority, client, time.monotonic() - started)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "limits": {
+                "concurrency": self.concurrency,
+                "perClient": self.per_client,
+                "maxQueue": self.max_queue,
+                **self.limits,
+            },
+            "running": self.running,
+            "queued": {priority: len(queue) for priority, queue in self.queues.items()},
+            "oldestWaitSeconds": {
+                priority: now - queue[0].queued_at if queue else 0.0
+                for priority, queue in self.queues.items()
+            },
+            "clients": self.clients,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+def schedule(obj, scheduler: Scheduler, priorities: Dict[str, str]):
+    # wraps the named coroutine and async generator methods of obj so every call holds a
+    # slot of its priority while it runs, a generator until it is exhausted or closed
+    for name, priority in priorities.items():
+        method = getattr(obj, name, None)
+        if method is None:
+            continue
+        if inspect.isasyncgenfunction(method):
+            wrapper = _scheduled_generator(method, scheduler, priority)
+        else:
+            wrapper = _scheduled_coroutine(method, scheduler, priority)
+        wrapper.priority = priority
+        setattr(obj, name, wrapper)
+    return obj
+
+
+def _scheduled_coroutine(method, scheduler: Scheduler, priority: str):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        async with scheduler.slot(priority):
+            return await method(*args, **kwargs)
+
+    return wrapper
+
+
+def _scheduled_generator(method, scheduler: Scheduler, priority: str):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        async with scheduler.slot(priority):
+            async for item in method(*args, **kwargs):
+                yield item
+
+    return wrapper
+
+
+def parse_proxies(value: str) -> List[Network]:
+    # "127.0.0.1,172.16.0.0/12" -> networks, a plain address is a network of one
+    return [
+        ipaddress.ip_network(entry.strip(), strict=False)
+        for entry in value.split(",")
+        if entry.strip()
+    ]
+
+
+def _trusted(address: str, proxies: List[Network]) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in proxies)
+
+
+def client_of(scope, proxies: List[Network] = ()) -> str:
+    # the peer address, or behind trusted reverse proxies the nearest forwarded address
+    # that is not one of them; proxies append to X-Forwarded-For, so it is read from the
+    # right and whatever a client wrote into it itself is never reached
+    client = scope.get("client")
+    address = client[0] if client else "unknown"
+    if not _trusted(address, proxies):
+        return address
+    forwarded = []
+    for name, value in scope.get("headers", ()):
+        if name == b"x-forwarded-for":
+            forwarded += value.decode("latin-1").split(",")
+    for hop in reversed(forwarded):
+        address = hop.strip()
+        if not _trusted(address, proxies):
+            break
+    return address
+
+
+class ClientMiddleware:
+    # plain ASGI middleware, sets CLIENT for the request's task and the tasks it starts
+    def __init__(self, app, trusted_proxies: str = config.TRUSTED_PROXIES):
+        self.app = app
+        self.proxies = parse_proxies(trusted_proxies)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            CLIENT.set(client_of(scope, self.proxies))
+        await self.app(scope, receive, send)
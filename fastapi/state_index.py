@@ -0,0 +1,232 @@
+# state_index keeps the state of every container and image in memory, seeded once from the daemon
+# and kept current by a single docker events subscription, so actions can check preconditions
+# without inspecting each container first
+
+import asyncio
+import calendar
+import re
+from typing import Callable, Dict, List, Optional
+import aiodocker
+from logger import Logger
+import config
+
+# container status each event action leaves the container in
+EVENT_STATUS = {
+    "create": "created",
+    "start": "running",
+    "restart": "running",
+    "unpause": "running",
+    "pause": "paused",
+    "die": "exited",
+    "stop": "exited",
+}
+IMAGE_ACTIONS = {"pull", "tag", "untag", "delete", "import", "load"}
+# RFC 3339 with up to nanoseconds, like SystemTime in /info
+SYSTEM_TIME = re.compile(
+    r"(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d+))?(Z|[+-]\d\d:\d\d)$"
+)
+
+
+def parse_system_time(value: str) -> int:
+    # nanoseconds since the epoch, on the daemon's clock; raises ValueError
+    match = SYSTEM_TIME.match(value)
+    if match is None:
+        raise ValueError(f"Unexpected daemon time: {value}")
+    *fields, fraction, zone = match.groups()
+    seconds = calendar.timegm(tuple(int(field) for field in fields))
+    if zone != "Z":
+        offset = int(zone[1:3]) * 3600 + int(zone[4:6]) * 60
+        seconds -= offset if zone[0] == "+" else -offset
+    return seconds * 10**9 + int((fraction or "0")[:9].ljust(9, "0"))
+
+
+class ContainerState:
+    __slots__ = ("id", "status", "name", "image", "labels")
+
+    def __init__(
+        self,
+        id: str,
+        status: str,
+        name: str = "",
+        image: str = "",
+        labels: dict = None,
+    ):
+        self.id = id
+        # docker's container state: created, running, paused, restarting, exited, removing, dead
+        self.status = status
+        self.name = name
+        self.image = image
+        self.labels = labels or {}
+
+    @property
+    def running(self) -> bool:
+        # matches State.Running from inspect, which stays true while paused or restarting
+        return self.status in ("running", "paused", "restarting")
+
+    @property
+    def paused(self) -> bool:
+        return self.status == "paused"
+
+
+class StateIndex:
+    def __init__(self, client: aiodocker.Docker = None):
+        # set by DockerManager.start when the client is created
+        self.client = client
+        self.containers: Dict[str, ContainerState] = {}
+        # image id -> repo tags
+        self.images: Dict[str, List[str]] = {}
+        self.ready = False
+        self._listeners: List[Callable[[dict], None]] = []
+        self._task: asyncio.Task = None
+        self._images_task: asyncio.Task = None
+        self.logger = Logger(__name__)
+
+    def add_listener(self, listener: Callable[[dict], None]):
+        # called with every docker event after the index applied it,
+        # and with {"Type": "resync"} whenever the index was rebuilt from scratch
+        self._listeners.append(listener)
+
+    def get(self, id: str) -> Optional[ContainerState]:
+        # accepts full ids, short ids and container names
+        state = self.containers.get(id)
+        if state is not None:
+            return state
+        for state in self.containers.values():
+            if state.id.startswith(id) or state.name == id:
+                return state
+        return None
+
+    def set_status(self, id: str, status: str):
+        # applied right after a successful action so repeated clicks see the new state
+        # before its event arrives
+        state = self.containers.get(id)
+        if state is not None:
+            state.status = status
+
+    def upsert_from_inspect(self, details: dict) -> ContainerState:
+        state = ContainerState(
+            details["Id"],
+            details["State"]["Status"],
+            details.get("Name", "").lstrip("/"),
+            details.get("Config", {}).get("Image", ""),
+            details.get("Config", {}).get("Labels"),
+        )
+        self.containers[state.id] = state
+        return state
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        for task in (self._task, self._images_task):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(
+            *[t for t in (self._task, self._images_task) if t is not None],
+            return_exceptions=True,
+        )
+        await self._stop_events()
+
+    async def _stop_events(self):
+        # resets aiodocker's events task so the next subscribe opens a new stream
+        if self.client is None:
+            return
+        try:
+            await self.client.events.stop()
+        except Exception:
+            # the task already ended with the error that closed the stream
+            self.client.events.task = None
+
+    async def seed(self):
+        containers = await self.client.containers.list(all=True)
+        self.containers = {
+            c.id: ContainerState(
+                c.id,
+                c["State"],
+                (c["Names"] or ["/"])[0].lstrip("/"),
+                c["Image"],
+                c["Labels"],
+            )
+            for c in containers
+        }
+        await self._refresh_images()
+        self.ready = True
+
+    async def _refresh_images(self):
+        images = await self.client.images.list(all=True)
+        self.images = {image["Id"]: image.get("RepoTags") or [] for image in images}
+
+    async def _run(self):
+        # the daemon's clock is read first, the stream asks for every event from then on and
+        # the seed comes last, so nothing that happens in between is missed; events older
+        # than the seed are already reflected in it and are skipped
+        # timeNano is the daemon's clock too, the panel's may be off from a remote host's
+        while True:
+            try:
+                info = await self.client.system.info()
+                seeded_at = parse_system_time(info["SystemTime"])
+                since = f"{seeded_at // 10**9}.{seeded_at % 10**9:09d}"
+                subscriber = self.client.events.subscribe(since=since)
+                await self.seed()
+                self._notify({"Type": "resync"})
+                while True:
+                    event = await subscriber.get()
+                    if event is None:
+                        # stream closed by the daemon
+                        break
+                    if event.get("timeNano", seeded_at) < seeded_at:
+                        continue
+                    self._apply(event)
+                    self._notify(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error("Docker events stream failed, resyncing: %s", e)
+            self.ready = False
+            await self._stop_events()
+            await asyncio.sleep(config.DOCKER_EVENTS_RECONNECT_DELAY)
+
+    def _apply(self, event: dict):
+        actor = event.get("Actor", {})
+        attributes = actor.get("Attributes", {})
+        action = event.get("Action", "")
+        if event.get("Type") == "container":
+            id = actor.get("ID", "")
+            if action == "destroy":
+                self.containers.pop(id, None)
+                return
+            state = self.containers.get(id)
+            if state is None:
+                state = self.containers[id] = ContainerState(
+                    id,
+                    "created",
+                    attributes.get("name", ""),
+                    attributes.get("image", ""),
+                    {
+                        key: value
+                        for key, value in attributes.items()
+                        if key not in ("name", "image")
+                    },
+                )
+            if action in EVENT_STATUS:
+                state.status = EVENT_STATUS[action]
+            elif action == "rename":
+                state.name = attributes.get("name", state.name)
+        elif event.get("Type") == "image" and action in IMAGE_ACTIONS:
+            # image events carry too little to patch the index, relist once a burst settles
+            if self._images_task is None or self._images_task.done():
+                self._images_task = asyncio.create_task(self._refresh_images_later())
+
+    async def _refresh_images_later(self):
+        await asyncio.sleep(0.5)
+        try:
+            await self._refresh_images()
+        except Exception as e:
+            self.logger.error("Failed to refresh images: %s", e)
+
+    def _notify(self, event: dict):
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                self.logger.error("State index listener failed: %s", e)
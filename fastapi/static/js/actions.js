@@ -23,6 +23,24 @@ function getInfo(containerId) {
   });
 }
 
+function rowKey(item) {
+  // lists merged from several docker hosts can hold the same image once per host
+  return item.Host ? `${item.Host}/${item.ID}` : item.ID;
+}
+
+function applyListFrame(entries, frame) {
+  // frames from ?mode=delta streams are either a full keyframe or the changes since the last frame
+  if (frame.type === 'full') {
+    entries.clear();
+    frame.items.forEach(item => entries.set(rowKey(item), item));
+  } else {
+    frame.removed.forEach(key => entries.delete(key));
+    frame.updated.forEach(item => entries.set(rowKey(item), item));
+    frame.added.forEach(item => entries.set(rowKey(item), item));
+  }
+  return Array.from(entries.values());
+}
+
 function getStatusClass(status) {
   switch (status) {
     case "running": return "success";
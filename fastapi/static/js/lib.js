@@ -58,7 +58,7 @@ $(document).ready(function () {
     var containerListSource = null;
     function initContainerListES() {
         if (containerListSource == null || containerListSource.readyState == 2) {
-            containerListSource = new EventSource(`${websiteUrl}/api/streams/containerlist`);
+            containerListSource = new EventSource(`${websiteUrl}/api/streams/containerlist?mode=delta`);
             containerListSource.onerror = function (event) {
                 if (containerListSource.readyState == 2) {
                     // retry connection to ES
@@ -68,8 +68,10 @@ $(document).ready(function () {
             var containersTbody = $("#containers-tbody");
             var previousStateContainers = {};
             var firstLoadContainerList = true;
+            // current list rebuilt from the keyframes and deltas of the stream
+            var containersById = new Map();
             containerListSource.onmessage = function (event) {
-                var data = JSON.parse(event.data);
+                var data = applyListFrame(containersById, JSON.parse(event.data));
                 // keep track of containerIds in the incoming data stream
                 var containerIds = new Set(data.map(container => container.ID));
                 // remove any rows with IDs not in the set
@@ -145,9 +147,12 @@ $(document).ready(function () {
     initContainerListES();
 
     var messagesSource = null;
+    // id of the last message batch received, a new EventSource resumes after it
+    let lastMessageId = null;
     function initMessageES() {
         if (messagesSource == null || messagesSource.readyState == 2) {
-            messagesSource = new EventSource(`${websiteUrl}/api/streams/servermessages`);
+            const resume = lastMessageId ? `?lastEventId=${encodeURIComponent(lastMessageId)}` : '';
+            messagesSource = new EventSource(`${websiteUrl}/api/streams/servermessages${resume}`);
             messagesSource.onerror = function (event) {
                 if (messagesSource.readyState == 2) {
                     // retry connection to ES
@@ -156,51 +161,57 @@ $(document).ready(function () {
             }
         }
         messagesSource.onmessage = function (event) {
-            var data = JSON.parse(event.data);
-            let icon;
-            let toastHeaderBgColor;
-            const uniqueId = 'toast' + Date.now();
-            const timeSent = new Date(data.timeSent * 1000);
-            const now = new Date();
-            const diffInMilliseconds = now - timeSent;
-            const diffInMinutes = Math.floor(diffInMilliseconds / 1000 / 60);
-            // if data.category is success use success, error uses danger
-            switch (data.category.toLowerCase()) {
-                case 'success':
-                    toastHeaderBgColor = 'success';
-                    icon = `<i class="fa-solid fa-circle-check text-light"></i>`;
-                    break;
-                case 'error':
-                    toastHeaderBgColor = 'danger';
-                    icon = `<i class="fa-solid fa-circle-exclamation  text-light"></i>`;
-                    break;
-            }
-            $('#toast-container').append(`
-              <div id="${uniqueId}" class="toast" role="alert" aria-live="assertive" aria-atomic="true">
-                <div class="toast-header d-flex align-items-center bg-${toastHeaderBgColor}">
-                    <span style="margin-right: 10px">${icon}</span>
-                    <strong class="me-auto  text-light">${data.category}</strong>
-                    <small class="text-light">${diffInMinutes} mins ago</small>
-                    <div data-bs-theme="dark">
-                        <button type="button" class="btn-close" data-bs-dismiss="toast" aria-label="Close"></button>
-                    </div>
-                </div>
-                <div class="toast-body">
-                  ${data.text}
+            // every event is a batch of messages published together
+            lastMessageId = event.lastEventId || lastMessageId;
+            const batch = JSON.parse(event.data);
+            (Array.isArray(batch) ? batch : [batch]).forEach(showToast);
+        };
+    }
+
+    function showToast(data) {
+        let icon;
+        let toastHeaderBgColor;
+        const uniqueId = 'toast' + Date.now() + Math.random().toString(36).substring(2, 8);
+        const timeSent = new Date(data.timeSent * 1000);
+        const now = new Date();
+        const diffInMilliseconds = now - timeSent;
+        const diffInMinutes = Math.floor(diffInMilliseconds / 1000 / 60);
+        // if data.category is success use success, error uses danger
+        switch (data.category.toLowerCase()) {
+            case 'success':
+                toastHeaderBgColor = 'success';
+                icon = `<i class="fa-solid fa-circle-check text-light"></i>`;
+                break;
+            case 'error':
+                toastHeaderBgColor = 'danger';
+                icon = `<i class="fa-solid fa-circle-exclamation  text-light"></i>`;
+                break;
+        }
+        $('#toast-container').append(`
+          <div id="${uniqueId}" class="toast" role="alert" aria-live="assertive" aria-atomic="true">
+            <div class="toast-header d-flex align-items-center bg-${toastHeaderBgColor}">
+                <span style="margin-right: 10px">${icon}</span>
+                <strong class="me-auto  text-light">${data.category}</strong>
+                <small class="text-light">${diffInMinutes} mins ago</small>
+                <div data-bs-theme="dark">
+                    <button type="button" class="btn-close" data-bs-dismiss="toast" aria-label="Close"></button>
                 </div>
-              </div>
             </div>
+            <div class="toast-body">
+              ${data.text}
+            </div>
+          </div>
+        </div>
           `);
-            // Initialize the toast
-            $('#' + uniqueId).toast('show');
-        };
+        // Initialize the toast
+        $('#' + uniqueId).toast('show');
     }
     initMessageES();
 
     var imageListSource = null;
     function initImageListES() {
         if (imageListSource == null || imageListSource.readyState == 2) {
-            imageListSource = new EventSource(`${websiteUrl}/api/streams/imagelist`);
+            imageListSource = new EventSource(`${websiteUrl}/api/streams/imagelist?mode=delta`);
             imageListSource.onerror = function (event) {
                 if (imageListSource.readyState == 2) {
                     // retry connection to ES
@@ -212,8 +223,10 @@ $(document).ready(function () {
         let previousStateImages = {};
         let firstLoadImageList = true;
         const imagesTbody = $("#images-tbody");
+        // current list rebuilt from the keyframes and deltas of the stream
+        const imagesById = new Map();
         imageListSource.onmessage = function (event) {
-            const data = JSON.parse(event.data);
+            const data = applyListFrame(imagesById, JSON.parse(event.data));
             // Created - timestamp
             // Id.split(":")[1].substring(12) - gets short id, otherwise complete hash
             // RepoTags[0] - name of image
@@ -304,11 +317,10 @@ $(document).ready(function () {
     var containerStatsSource = null;
     function initContainerStatsES() {
         if (containerStatsSource == null || containerStatsSource.readyState == 2) {
-            // container metrics are being populated individually instead of all at once
             // Go is publishing all individual container stats as messages to container_metrics channel
-            // so that means each message HAS an id for a container and stats for ONLY that container
-            // this is why containermetrics doesnt need to use id
-            containerStatsSource = new EventSource(`${websiteUrl}/api/streams/containermetrics`);//how come /containermetrics doesnt have the id
+            // the server batches them into one frame per interval holding the latest stats of every
+            // container that reported, plus the ids of containers that were deleted
+            containerStatsSource = new EventSource(`${websiteUrl}/api/streams/containermetrics?interval=1s`);
             containerStatsSource.onerror = function (event) {
                 if (containerStatsSource.readyState == 2) {
                     // retry connection to ES
@@ -322,12 +334,17 @@ $(document).ready(function () {
         const statsTbody = $("#stats-tbody");
 
         containerStatsSource.onmessage = function (event) {
-            const container = JSON.parse(event.data);
-            if (container['Message']) {
-                // delete row and return 
-                $("#stats-row-" + container.ID).remove();
-                return;
+            const frame = JSON.parse(event.data);
+            // delete rows of removed containers
+            frame.Deleted.forEach(id => $("#stats-row-" + id).remove());
+            frame.Stats.forEach(updateStatsRow);
+            if (frame.Stats.length && firstLoadStatsList) {
+                firstLoadStatsList = false;
             }
+            $("#stats-loading").hide();
+        };
+
+        function updateStatsRow(container) {
             let tr = statsTbody.find('#stats-row-' + container.ID);
             if (!tr.length) {
                 // If the row does not exist, create it
@@ -377,12 +394,7 @@ $(document).ready(function () {
             });
             // Store the current state of the container for the next update
             previousStateStats[container.ID] = container;
-
-            if (firstLoadStatsList) {
-                firstLoadStatsList = false;
-            }
-            $("#stats-loading").hide();
-        };
+        }
     }
     initContainerStatsES()
 
@@ -605,6 +617,32 @@ $(document).ready(function () {
         })
     });
 
+    // show what each prune would remove when the prune modal opens
+    $('#pruneModal').on('show.bs.modal', function () {
+        $.ajax({
+            url: `${websiteUrl}/api/system/prune/plan`,
+            type: 'GET',
+            success: function (plan) {
+                $('#individual-prune-selects input[type="checkbox"]').each(function () {
+                    const objectType = $(this).val();
+                    const estimate = plan.objects[objectType];
+                    const label = $(this).siblings('label');
+                    label.find('.prune-estimate').remove();
+                    if (estimate) {
+                        let text = ` (${estimate.count} unused`;
+                        if (objectType !== 'networks') {
+                            text += `, ${estimate.reclaimableHuman}`;
+                        }
+                        label.append($('<small class="text-muted prune-estimate"></small>').text(text + ')'));
+                    }
+                });
+            },
+            error: function (result) {
+                console.error(result);
+            }
+        });
+    });
+
     // handle prune check box
     $('#btncheck1').change(function () {
         $('#confirm-prune').toggleClass('disabled');
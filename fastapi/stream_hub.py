@@ -0,0 +1,360 @@
+# stream_hub keeps one redis subscription per channel and fans every message out to the SSE clients
+# each client reads from its own bounded queue so a slow browser can never hold up the others
+# the latest payload of every channel is cached so new clients get a first frame right away
+# channels started ahead of clients or with listeners keep their subscription, any other one
+# is dropped with its cache once it had no clients for STREAM_READER_IDLE_TIMEOUT
+
+import asyncio
+import json
+import time
+from collections import defaultdict, deque
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+from aioredis import Redis
+from instrumentation import HUB_FANOUT
+from logger import Logger
+import config
+
+# put on a subscriber's queue to end its iteration
+_CLOSED = object()
+
+
+class Subscriber:
+    def __init__(self, channel: str, queue_size: int, max_drops: int):
+        self.channel = channel
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        # snapshot frames replayed before anything from the queue, not bounded by queue_size
+        self.backlog = deque()
+        self.max_drops = max_drops
+        # frames dropped since the client last read one, and over its whole lifetime
+        self.drops = 0
+        self.total_drops = 0
+        # set when a frame was dropped, lets consumers of incremental frames resync
+        self.missed = False
+        self.closed = False
+
+    def offer(self, frame, key: str = None, deleted: bool = False) -> bool:
+        # returns False when the subscriber fell too far behind and was closed
+        # key and deleted are set for keyed channels, a plain subscriber only needs the frame
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # drop the oldest frame, the newest one is always the most useful
+            self.queue.get_nowait()
+            self.queue.put_nowait(frame)
+            self.drops += 1
+            self.total_drops += 1
+            self.missed = True
+            if self.drops >= self.max_drops:
+                self.close()
+                return False
+        return True
+
+    def take_missed(self) -> bool:
+        missed, self.missed = self.missed, False
+        return missed
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        # make room for the sentinel so a waiting reader wakes up
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(_CLOSED)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.backlog and not self.closed:
+            return self.backlog.popleft()
+        frame = await self.queue.get()
+        if frame is _CLOSED:
+            raise StopAsyncIteration
+        self.drops = 0
+        return frame
+
+
+class CoalescingSubscriber:
+    # subscriber of a keyed channel that keeps only the latest frame per key between reads
+    # memory is bounded by the number of keys, so nothing is ever dropped, deletions included
+    def __init__(self, channel: str, keys: Tuple[str, ...] = None):
+        self.channel = channel
+        # optional id prefixes, keys matching none of them are ignored
+        self.keys = keys
+        self.pending: Dict[str, str] = {}
+        self.deleted: Set[str] = set()
+        self.closed = False
+
+    def wants(self, key: str) -> bool:
+        return self.keys is None or key.startswith(self.keys)
+
+    def offer(self, frame, key: str = None, deleted: bool = False) -> bool:
+        if self.closed:
+            return False
+        if key is None or not self.wants(key):
+            return True
+        if deleted:
+            self.pending.pop(key, None)
+            self.deleted.add(key)
+        else:
+            self.pending[key] = frame
+            self.deleted.discard(key)
+        return True
+
+    def take(self) -> Tuple[List[str], List[str]]:
+        # returns and resets the latest frames and deleted keys gathered since the last call
+        frames, deleted = list(self.pending.values()), list(self.deleted)
+        self.pending = {}
+        self.deleted = set()
+        return frames, deleted
+
+    def close(self):
+        self.closed = True
+
+
+class StreamHub:
+    def __init__(
+        self,
+        queue_size: int = config.STREAM_CLIENT_QUEUE_SIZE,
+        max_drops: int = config.STREAM_CLIENT_MAX_DROPS,
+        keyed_channels: Dict[str, str] = None,
+    ):
+        self.redis: Redis = None
+        self.queue_size = queue_size
+        self.max_drops = max_drops
+        self._subscribers: Dict[str, Set[Subscriber]] = defaultdict(set)
+        self._readers: Dict[str, asyncio.Task] = {}
+        # channels passed to start, their subscription lives as long as the hub
+        self._started: Set[str] = set()
+        # channel -> pending stop of its subscription, cancelled when a client comes back
+        self._idle: Dict[str, asyncio.TimerHandle] = {}
+        # channels whose messages describe one object each, mapped to the field holding its id
+        # their cache keeps the latest message per id instead of only the latest message
+        self._keyed_channels = keyed_channels or {}
+        self._last: Dict[str, str] = {}
+        self._last_by_key: Dict[str, Dict[str, str]] = defaultdict(dict)
+        # bumped whenever the cached value of a channel changes, used for ETags
+        self._versions: Dict[str, int] = defaultdict(int)
+        self._epoch = int(time.time())
+        # callbacks run once per message, before the fan-out, for stages derived from a channel
+        self._listeners: Dict[str, List[Callable[[str], None]]] = defaultdict(list)
+        # channels fed only through publish_local, they never get a redis subscription
+        self._local_channels: Set[str] = set()
+        # channels whose catch-up frames are produced by a callback instead of the cache
+        self._snapshot_providers: Dict[str, Callable[[], List[str]]] = {}
+        self.logger = Logger(__name__)
+
+    def set_redis(self, redis: Redis):
+        self.redis = redis
+
+    def start(self, chans: Iterable[str]):
+        # subscribe ahead of any client so the cache is warm for the first one
+        for chan in chans:
+            self._started.add(chan)
+            self._ensure_reader(chan)
+
+    def subscribe(self, chan: str, replay: bool = True) -> Subscriber:
+        sub = Subscriber(chan, self.queue_size, self.max_drops)
+        if replay:
+            sub.backlog.extend(self.snapshot_frames(chan))
+        self._subscribers[chan].add(sub)
+        self._ensure_reader(chan)
+        return sub
+
+    def subscribe_coalesced(
+        self, chan: str, keys: Tuple[str, ...] = None
+    ) -> CoalescingSubscriber:
+        sub = CoalescingSubscriber(chan, keys)
+        for key, frame in self._last_by_key[chan].items():
+            sub.offer(frame, key)
+        self._subscribers[chan].add(sub)
+        self._ensure_reader(chan)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        sub.close()
+        self._subscribers.get(sub.channel, set()).discard(sub)
+        self._release_reader(sub.channel)
+
+    def client_count(self, chan: str) -> int:
+        return len(self._subscribers.get(chan, ()))
+
+    def client_counts(self) -> Dict[str, int]:
+        return {chan: len(subs) for chan, subs in self._subscribers.items()}
+
+    def add_listener(self, chan: str, listener: Callable[[str], None]):
+        self._listeners[chan].append(listener)
+
+    def remove_listener(self, chan: str, listener: Callable[[str], None]):
+        if listener in self._listeners.get(chan, ()):
+            self._listeners[chan].remove(listener)
+            self._release_reader(chan)
+
+    def add_local_channel(
+        self,
+        chan: str,
+        snapshot_provider: Callable[[], List[str]] = None,
+        key_field: str = None,
+    ):
+        # key_field makes the channel keyed, cached per object like container_metrics
+        self._local_channels.add(chan)
+        if snapshot_provider is not None:
+            self._snapshot_providers[chan] = snapshot_provider
+        if key_field is not None:
+            self._keyed_channels[chan] = key_field
+
+    def remove_local_channel(self, chan: str):
+        # for channels that live only as long as their clients, drops the cache with them
+        for sub in self._subscribers.pop(chan, ()):
+            sub.close()
+        self._local_channels.discard(chan)
+        self._snapshot_providers.pop(chan, None)
+        self._keyed_channels.pop(chan, None)
+        self._last.pop(chan, None)
+        self._last_by_key.pop(chan, None)
+        self._versions.pop(chan, None)
+        self._listeners.pop(chan, None)
+
+    def snapshot_frames(self, chan: str) -> List[str]:
+        # frames a new client needs to catch up with the current state of the channel
+        if chan in self._snapshot_providers:
+            return self._snapshot_providers[chan]()
+        if chan in self._keyed_channels:
+            return list(self._last_by_key[chan].values())
+        return [self._last[chan]] if chan in self._last else []
+
+    def snapshot(self, chan: str) -> Tuple[str, str]:
+        # returns the cached state of a channel as a json document and its etag
+        # keyed channels are returned as an array of the latest message per id
+        if chan in self._keyed_channels:
+            body = f"[{','.join(self._last_by_key[chan].values())}]"
+        else:
+            body = self._last.get(chan)
+        return body, f'"{chan}-{self._epoch}-{self._versions[chan]}"'
+
+    def _remember(self, chan: str, frame) -> Tuple[str, bool]:
+        # caches the frame, for keyed channels returns its key and whether it is a deletion
+        key_field = self._keyed_channels.get(chan)
+        if key_field is None:
+            if self._last.get(chan) != frame:
+                self._last[chan] = frame
+                self._versions[chan] += 1
+            return None, False
+        try:
+            message = json.loads(frame)
+            key = message[key_field]
+        except (ValueError, TypeError, KeyError):
+            return None, False
+        cache = self._last_by_key[chan]
+        if "Message" in message:
+            # deletion messages remove the object instead of being cached
+            if cache.pop(key, None) is not None:
+                self._versions[chan] += 1
+            return key, True
+        if cache.get(key) != frame:
+            cache[key] = frame
+            self._versions[chan] += 1
+        return key, False
+
+    def publish_local(self, chan: str, frame):
+        # hands a frame to every subscriber of the channel without going through redis
+        key, deleted = None, False
+        if isinstance(frame, str) and chan not in self._snapshot_providers:
+            key, deleted = self._remember(chan, frame)
+        for listener in self._listeners.get(chan, ()):
+            try:
+                listener(frame)
+            except Exception as e:
+                self.logger.error("Listener on %s failed: %s", chan, e)
+        lagging = [
+            sub
+            for sub in self._subscribers.get(chan, ())
+            if not sub.offer(frame, key, deleted)
+        ]
+        for sub in lagging:
+            self.logger.warning(
+                "Disconnecting slow client on %s after %d dropped frames",
+                chan,
+                sub.total_drops,
+            )
+            self._subscribers[chan].discard(sub)
+        if lagging:
+            self._release_reader(chan)
+
+    def _ensure_reader(self, chan: str):
+        if chan in self._local_channels:
+            return
+        idle = self._idle.pop(chan, None)
+        if idle is not None:
+            idle.cancel()
+        task = self._readers.get(chan)
+        if task is None or task.done():
+            self._readers[chan] = asyncio.create_task(self._read_channel(chan))
+
+    def _needed(self, chan: str) -> bool:
+        return (
+            chan in self._started
+            or bool(self._listeners.get(chan))
+            or bool(self._subscribers.get(chan))
+        )
+
+    def _release_reader(self, chan: str):
+        # stops the subscription of a channel nobody needs once it stayed that way a while
+        if chan not in self._readers or chan in self._idle or self._needed(chan):
+            return
+        loop = asyncio.get_running_loop()
+        self._idle[chan] = loop.call_later(
+            config.STREAM_READER_IDLE_TIMEOUT, self._stop_reader, chan
+        )
+
+    def _stop_reader(self, chan: str):
+        self._idle.pop(chan, None)
+        if self._needed(chan):
+            return
+        task = self._readers.pop(chan, None)
+        if task is not None:
+            task.cancel()
+        # not kept current any more, a later client must not be sent a stale frame
+        self._last.pop(chan, None)
+        self._last_by_key.pop(chan, None)
+
+    async def _read_channel(self, chan: str):
+        # the single redis subscription for a channel, reconnects until the hub is closed
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.redis.pubsub()
+                # will fail if you pass a channel that doesn't exist
+                await pubsub.subscribe(chan)
+                async for message in pubsub.listen():
+                    if message["type"] == "message" and message["data"] != 1:
+                        # decode once for every client
+                        with HUB_FANOUT.time(chan):
+                            self.publish_local(chan, message["data"].decode("utf-8"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error("Subscription to %s failed, retrying: %s", chan, e)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.close()
+                    except Exception:
+                        pass
+            await asyncio.sleep(config.STREAM_RECONNECT_DELAY)
+
+    async def close(self):
+        for idle in self._idle.values():
+            idle.cancel()
+        self._idle.clear()
+        for task in self._readers.values():
+            task.cancel()
+        await asyncio.gather(*self._readers.values(), return_exceptions=True)
+        self._readers.clear()
+        for subs in self._subscribers.values():
+            for sub in subs:
+                sub.close()
+        self._subscribers.clear()
@@ -0,0 +1,230 @@
+# stream_views derives projected and filtered variants of hub channels, for SSE clients that
+# show a few fields of some rows, e.g. /api/streams/containerlist?fields=Names,State&state=running
+# every distinct channel, fields and filters is one view on its own local hub channel, so the
+# projection runs once per published frame and view however many clients share it, and the
+# view with its cache is dropped when its last client leaves
+
+import json
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+from list_diff import ListDiffer, row_key
+from state_index import ContainerState
+from stream_hub import StreamHub
+
+
+def _dumps(value) -> str:
+    # compact, the keys and separators are most of a projected row
+    return json.dumps(value, separators=(",", ":"))
+
+
+def parse_fields(value: str) -> Optional[Tuple[str, ...]]:
+    # comma separated field names, None for every field
+    fields = {field.strip() for field in (value or "").split(",") if field.strip()}
+    return tuple(sorted(fields)) or None
+
+
+def project(item: dict, fields: Optional[Tuple[str, ...]], keep: Tuple[str, ...]):
+    # keep holds the fields rows are keyed by, they are sent whatever the client asked for
+    if fields is None:
+        return item
+    return {field: item[field] for field in keep + fields if field in item}
+
+
+def metrics_filters(
+    find_state: Callable[[str], Optional[ContainerState]]
+) -> Dict[str, Callable[[dict], str]]:
+    # stats messages carry neither state nor image, the state index of their host has both
+    def state(stats: dict) -> str:
+        container = find_state(stats.get("ID", ""))
+        return container.status if container is not None else ""
+
+    def image(stats: dict) -> str:
+        container = find_state(stats.get("ID", ""))
+        return container.image if container is not None else ""
+
+    return {"state": state, "image": image, "host": lambda s: s.get("Host", "")}
+
+
+class ViewSource:
+    def __init__(
+        self,
+        chan: str,
+        filters: Dict[str, Callable[[dict], str]],
+        key: str = "ID",
+        keyed: bool = False,
+    ):
+        self.chan = chan
+        self.filters = filters
+        # the field rows are keyed by, and the host that tells equal keys apart
+        self.keep = (key, "Host")
+        self.key = key
+        # keyed channels publish one object per message instead of the whole list
+        self.keyed = keyed
+
+
+class View:
+    def __init__(
+        self,
+        chan: str,
+        source: ViewSource,
+        fields: Optional[Tuple[str, ...]],
+        filters: Tuple[Tuple[str, str], ...],
+        delta: bool,
+    ):
+        self.chan = chan
+        self.source = source
+        self.fields = fields
+        self.filters = [(source.filters[name], value) for name, value in filters]
+        self.differ = ListDiffer(source.key) if delta else None
+        self.clients = 0
+        # the hub listener on the source channel, set by StreamViews
+        self.listener: Callable[[str], None] = None
+        self._frame: str = None
+        # keys of keyed rows sent on the view, a row that stops matching is deleted
+        self._sent = set()
+
+    def matches(self, item: dict) -> bool:
+        return all(extract(item) == value for extract, value in self.filters)
+
+    def keyframe(self) -> str:
+        return _dumps(self.differ.keyframe())
+
+    def snapshot(self) -> List[str]:
+        return [self.keyframe()] if self.differ.ready else []
+
+    def apply(self, frame: str) -> Optional[str]:
+        # the frame to publish on the view for a frame of its source, None if it has none
+        try:
+            message = json.loads(frame)
+        except ValueError:
+            return None
+        if self.source.keyed:
+            return self._apply_keyed(message)
+        # the publisher marshals an empty list as null
+        rows = [
+            project(item, self.fields, self.source.keep)
+            for item in message or []
+            if self.matches(item)
+        ]
+        if self.differ is not None:
+            delta = self.differ.update(rows)
+            return _dumps(delta) if delta is not None else None
+        frame = _dumps(rows)
+        # a change to rows the view filters out or fields it drops changes nothing here
+        if frame == self._frame:
+            return None
+        self._frame = frame
+        return frame
+
+    def _apply_keyed(self, message: dict) -> Optional[str]:
+        if self.source.key not in message:
+            return None
+        key = row_key(message, self.source.key)
+        if "Message" not in message and self.matches(message):
+            self._sent.add(key)
+            return _dumps(project(message, self.fields, self.source.keep))
+        # deletions, and rows that stopped matching, only for clients that have the row
+        if key not in self._sent:
+            return None
+        self._sent.discard(key)
+        deleted = project(message, (), self.source.keep)
+        deleted["Message"] = message.get("Message", "filtered")
+        return _dumps(deleted)
+
+
+class StreamViews:
+    def __init__(self, hub: StreamHub):
+        self.hub = hub
+        self.sources: Dict[str, ViewSource] = {}
+        self.views: Dict[str, View] = {}
+
+    def add_source(
+        self,
+        chan: str,
+        filters: Dict[str, Callable[[dict], str]] = None,
+        key: str = "ID",
+        keyed: bool = False,
+    ):
+        self.sources[chan] = ViewSource(chan, filters or {}, key, keyed)
+
+    def shape(
+        self, chan: str, fields: str = "", delta: bool = False, **filters: str
+    ) -> Optional[tuple]:
+        # what identifies a view, None when the client wants the channel as published
+        # raises ValueError for a filter the channel does not have
+        filters = {name: value for name, value in filters.items() if value}
+        for name in filters:
+            if name not in self.sources[chan].filters:
+                raise ValueError(f"Unknown filter: {name}")
+        fields = parse_fields(fields)
+        if fields is None and not filters:
+            return None
+        return chan, fields, tuple(sorted(filters.items())), delta
+
+    def acquire(self, shape: tuple) -> View:
+        chan, fields, filters, delta = shape
+        name = f"{chan}:view:{json.dumps([fields, filters, delta])}"
+        view = self.views.get(name)
+        if view is None:
+            view = self._create(name, self.sources[chan], fields, filters, delta)
+        view.clients += 1
+        return view
+
+    def _create(self, name: str, source: ViewSource, fields, filters, delta) -> View:
+        view = View(name, source, fields, filters, delta)
+
+        def on_message(frame: str):
+            result = view.apply(frame)
+            if result is not None:
+                self.hub.publish_local(name, result)
+
+        view.listener = on_message
+        self.hub.add_local_channel(
+            name,
+            snapshot_provider=view.snapshot if delta else None,
+            key_field=source.key if source.keyed else None,
+        )
+        # the hub caches what the view published, seeded from its source's cache
+        for frame in self.hub.snapshot_frames(source.chan):
+            on_message(frame)
+        self.hub.add_listener(source.chan, on_message)
+        self.hub.start([source.chan])
+        self.views[name] = view
+        return view
+
+    def release(self, view: View):
+        view.clients -= 1
+        if view.clients <= 0 and self.views.get(view.chan) is view:
+            del self.views[view.chan]
+            self.hub.remove_listener(view.source.chan, view.listener)
+            self.hub.remove_local_channel(view.chan)
+
+    def client_counts(self) -> Dict[str, int]:
+        # hub client counts with the clients of views counted on their source channel,
+        # view channel names hold client input and never become metric labels
+        counts = {
+            chan: count
+            for chan, count in self.hub.client_counts().items()
+            if chan not in self.views
+        }
+        for view in self.views.values():
+            chan = view.source.chan
+            counts[chan] = counts.get(chan, 0) + self.hub.client_count(view.chan)
+        return counts
+
+    def view_counts(self) -> Dict[str, int]:
+        counts = {chan: 0 for chan in self.sources}
+        for view in self.views.values():
+            counts[view.source.chan] += 1
+        return counts
+
+
+async def follow_view(
+    views: StreamViews, shape: tuple, stream: Callable[[View], AsyncIterator[str]]
+):
+    # runs a channel stream on the view's channel, holding the view while the client reads
+    view = views.acquire(shape)
+    try:
+        async for frame in stream(view):
+            yield frame
+    finally:
+        views.release(view)
@@ -0,0 +1,68 @@
+# a slow blocking call on the pool must not hold up the event loop
+
+import asyncio
+import time
+from blocking import BlockingExecutor, LoopLagMonitor
+from compose_index import ComposeFileIndex
+from compose_manager import ComposeManager
+from state_index import StateIndex
+from stream_hub import StreamHub
+
+# far above what a free loop lags, far below the 2s the blocking call takes
+MAX_LAG = 0.1
+
+
+class SlowCompose:
+    # stands in for python_on_whales' DockerClient, compose up blocks for 2s
+    def __init__(self):
+        self.compose = self
+
+    def up(self, detach=False):
+        time.sleep(2)
+
+    def down(self):
+        time.sleep(2)
+
+
+async def sampled(work) -> LoopLagMonitor:
+    monitor = LoopLagMonitor(interval=0.02)
+    await monitor.start()
+    try:
+        await work
+        # lets the sample that was due while work ran land before the monitor stops
+        await asyncio.sleep(monitor.interval * 3)
+    finally:
+        await monitor.close()
+    return monitor
+
+
+def test_blocking_run_keeps_loop_responsive():
+    async def main():
+        blocking = BlockingExecutor(workers=2)
+        try:
+            return await sampled(blocking.run(time.sleep, 2))
+        finally:
+            blocking.shutdown()
+
+    monitor = asyncio.run(main())
+    assert monitor.max_lag < MAX_LAG
+
+
+def test_compose_run_keeps_loop_responsive(tmp_path):
+    async def main():
+        blocking = BlockingExecutor(workers=2)
+        hub = StreamHub()
+        index = ComposeFileIndex(hub, blocking, directory=str(tmp_path))
+        manager = ComposeManager(index, StateIndex(), blocking, hub)
+        manager._clients["slow.yaml"] = SlowCompose()
+        try:
+            started = time.monotonic()
+            monitor = await sampled(manager.run("slow.yaml", "up"))
+            return monitor, time.monotonic() - started
+        finally:
+            blocking.shutdown()
+
+    monitor, seconds = asyncio.run(main())
+    # the call did run for its 2s, the loop kept waking the monitor meanwhile
+    assert seconds >= 2
+    assert monitor.max_lag < MAX_LAG
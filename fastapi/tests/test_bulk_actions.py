@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from bulk_actions import BulkActionExecutor, detached
+
+
+async def results(executor: BulkActionExecutor, items, fn, **kwargs):
+    return [result async for result in executor.run(items, fn, **kwargs)]
+
+
+def slow(seconds: float):
+    async def fn(item):
+        await asyncio.sleep(seconds)
+        return {"type": "success", "objectId": item}
+
+    return fn
+
+
+def test_calls_past_the_timeout_fail_alone():
+    async def fn(item):
+        await asyncio.sleep(1 if item == "slow" else 0)
+        return {"type": "success", "objectId": item}
+
+    executor = BulkActionExecutor(concurrency=2, timeout=0.05)
+    done = asyncio.run(results(executor, ["fast", "slow"], fn))
+    assert done[0] == {"type": "success", "objectId": "fast"}
+    assert done[1]["type"] == "error"
+    assert done[1]["statusCode"] == 504
+
+
+def test_timeout_none_waits_for_slow_calls():
+    # pulls run through the executor without a limit
+    executor = BulkActionExecutor(timeout=0.05)
+    done = asyncio.run(results(executor, ["image"], slow(0.2), timeout=None))
+    assert done == [{"type": "success", "objectId": "image"}]
+
+
+def test_run_timeout_replaces_the_executors():
+    executor = BulkActionExecutor(timeout=10)
+    done = asyncio.run(results(executor, ["image"], slow(0.2), timeout=0.05))
+    assert done[0]["statusCode"] == 504
+
+
+def test_detached_results_finish_after_the_reader_goes_away():
+    async def main():
+        finished = []
+
+        async def fn(item):
+            await asyncio.sleep(0.05 * item)
+            finished.append(item)
+            return {"type": "success", "objectId": item}
+
+        async def with_summary():
+            executor = BulkActionExecutor(concurrency=2)
+            async for result in executor.run([0, 1, 2, 3], fn, timeout=None):
+                yield result
+            finished.append("summary")
+
+        reader = detached(with_summary())
+        assert (await reader.__anext__())["objectId"] == 0
+        # the client disconnects
+        await reader.aclose()
+        await asyncio.sleep(0.3)
+        return finished
+
+    assert asyncio.run(main()) == [0, 1, 2, 3, "summary"]
+
+
+def test_detached_reader_gets_the_error_that_ended_results():
+    async def failing():
+        yield 1
+        raise RuntimeError("daemon gone")
+
+    async def main():
+        return [result async for result in detached(failing())]
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(main())
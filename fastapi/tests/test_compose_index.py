@@ -0,0 +1,55 @@
+import asyncio
+import compose_index
+from blocking import BlockingExecutor
+from compose_index import ComposeFileIndex
+from stream_hub import StreamHub
+
+COMPOSE = "services:\n  web:\n    image: nginx\n"
+
+
+async def until(condition, timeout: float = 5.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met")
+
+
+def test_watcher_picks_up_files_written_outside_the_api(tmp_path):
+    # runs the inotify watcher, watchfiles is a requirement
+    assert compose_index.watchfiles is not None
+
+    async def main():
+        # an hour between polls, only the watcher can see the new file in time
+        index = ComposeFileIndex(StreamHub(), BlockingExecutor(), str(tmp_path), 3600)
+        await index.start()
+        # the watch is set up on watchfiles' own thread
+        await asyncio.sleep(0.5)
+        (tmp_path / "web.yaml").write_text(COMPOSE)
+        await until(lambda: index.names() == ["web"])
+        assert index.get("web")["images"] == ["nginx"]
+        (tmp_path / "web.yaml").unlink()
+        await until(lambda: index.names() == [])
+        await index.close()
+
+    asyncio.run(main())
+
+
+def test_yml_projects_resolve_to_their_own_file(tmp_path):
+    async def main():
+        index = ComposeFileIndex(StreamHub(), BlockingExecutor(), str(tmp_path))
+        (tmp_path / "web.yml").write_text(COMPOSE)
+        (tmp_path / "db.yaml").write_text(COMPOSE)
+        (tmp_path / "db.yml").write_text(COMPOSE)
+        await index.rescan()
+        assert index.names() == ["db", "web"]
+        assert index.path("web") == str(tmp_path / "web.yml")
+        # both exist, compose up and delete act on the .yaml one
+        assert index.path("db") == str(tmp_path / "db.yaml")
+        # a project that is not indexed yet is uploaded as .yaml
+        assert index.path("new") == str(tmp_path / "new.yaml")
+        (tmp_path / "web.yml").unlink()
+        await index.rescan()
+        assert index.path("web") == str(tmp_path / "web.yaml")
+
+    asyncio.run(main())
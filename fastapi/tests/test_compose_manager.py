@@ -0,0 +1,103 @@
+import asyncio
+import threading
+from blocking import BlockingExecutor
+from compose_index import ComposeFileIndex
+from compose_manager import ComposeManager
+from scheduler import Scheduler
+from state_index import StateIndex
+from stream_hub import StreamHub
+
+
+class GatedCompose:
+    # stands in for python_on_whales' DockerClient, compose up blocks until released
+    def __init__(self):
+        self.compose = self
+        self.release = threading.Event()
+        self.calls = 0
+
+    def up(self, detach=False):
+        self.calls += 1
+        self.release.wait(5)
+
+    def down(self):
+        self.calls += 1
+        self.release.wait(5)
+
+
+def manager_with(tmp_path, blocking: BlockingExecutor, scheduler: Scheduler):
+    hub = StreamHub()
+    index = ComposeFileIndex(hub, blocking, directory=str(tmp_path))
+    return ComposeManager(index, StateIndex(), blocking, hub, scheduler)
+
+
+def test_runs_queued_on_a_busy_project_hold_no_slot(tmp_path):
+    async def main():
+        blocking = BlockingExecutor(workers=4)
+        scheduler = Scheduler(concurrency=4, background=2)
+        manager = manager_with(tmp_path, blocking, scheduler)
+        compose = manager._clients["busy.yaml"] = GatedCompose()
+        try:
+            runs = [
+                asyncio.create_task(manager.run("busy.yaml", action))
+                for action in ("up", "down", "up")
+            ]
+            await asyncio.sleep(0.1)
+            # one run holds the project lock and a slot, the other two wait on the lock
+            assert scheduler.running["background"] == 1
+            assert not scheduler.queues["background"]
+            # so a pull still finds a background slot
+            async with scheduler.slot("background"):
+                assert scheduler.running["background"] == 2
+            compose.release.set()
+            await asyncio.gather(*runs)
+            assert scheduler.running["background"] == 0
+        finally:
+            compose.release.set()
+            blocking.shutdown()
+
+    asyncio.run(asyncio.wait_for(main(), 10))
+
+
+def test_a_cancelled_run_keeps_the_project_until_compose_returns(tmp_path):
+    async def main():
+        blocking = BlockingExecutor(workers=4)
+        scheduler = Scheduler(concurrency=4, background=2)
+        manager = manager_with(tmp_path, blocking, scheduler)
+        compose = manager._clients["busy.yaml"] = GatedCompose()
+        try:
+            up = asyncio.create_task(manager.run("busy.yaml", "up"))
+            await asyncio.sleep(0.1)
+            up.cancel()
+            await asyncio.sleep(0.1)
+            assert not up.done()
+            # compose is still running on its thread
+            assert manager.busy("busy.yaml")
+            assert scheduler.running["background"] == 1
+            down = asyncio.create_task(manager.run("busy.yaml", "down"))
+            await asyncio.sleep(0.1)
+            assert compose.calls == 1
+            compose.release.set()
+            await asyncio.gather(up, return_exceptions=True)
+            assert up.cancelled()
+            await down
+            assert compose.calls == 2
+            assert not manager.busy("busy.yaml")
+            assert scheduler.running["background"] == 0
+        finally:
+            compose.release.set()
+            blocking.shutdown()
+
+    asyncio.run(asyncio.wait_for(main(), 10))
+
+
+def test_yml_projects_run_their_own_file(tmp_path):
+    async def main():
+        blocking = BlockingExecutor(workers=1)
+        manager = manager_with(tmp_path, blocking, Scheduler())
+        (tmp_path / "web.yml").write_text("services: {}\n")
+        await manager.index.rescan()
+        docker = manager.client("web")
+        assert docker.client_config.compose_files == [str(tmp_path / "web.yml")]
+        blocking.shutdown()
+
+    asyncio.run(main())
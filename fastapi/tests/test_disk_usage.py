@@ -0,0 +1,101 @@
+import asyncio
+from disk_usage import ANONYMOUS_LABEL, DiskUsage
+
+ANONYMOUS = {ANONYMOUS_LABEL: ""}
+
+
+def container(id, state, image, volume, network, size=0) -> dict:
+    return {
+        "Id": id,
+        "State": state,
+        "ImageID": image,
+        "SizeRw": size,
+        "Mounts": [{"Type": "volume", "Name": volume}],
+        "NetworkSettings": {"Networks": {network: {}}},
+    }
+
+
+DF = {
+    "Containers": [
+        container("web", "running", "img-web", "data", "app"),
+        container("old", "exited", "img-old", "cache", "legacy", size=100),
+    ],
+    "Images": [
+        {"Id": "img-web", "RepoTags": ["web:latest"], "Size": 1000, "SharedSize": 0},
+        {"Id": "img-old", "RepoTags": None, "Size": 500, "SharedSize": 100},
+        # the daemon sends -1 for sizes it did not compute
+        {
+            "Id": "img-none",
+            "RepoTags": ["<none>:<none>"],
+            "Size": 300,
+            "SharedSize": -1,
+        },
+    ],
+    "Volumes": [
+        {"Name": "data", "Labels": ANONYMOUS, "UsageData": {"Size": 10}},
+        {"Name": "cache", "Labels": ANONYMOUS, "UsageData": {"Size": 20}},
+        {"Name": "named", "Labels": None, "UsageData": {"Size": 40}},
+    ],
+}
+NETWORKS = [
+    {"Id": "n1", "Name": "app"},
+    {"Id": "n2", "Name": "legacy"},
+    {"Id": "n3", "Name": "spare"},
+]
+
+
+def loaded(api_version: str = "1.43") -> DiskUsage:
+    async def fetch():
+        return {"df": DF, "networks": NETWORKS, "apiVersion": api_version}
+
+    usage = DiskUsage(fetch)
+    asyncio.run(usage.refresh())
+    return usage
+
+
+def estimates(plan: dict) -> dict:
+    return {
+        object_type: (estimate["count"], estimate["reclaimable"])
+        for object_type, estimate in plan["objects"].items()
+    }
+
+
+def test_pruned_containers_free_what_only_they_used():
+    plan = loaded().plan(["containers", "images", "volumes", "networks"])
+    assert estimates(plan) == {
+        "containers": (1, 100),
+        # without the space shared with other images
+        "images": (2, 400 + 300),
+        "volumes": (1, 20),
+        "networks": (2, 0),
+    }
+    assert plan["reclaimable"] == 820
+    assert plan["refreshPending"] is False
+
+
+def test_objects_of_kept_containers_are_not_reclaimable():
+    plan = loaded().plan(["images", "volumes", "networks"])
+    assert estimates(plan) == {
+        "images": (1, 300),
+        "volumes": (0, 0),
+        "networks": (1, 0),
+    }
+
+
+def test_named_volumes_are_pruned_before_api_1_42():
+    assert estimates(loaded("1.41").plan(["volumes"])) == {"volumes": (1, 40)}
+    assert estimates(loaded("1.42").plan(["volumes"])) == {"volumes": (0, 0)}
+
+
+def test_events_patch_the_plan_before_the_next_refresh():
+    usage = loaded()
+    usage.on_event({"Type": "container", "Action": "die", "Actor": {"ID": "web"}})
+    usage.on_event({"Type": "container", "Action": "destroy", "Actor": {"ID": "old"}})
+    usage.on_event({"Type": "image", "Action": "delete", "Actor": {"ID": "img-none"}})
+    plan = usage.plan(["containers", "images", "volumes"])
+    assert estimates(plan) == {
+        "containers": (1, 0),
+        # tagged images stay, whether or not a container uses them
+        "images": (1, 400),
+        "volumes": (2, 30),
+    }
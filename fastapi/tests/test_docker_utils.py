@@ -0,0 +1,162 @@
+import asyncio
+import pytest
+from starlette.testclient import TestClient
+from bench.fake_docker import FakeDaemon, serve
+from docker_utils import (
+    DockerHost,
+    DockerManager,
+    InvalidConfig,
+    container_config,
+    docker_client,
+    split_image,
+)
+from main import app
+
+
+def test_split_image():
+    assert split_image("nginx") == ("nginx", None)
+    assert split_image("nginx:1.25") == ("nginx", "1.25")
+    # a colon before the last slash is a registry port, not a tag
+    assert split_image("localhost:5000/web") == ("localhost:5000/web", None)
+    assert split_image("localhost:5000/web:dev") == ("localhost:5000/web", "dev")
+    digest = "nginx@sha256:" + "a" * 64
+    assert split_image(digest) == (digest, None)
+
+
+def test_container_config_translates_the_run_form():
+    body = container_config(
+        {
+            "image": "web:1",
+            "ports": {"80/tcp": "8080", 443: ("127.0.0.1", 8443), "53/udp": [53, 5353]},
+            "volumes": {
+                "data": {"bind": "/data"},
+                "/etc/web": {"bind": "/etc/web", "mode": "ro"},
+            },
+            "environment": {"MODE": "prod"},
+        }
+    )
+    assert body["Image"] == "web:1"
+    assert body["Env"] == ["MODE=prod"]
+    assert set(body["ExposedPorts"]) == {"80/tcp", "443/tcp", "53/udp"}
+    assert body["HostConfig"]["PortBindings"] == {
+        "80/tcp": [{"HostPort": "8080"}],
+        "443/tcp": [{"HostIp": "127.0.0.1", "HostPort": "8443"}],
+        "53/udp": [{"HostPort": "53"}, {"HostPort": "5353"}],
+    }
+    assert body["HostConfig"]["Binds"] == ["data:/data:rw", "/etc/web:/etc/web:ro"]
+
+
+def test_container_config_takes_docker_py_list_forms():
+    body = container_config(
+        {
+            "image": "web",
+            # None publishes on a random host port
+            "ports": {"22": None},
+            "volumes": ["data:/data", "/src:/src:ro"],
+            "environment": ["MODE=prod"],
+        }
+    )
+    assert body["HostConfig"]["PortBindings"] == {"22/tcp": [{}]}
+    assert body["HostConfig"]["Binds"] == ["data:/data", "/src:/src:ro"]
+    assert body["Env"] == ["MODE=prod"]
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        {"ports": {"80/tcp": 80}},
+        {"image": "web", "ports": [80, 443]},
+        {"image": "web", "ports": {"80/tcp": ("127.0.0.1", 80, "x")}},
+        {"image": "web", "volumes": {"data": "/data"}},
+        {"image": "web", "volumes": "data:/data"},
+    ],
+)
+def test_container_config_rejects_what_it_cannot_translate(config):
+    with pytest.raises(InvalidConfig):
+        container_config(config)
+
+
+def test_run_container_pulls_a_missing_image_as_latest(tmp_path):
+    daemon = FakeDaemon(containers=0, images=0)
+    path = str(tmp_path / "docker.sock")
+    serve(daemon, path)
+
+    async def main():
+        host = DockerHost("local", f"unix://{path}")
+        host.async_client = docker_client(f"unix://{path}")
+        try:
+            return await host.run_container({"image": "nginx", "containerName": "web"})
+        finally:
+            await host.async_client.close()
+
+    result = asyncio.run(main())
+    assert result["type"] == "success"
+    # one tag, not every tag of the repository
+    assert daemon.pulls == [{"fromImage": "nginx", "tag": "latest"}]
+    container = daemon.containers[result["objectId"]]
+    assert container["Names"] == ["/web"] and container["State"] == "running"
+
+
+def test_run_refuses_an_invalid_config_before_running_anything():
+    # without the startup events, nothing could reach a daemon
+    response = TestClient(app).post(
+        "/api/containers/run", json={"config": {"image": "web", "ports": [80]}}
+    )
+    assert response.status_code == 400
+    message = "ports must map container ports to host ports"
+    assert response.json() == {"message": message}
+
+
+def test_containers_are_routed_to_the_host_that_has_them(tmp_path):
+    local = FakeDaemon(containers=2, images=1)
+    edge = FakeDaemon(containers=2, images=1)
+    edge_id = next(iter(edge.containers))
+    # a name on the default host that is an exact id on the other
+    local.add_container(edge_id, "", "exited", {})
+    urls = {}
+    for name, daemon in (("local", local), ("edge", edge)):
+        serve(daemon, str(tmp_path / f"{name}.sock"))
+        urls[name] = f"unix://{tmp_path / name}.sock"
+
+    async def main():
+        manager = DockerManager(urls)
+        await manager.start()
+        try:
+            while not all(h.state_index.ready for h in manager.hosts.values()):
+                await asyncio.sleep(0.01)
+            local_host, edge_host = manager.hosts["local"], manager.hosts["edge"]
+            # exact ids before names and prefixes, the default host has it as a name
+            assert local_host.state_index.get(edge_id) is not None
+            assert manager.host_of(edge_id) is edge_host
+            local_id = next(iter(local.containers))
+            assert manager.host_of(local_id[:12]) is local_host
+            # names repeat across hosts, the first host has it
+            assert manager.host_of("bench-0") is local_host
+            # unknown ids go to the default host, whose daemon answers 404
+            assert manager.host_of("missing") is local_host
+            with pytest.raises(KeyError):
+                manager.host("nope")
+
+            container = await manager.get_container(edge_id)
+            assert manager._owner(container) is edge_host
+            state = await manager.get_container_state(container)
+            assert state.id == edge_id
+            assert state.status == edge.containers[edge_id]["State"]
+            container = await manager.get_container("bench-0", host="edge")
+            assert manager._owner(container) is edge_host
+            # handles built on another client fall back to the default host
+            other = docker_client(urls["edge"])
+            assert manager._owner(other.containers.container(edge_id)) is local_host
+            await other.close()
+        finally:
+            await manager.close()
+
+    asyncio.run(asyncio.wait_for(main(), 10))
+
+
+def test_unknown_hosts_are_refused():
+    response = TestClient(app).post(
+        "/api/containers/stop", json={"ids": ["abc"], "host": "nope"}
+    )
+    assert response.status_code == 400
+    assert response.json() == {"message": "Unknown docker host: 'nope'"}
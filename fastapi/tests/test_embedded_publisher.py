@@ -0,0 +1,85 @@
+import asyncio
+import json
+from bench.fake_docker import FakeDaemon, serve
+from docker_utils import DockerManager
+from embedded_publisher import EmbeddedPublisher
+from stream_hub import StreamHub
+
+
+def daemons(tmp_path, **edge_options):
+    # two hosts with the same container names, like two nodes running the same stack
+    local = FakeDaemon(containers=3, images=1)
+    edge = FakeDaemon(containers=2, images=1, **edge_options)
+    urls = {}
+    for name, daemon in (("local", local), ("edge", edge)):
+        path = str(tmp_path / f"{name}.sock")
+        serve(daemon, path)
+        urls[name] = f"unix://{path}"
+    return local, edge, urls
+
+
+def rows(hub: StreamHub, chan: str):
+    body, _ = hub.snapshot(chan)
+    return json.loads(body) if body is not None else None
+
+
+async def until(condition, timeout: float = 5.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met")
+
+
+def test_lists_merge_every_hosts_rows_in_host_order(tmp_path):
+    local, edge, urls = daemons(tmp_path)
+
+    async def main():
+        manager = DockerManager(urls)
+        hub = StreamHub()
+        publisher = EmbeddedPublisher(manager, hub)
+        await manager.start()
+        try:
+            # edge answers first, its rows still come after the default host's
+            await publisher.tick(manager.hosts["edge"])
+            assert {row["Host"] for row in rows(hub, "containers_list")} == {"edge"}
+            await publisher.tick(manager.hosts["local"])
+            containers = rows(hub, "containers_list")
+            images = rows(hub, "images_list")
+        finally:
+            await publisher.close()
+            await manager.close()
+        return containers, images
+
+    containers, images = asyncio.run(main())
+    assert [row["Host"] for row in containers] == ["local"] * 3 + ["edge"] * 2
+    assert {row["ID"] for row in containers} == set(local.containers) | set(
+        edge.containers
+    )
+    # the same image on both hosts is one row per host
+    assert [row["Host"] for row in images] == ["local", "edge"]
+
+
+def test_a_slow_host_only_drops_its_own_rows(tmp_path):
+    local, edge, urls = daemons(tmp_path, latency=0.5)
+
+    async def main():
+        manager = DockerManager(urls)
+        hub = StreamHub()
+        publisher = EmbeddedPublisher(manager, hub, interval=0.05, timeout=0.2)
+        await manager.start()
+        await publisher.start()
+        try:
+            await until(lambda: "edge" in publisher.failing)
+            slow = rows(hub, "containers_list")
+            # the host answers in time again and its rows come back
+            edge.latency = 0
+            await until(lambda: "edge" not in publisher.failing)
+            await until(lambda: len(rows(hub, "containers_list")) == 5)
+        finally:
+            await publisher.close()
+            await manager.close()
+        return slow
+
+    slow = asyncio.run(main())
+    assert [row["Host"] for row in slow] == ["local"] * 3
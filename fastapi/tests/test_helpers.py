@@ -0,0 +1,60 @@
+import asyncio
+import zlib
+from sse_starlette import EventSourceResponse
+from helpers import STREAM_ENCODINGS, CompressedResponse
+
+
+async def events():
+    for i in range(3):
+        yield {"data": f'{{"ID": "{i}", "State": "running"}}'}
+
+
+async def call(response) -> list:
+    sent = []
+
+    async def receive():
+        # a client that stays connected
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    await response({"type": "http"}, receive, send)
+    return sent
+
+
+def test_is_a_response_with_the_wrapped_headers():
+    async def main():
+        # EventSourceResponse needs a running loop in older sse_starlette releases
+        wrapped = EventSourceResponse(events())
+        return wrapped, CompressedResponse(wrapped, "gzip")
+
+    wrapped, response = asyncio.run(main())
+    assert response.status_code == 200
+    assert response.media_type == "text/event-stream"
+    assert response.body == b""
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["cache-control"] == wrapped.headers["cache-control"]
+
+
+def test_sends_its_headers_and_a_decodable_body():
+    async def main():
+        response = CompressedResponse(EventSourceResponse(events()), "deflate")
+        response.headers["x-test"] = "1"
+        return await call(response)
+
+    sent = asyncio.run(main())
+    start = sent[0]
+    headers = dict((k.decode(), v.decode()) for k, v in start["headers"])
+    assert headers["content-encoding"] == "deflate" and headers["x-test"] == "1"
+    decompressor = zlib.decompressobj(STREAM_ENCODINGS["deflate"])
+    chunks = [
+        decompressor.decompress(m["body"])
+        for m in sent
+        if m["type"] == "http.response.body"
+    ]
+    body = b"".join(chunks).decode()
+    assert body.count("data: ") == 3 and '"ID": "2"' in body
+    # every event is flushed on its own, readable before the stream ends
+    assert '"ID": "0"' in chunks[0].decode()
@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from inspect_cache import InspectCache
+
+FULL_ID = "a" * 64
+
+
+def container_event(action: str, **attributes) -> dict:
+    return {
+        "Type": "container",
+        "Action": action,
+        "Actor": {"ID": FULL_ID, "Attributes": attributes},
+    }
+
+
+class Daemon:
+    # inspect answers once released, so events can arrive while a load is in flight
+    def __init__(self):
+        self.status = "running"
+        self.release = asyncio.Event()
+        self.calls = 0
+
+    async def inspect(self, id: str) -> dict:
+        self.calls += 1
+        status = self.status
+        await self.release.wait()
+        return {"Id": FULL_ID, "State": {"Status": status}}
+
+
+@pytest.mark.parametrize("requested", ["aaaaaaaaaaaa", "web", "/web"])
+def test_events_during_a_load_keep_its_result_out_of_the_cache(requested):
+    async def main():
+        daemon = Daemon()
+        cache = InspectCache(daemon.inspect, ttl=60)
+        load = asyncio.ensure_future(cache.get(requested))
+        await asyncio.sleep(0.01)
+        daemon.status = "exited"
+        cache.on_event(container_event("die", name="web"))
+        daemon.release.set()
+        assert (await load)["State"]["Status"] == "running"
+        # neither the id nor the name serve the pre-event result
+        assert (await cache.get(requested))["State"]["Status"] == "exited"
+        assert (await cache.get(FULL_ID))["State"]["Status"] == "exited"
+        return daemon.calls
+
+    assert asyncio.run(main()) == 2
+
+
+def test_renames_invalidate_loads_by_the_old_name():
+    async def main():
+        daemon = Daemon()
+        cache = InspectCache(daemon.inspect, ttl=60)
+        load = asyncio.ensure_future(cache.get("old"))
+        await asyncio.sleep(0.01)
+        cache.on_event(container_event("rename", name="new", oldName="/old"))
+        daemon.release.set()
+        await load
+        await cache.get("old")
+        return daemon.calls
+
+    assert asyncio.run(main()) == 2
+
+
+def test_events_for_other_containers_leave_loads_alone():
+    async def main():
+        daemon = Daemon()
+        cache = InspectCache(daemon.inspect, ttl=60)
+        load = asyncio.ensure_future(cache.get("web"))
+        await asyncio.sleep(0.01)
+        other = {"Type": "container", "Actor": {"ID": "b" * 64, "Attributes": {}}}
+        cache.on_event(dict(other, Action="start"))
+        daemon.release.set()
+        await load
+        await cache.get("web")
+        return daemon.calls, cache.hits
+
+    assert asyncio.run(main()) == (1, 1)
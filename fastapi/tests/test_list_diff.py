@@ -0,0 +1,91 @@
+import asyncio
+import json
+import list_diff
+from list_diff import ListDiffer, attach_delta_channel, delta_channel
+from stream_hub import StreamHub
+
+
+def rows(*states):
+    return [{"ID": f"c{i}", "State": state} for i, state in enumerate(states)]
+
+
+def test_first_list_is_a_keyframe_and_unchanged_lists_send_nothing():
+    differ = ListDiffer(keyframe_interval=60)
+    assert differ.update(rows("running", "exited")) == {
+        "type": "full",
+        "items": rows("running", "exited"),
+    }
+    assert differ.update(rows("running", "exited")) is None
+
+
+def test_changes_are_sent_as_deltas():
+    differ = ListDiffer(keyframe_interval=60)
+    differ.update(rows("running", "exited", "running"))
+    # c0 changed, c2 went away and c3 is new
+    items = rows("exited", "exited") + [{"ID": "c3", "State": "created"}]
+    assert differ.update(items) == {
+        "type": "delta",
+        "added": [{"ID": "c3", "State": "created"}],
+        "updated": [{"ID": "c0", "State": "exited"}],
+        "removed": ["c2"],
+    }
+    assert differ.keyframe() == {"type": "full", "items": items}
+
+
+def test_a_change_after_the_keyframe_interval_is_a_keyframe(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(list_diff.time, "monotonic", lambda: now[0])
+    differ = ListDiffer(keyframe_interval=30)
+    differ.update(rows("running"))
+    now[0] += 10
+    assert differ.update(rows("exited"))["type"] == "delta"
+    now[0] += 25
+    # nothing changed, past the interval is still no frame
+    assert differ.update(rows("exited")) is None
+    assert differ.update(rows("running")) == {"type": "full", "items": rows("running")}
+    now[0] += 1
+    assert differ.update(rows("exited"))["type"] == "delta"
+
+
+def test_rows_from_different_hosts_are_kept_apart():
+    differ = ListDiffer(keyframe_interval=60)
+    image = {"ID": "sha256:a", "Host": "local"}
+    differ.update([image])
+    delta = differ.update([image, {"ID": "sha256:a", "Host": "edge"}])
+    assert delta["added"] == [{"ID": "sha256:a", "Host": "edge"}]
+    assert differ.update([{"ID": "sha256:a", "Host": "edge"}])["removed"] == [
+        "local/sha256:a"
+    ]
+
+
+def test_delta_channel_follows_the_full_list():
+    async def main():
+        hub = StreamHub()
+        hub.add_local_channel("containers_list")
+        attach_delta_channel(hub, "containers_list", ListDiffer(keyframe_interval=60))
+        chan = delta_channel("containers_list")
+        assert hub.snapshot_frames(chan) == []
+        sub = hub.subscribe(chan)
+        # the publisher marshals an empty list as null
+        hub.publish_local("containers_list", "null")
+        hub.publish_local("containers_list", json.dumps(rows("running")))
+        hub.publish_local("containers_list", json.dumps(rows("running")))
+        frames = [
+            json.loads(sub.queue.get_nowait()) for _ in range(sub.queue.qsize())
+        ]
+        assert frames == [
+            {"type": "full", "items": []},
+            {
+                "type": "delta",
+                "added": rows("running"),
+                "updated": [],
+                "removed": [],
+            },
+        ]
+        # new clients start from a keyframe of the current list
+        assert json.loads(hub.snapshot_frames(chan)[0]) == {
+            "type": "full",
+            "items": rows("running"),
+        }
+
+    asyncio.run(main())
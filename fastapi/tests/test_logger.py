@@ -0,0 +1,45 @@
+import logging
+import queue
+from logger import DroppingQueueHandler
+
+
+class Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def logger_with(handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger("test_logger")
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+def test_records_after_stop_are_still_written():
+    output = Collect()
+    handler = DroppingQueueHandler(queue.Queue(100), output)
+    handler.start()
+    logger = logger_with(handler)
+    logger.info("before %s", "shutdown")
+    handler.stop()
+    assert output.messages == ["before shutdown"]
+    # e.g. the app starting again in the same process, its loggers keep the handler
+    logger.info("after %s", "shutdown")
+    handler.stop()
+    assert output.messages == ["before shutdown", "after shutdown"]
+
+
+def test_full_queue_drops_and_counts():
+    output = Collect()
+    handler = DroppingQueueHandler(queue.Queue(1), output)
+    # a writer that never catches up
+    handler.running = True
+    logger = logger_with(handler)
+    for i in range(3):
+        logger.info("record %d", i)
+    assert handler.dropped == 2
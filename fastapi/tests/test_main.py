@@ -0,0 +1,67 @@
+import aiohttp
+import pytest
+from aiodocker.exceptions import DockerError
+from starlette.testclient import TestClient
+import main
+
+REPORTS = {
+    "containers": {"ContainersDeleted": ["a", "b"], "SpaceReclaimed": 100},
+    "volumes": {"VolumesDeleted": ["data"], "SpaceReclaimed": 10},
+}
+
+
+@pytest.fixture
+def daemon(monkeypatch):
+    # images fails like an unreachable daemon, networks with a daemon error
+    pruned = []
+
+    async def prune(obj: str) -> dict:
+        pruned.append(obj)
+        if obj == "images":
+            raise aiohttp.ClientConnectionError("connection refused")
+        if obj == "networks":
+            raise DockerError(409, {"message": "a prune operation is already running"})
+        return REPORTS[obj]
+
+    async def publish(message: str, category: str):
+        pass
+
+    monkeypatch.setattr(main.docker_manager, "prune", prune)
+    monkeypatch.setattr(main.message_log, "publish", publish)
+    monkeypatch.setattr(main.disk_usage, "refresh_soon", lambda: None)
+    return pruned
+
+
+def test_prune_reports_unreachable_daemons_per_type(daemon):
+    objects = ["containers", "images", "volumes", "networks"]
+    response = TestClient(main.app).post(
+        "/api/system/prune", json={"objectsToPrune": objects}
+    )
+    assert response.status_code == 400
+    results = {res["objectType"]: res for res in response.json()["results"]}
+    assert sorted(daemon) == sorted(objects)
+    assert results["containers"]["deleted"] == 2
+    assert results["volumes"]["type"] == "success"
+    assert results["images"]["statusCode"] == 503
+    assert "connection refused" in results["images"]["message"]
+    assert results["networks"]["statusCode"] == 409
+
+
+def test_streamed_prune_ends_with_a_summary(daemon):
+    response = TestClient(main.app).post(
+        "/api/system/prune?stream=ndjson",
+        json={"objectsToPrune": ["containers", "images"]},
+    )
+    lines = [line for line in response.text.splitlines() if line]
+    assert len(lines) == 3
+    assert lines[-1] == '{"type": "summary", "succeeded": 1, "failed": 1}'
+
+
+def test_prune_plan_without_a_daemon(monkeypatch):
+    async def fetch():
+        raise aiohttp.ClientConnectionError("connection refused")
+
+    monkeypatch.setattr(main.disk_usage, "fetch", fetch)
+    response = TestClient(main.app).get("/api/system/prune/plan")
+    assert response.status_code == 503
+    assert "connection refused" in response.json()["message"]
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import pytest
+import message_log
+from bench.fake_redis import FakeRedis
+from message_log import MessageLog, parse_stream_id
+from stream_hub import StreamHub
+
+
+class Client:
+    async def is_disconnected(self) -> bool:
+        return False
+
+
+async def started_log(redis) -> MessageLog:
+    log = MessageLog(StreamHub(), key="messages", batch_window=0.01)
+    if redis:
+        log.set_redis(FakeRedis())
+    await log.start()
+    return log
+
+
+async def write(log: MessageLog, *texts: str):
+    # one entry per text, each waits for its batch window to close
+    for text in texts:
+        await log.publish(text, "info")
+        await asyncio.sleep(0.05)
+
+
+def texts(data: str):
+    return [message["text"] for message in json.loads(data)]
+
+
+def test_messages_within_the_batch_window_are_one_entry():
+    async def main():
+        log = await started_log(redis=False)
+        await log.publish("first", "info")
+        await log.publish("second", "error")
+        await asyncio.sleep(0.05)
+        [(_, data)] = await log.since("0-0")
+        assert texts(data) == ["first", "second"]
+        await log.close()
+
+    asyncio.run(main())
+
+
+def test_entry_ids_keep_increasing_within_one_millisecond(monkeypatch):
+    monkeypatch.setattr(message_log.time, "time", lambda: 1700000000.0)
+    log = MessageLog(StreamHub())
+    for text in ("a", "b", "c"):
+        log._append(json.dumps([{"text": text}]))
+    assert [id for id, _ in log._entries] == [
+        "1700000000000-0",
+        "1700000000000-1",
+        "1700000000000-2",
+    ]
+
+
+@pytest.mark.parametrize("redis", [False, True], ids=["memory", "redis"])
+def test_last_event_id_catches_up_without_duplicates(redis):
+    async def main():
+        log = await started_log(redis)
+        await write(log, "a", "b", "c")
+        ids = [id for id, _ in await log.since("0-0")]
+        assert len(ids) == 3
+        events = log.follow(Client(), last_id=ids[0])
+        caught_up = [await events.__anext__() for _ in range(2)]
+        assert [event["id"] for event in caught_up] == ids[1:]
+        assert texts(caught_up[0]["data"]) == ["b"]
+        # entries the client already has come through the hub again, e.g. from the
+        # reader, and are skipped
+        for id in ids:
+            log.hub.publish_local(log.chan, {"id": id, "data": "[]"})
+        await write(log, "d")
+        event = await asyncio.wait_for(events.__anext__(), 1)
+        assert parse_stream_id(event["id"]) > parse_stream_id(ids[2])
+        assert texts(event["data"]) == ["d"]
+        await events.aclose()
+        await log.close()
+
+    asyncio.run(main())
+
+
+def test_unknown_last_event_id_only_follows_new_entries():
+    async def main():
+        log = await started_log(redis=False)
+        await write(log, "old")
+        events = log.follow(Client(), last_id="not-an-id")
+        next_event = asyncio.ensure_future(events.__anext__())
+        await asyncio.sleep(0.01)
+        await write(log, "new")
+        event = await asyncio.wait_for(next_event, 1)
+        assert texts(event["data"]) == ["new"]
+        await events.aclose()
+        await log.close()
+
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+import json
+from metrics_history import ContainerHistory, MetricsHistory, _Tier
+
+NOW = 1_700_000_000
+
+
+def frame(id: str, cpu: float) -> str:
+    return json.dumps({"ID": id, "CpuPercent": cpu, "MemoryPercent": 1.0})
+
+
+def test_tier_reuses_slots_after_wrapping():
+    tier = _Tier(slots=4, resolution=1, keep_extremes=False)
+    for t in range(NOW, NOW + 6):
+        tier.add(t, [float(t - NOW), 0.0, 0.0])
+    # six seconds in four slots: the first two were overwritten in place
+    samples = sorted(tier.samples(0, NOW + 10))
+    assert [ts for ts, _, _ in samples] == [NOW + 2, NOW + 3, NOW + 4, NOW + 5]
+    assert [tier.avg[0][i] for _, _, i in samples] == [2.0, 3.0, 4.0, 5.0]
+    assert all(count == 1 for _, count, _ in samples)
+
+
+def test_tier_slot_keeps_min_max_and_mean():
+    tier = _Tier(slots=10, resolution=60, keep_extremes=True)
+    start = NOW - NOW % 60
+    for value in (4.0, 1.0, 7.0):
+        tier.add(start + 5, [value, 0.0, 0.0])
+    [(ts, count, i)] = list(tier.samples(0, NOW + 60))
+    assert (ts, count) == (start, 3)
+    assert (tier.min[0][i], tier.max[0][i], tier.avg[0][i]) == (1.0, 7.0, 4.0)
+
+
+def test_fine_tier_only_for_viewed_containers():
+    history = ContainerHistory()
+    history.add(NOW, [1.0, 0.0, 0.0])
+    assert history.fine is None
+    history.view(NOW)
+    history.add(NOW + 61, [2.0, 0.0, 0.0])
+    assert history.fine is not None
+    # dropped once nobody asked for longer than it remembers
+    history.add(NOW + history.fine.window() + 1, [3.0, 0.0, 0.0])
+    assert history.fine is None
+
+
+def test_recent_window_joins_coarse_and_fine_tiers():
+    history = ContainerHistory()
+    start = NOW - NOW % 60
+    for t in range(start, start + 60):
+        history.add(t, [1.0, 0.0, 0.0])
+    history.view(start + 59)
+    for t in range(start + 60, start + 120):
+        history.add(t, [3.0, 0.0, 0.0])
+    result = history.downsample(120, 120, start + 119)
+    assert result["resolution"] == 1
+    # the minute before the fine tier as one coarse slot, then about a point per second
+    cpu = [point["CpuPercent"]["avg"] for point in result["points"]]
+    assert cpu[0] == 1.0
+    assert set(cpu[1:]) == {3.0} and len(cpu) > 50
+
+
+def test_query_starts_the_fine_tier_and_deleted_frees_it():
+    metrics = MetricsHistory(max_containers=2)
+    metrics.record(frame("a" * 64, 5.0))
+    assert metrics.fine_count() == 0
+    assert metrics.query("aaaa", 3600, 10)["id"] == "a" * 64
+    assert metrics.fine_count() == 1
+    metrics.record(json.dumps({"ID": "a" * 64, "Message": "deleted"}))
+    assert len(metrics) == 0
+
+
+def test_least_recently_updated_is_evicted():
+    metrics = MetricsHistory(max_containers=2)
+    for id in ("a", "b", "a", "c"):
+        metrics.record(frame(id, 1.0))
+    assert metrics.find("b") is None
+    assert metrics.find("a") == "a" and metrics.find("c") == "c"
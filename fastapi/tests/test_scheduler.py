@@ -0,0 +1,129 @@
+import asyncio
+import pytest
+from main import overloaded
+from scheduler import Overloaded, Scheduler, client_of, parse_proxies
+
+PROXIES = parse_proxies("127.0.0.1, 10.0.0.0/8")
+
+
+def scope(peer: str, forwarded: str = None) -> dict:
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return {"type": "http", "client": (peer, 50000), "headers": headers}
+
+
+def test_forwarded_for_is_ignored_from_untrusted_peers():
+    assert client_of(scope("203.0.113.7", "198.51.100.1"), PROXIES) == "203.0.113.7"
+    assert client_of(scope("127.0.0.1", "198.51.100.1")) == "127.0.0.1"
+
+
+def test_client_behind_trusted_proxies():
+    assert client_of(scope("127.0.0.1", "198.51.100.1"), PROXIES) == "198.51.100.1"
+    # the hop the proxies saw, not what the client wrote into the header itself
+    chain = "1.1.1.1, 198.51.100.1, 10.0.0.5"
+    assert client_of(scope("127.0.0.1", chain), PROXIES) == "198.51.100.1"
+
+
+def test_trusted_proxy_without_header_is_the_client():
+    assert client_of(scope("127.0.0.1"), PROXIES) == "127.0.0.1"
+
+
+async def hold(scheduler: Scheduler, priority: str, client: str, order, done):
+    async with scheduler.slot(priority, client):
+        order.append(priority)
+        await done.wait()
+
+
+async def queue(scheduler: Scheduler, *calls):
+    # starts (priority, client) calls in order; order lists the priorities that got a
+    # slot, and the calls hold it until done is set
+    order, done = [], asyncio.Event()
+    tasks = []
+    for priority, client in calls:
+        call = hold(scheduler, priority, client, order, done)
+        tasks.append(asyncio.create_task(call))
+        await asyncio.sleep(0)
+    return tasks, order, done
+
+
+def test_waiting_calls_start_by_priority():
+    async def main():
+        scheduler = Scheduler(concurrency=1, per_client=10, max_queue=10)
+        tasks, order, done = await queue(
+            scheduler,
+            ("normal", "a"),
+            ("background", "a"),
+            ("normal", "b"),
+            ("interactive", "c"),
+        )
+        assert order == ["normal"]
+        done.set()
+        await asyncio.gather(*tasks)
+        assert order == ["normal", "interactive", "normal", "background"]
+
+    asyncio.run(main())
+
+
+def test_background_calls_leave_slots_for_interactive_ones():
+    async def main():
+        scheduler = Scheduler(concurrency=2, background=1, per_client=10)
+        tasks, order, done = await queue(
+            scheduler, ("background", "a"), ("background", "b"), ("interactive", "c")
+        )
+        assert order == ["background", "interactive"]
+        assert scheduler.stats()["queued"]["background"] == 1
+        done.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+
+
+def test_a_client_at_its_limit_waits_for_its_own_calls():
+    async def main():
+        scheduler = Scheduler(concurrency=3, per_client=1)
+        tasks, order, done = await queue(
+            scheduler, ("normal", "a"), ("interactive", "a"), ("background", "b")
+        )
+        # a's interactive call waits behind its own normal one, b goes ahead
+        assert order == ["normal", "background"]
+        assert scheduler.clients == {"a": 1, "b": 1}
+        done.set()
+        await asyncio.gather(*tasks)
+        assert scheduler.clients == {}
+
+    asyncio.run(main())
+
+
+def test_full_queues_are_refused_with_retry_after():
+    async def main():
+        scheduler = Scheduler(concurrency=1, per_client=10, max_queue=2)
+        tasks, order, done = await queue(
+            scheduler, ("normal", "a"), ("background", "a"), ("background", "b")
+        )
+        with pytest.raises(Overloaded) as refused:
+            scheduler.admit("background", "c")
+        # higher priorities do not wait behind the background queue
+        scheduler.admit("interactive", "c")
+        assert scheduler.rejected["background"] == 1
+        response = overloaded(refused.value)
+        assert response.status_code == 429
+        assert 1 <= int(response.headers["retry-after"]) <= 60
+        assert response.headers["retry-after"] == str(refused.value.retry_after)
+        done.set()
+        await asyncio.gather(*tasks)
+        scheduler.admit("background", "c")
+
+    asyncio.run(main())
+
+
+def test_a_call_cancelled_while_waiting_leaves_the_queue():
+    async def main():
+        scheduler = Scheduler(concurrency=1)
+        tasks, order, done = await queue(scheduler, ("normal", "a"), ("normal", "b"))
+        tasks[1].cancel()
+        await asyncio.gather(tasks[1], return_exceptions=True)
+        assert scheduler.stats()["queued"]["normal"] == 0
+        done.set()
+        await tasks[0]
+        assert scheduler.running["normal"] == 0
+
+    asyncio.run(main())
@@ -0,0 +1,42 @@
+import asyncio
+import pytest
+from bench.fake_docker import FakeDaemon, serve
+from docker_utils import docker_client
+from state_index import StateIndex, parse_system_time
+
+
+def test_parse_system_time():
+    nanos = 1709633472123456789
+    assert parse_system_time("2024-03-05T10:11:12.123456789Z") == nanos
+    assert parse_system_time("2024-03-05T11:11:12.123456789+01:00") == nanos
+    assert parse_system_time("2024-03-05T10:11:12.5Z") == 1709633472500000000
+    with pytest.raises(ValueError):
+        parse_system_time("yesterday")
+
+
+@pytest.mark.parametrize("offset", [-300, 300])
+def test_events_apply_whatever_the_daemons_clock(tmp_path, offset):
+    # a remote daemon's clock minutes off from the panel's
+    daemon = FakeDaemon(containers=4, images=1, clock_offset=offset)
+    path = str(tmp_path / "docker.sock")
+    serve(daemon, path)
+
+    async def main():
+        client = docker_client(f"unix://{path}")
+        index = StateIndex(client)
+        await index.start()
+        try:
+            while not index.ready:
+                await asyncio.sleep(0.01)
+            id = next(i for i, s in index.containers.items() if s.status == "running")
+            await client.containers.container(id).stop()
+            for _ in range(200):
+                if index.containers[id].status == "exited":
+                    break
+                await asyncio.sleep(0.01)
+            return index.containers[id].status
+        finally:
+            await index.close()
+            await client.close()
+
+    assert asyncio.run(asyncio.wait_for(main(), 10)) == "exited"
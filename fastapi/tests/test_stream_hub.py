@@ -0,0 +1,72 @@
+import asyncio
+from bench.fake_redis import FakeRedis
+from stream_hub import StreamHub
+import config
+
+
+async def hub_with_redis() -> StreamHub:
+    hub = StreamHub()
+    hub.set_redis(FakeRedis())
+    return hub
+
+
+async def until(condition, timeout: float = 1.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met")
+
+
+def test_reader_stops_after_the_last_client_leaves(monkeypatch):
+    monkeypatch.setattr(config, "STREAM_READER_IDLE_TIMEOUT", 0.05)
+
+    async def main():
+        hub = await hub_with_redis()
+        sub = hub.subscribe("logs")
+        await until(lambda: hub.redis.subscribers["logs"])
+        await hub.redis.publish("logs", "frame")
+        assert await sub.__anext__() == "frame"
+        hub.unsubscribe(sub)
+        await asyncio.sleep(0.1)
+        # the redis subscription is closed and its now stale cache dropped
+        await until(lambda: not hub.redis.subscribers["logs"])
+        assert "logs" not in hub._readers
+        assert hub.snapshot_frames("logs") == []
+        await hub.close()
+
+    asyncio.run(main())
+
+
+def test_client_coming_back_keeps_the_reader(monkeypatch):
+    monkeypatch.setattr(config, "STREAM_READER_IDLE_TIMEOUT", 0.1)
+
+    async def main():
+        hub = await hub_with_redis()
+        hub.unsubscribe(hub.subscribe("logs"))
+        reader = hub._readers["logs"]
+        await asyncio.sleep(0.05)
+        sub = hub.subscribe("logs")
+        await asyncio.sleep(0.1)
+        assert hub._readers["logs"] is reader and not reader.done()
+        hub.unsubscribe(sub)
+        await hub.close()
+
+    asyncio.run(main())
+
+
+def test_started_and_listened_channels_keep_their_reader(monkeypatch):
+    monkeypatch.setattr(config, "STREAM_READER_IDLE_TIMEOUT", 0.01)
+
+    async def main():
+        hub = await hub_with_redis()
+        hub.start(["containers_list"])
+        hub.add_listener("container_metrics", lambda frame: None)
+        for chan in ("containers_list", "container_metrics"):
+            hub.unsubscribe(hub.subscribe(chan))
+        await asyncio.sleep(0.05)
+        assert not hub._readers["containers_list"].done()
+        assert not hub._readers["container_metrics"].done()
+        await hub.close()
+
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+import json
+import pytest
+from stream_hub import StreamHub
+from stream_views import StreamViews, View, ViewSource
+
+STATE = {"state": lambda row: row.get("State", "")}
+
+
+def keyed_view(fields=("CpuPercent",)) -> View:
+    source = ViewSource("container_metrics", STATE, keyed=True)
+    return View("metrics:view", source, fields, (("state", "running"),), delta=False)
+
+
+def stats(id: str, state: str, cpu: float = 1.0) -> str:
+    return json.dumps({"ID": id, "Host": "local", "State": state, "CpuPercent": cpu})
+
+
+def test_keyed_rows_that_stop_matching_are_deleted_once():
+    view = keyed_view()
+    assert json.loads(view.apply(stats("a", "running"))) == {
+        "ID": "a",
+        "Host": "local",
+        "CpuPercent": 1.0,
+    }
+    # clients have the row, so it goes as a deletion the frontend already handles
+    assert json.loads(view.apply(stats("a", "exited"))) == {
+        "ID": "a",
+        "Host": "local",
+        "Message": "filtered",
+    }
+    assert view.apply(stats("a", "exited")) is None
+    # never sent, nothing to delete
+    assert view.apply(stats("b", "exited")) is None
+
+
+def test_keyed_deletions_from_the_source_keep_their_message():
+    view = keyed_view()
+    view.apply(stats("a", "running"))
+    removed = json.dumps({"ID": "a", "Host": "local", "Message": "removed"})
+    assert json.loads(view.apply(removed)) == {
+        "ID": "a",
+        "Host": "local",
+        "Message": "removed",
+    }
+    assert view.apply(removed) is None
+
+
+def test_lists_are_filtered_and_projected():
+    source = ViewSource("containers_list", STATE)
+    view = View("list:view", source, ("State",), (("state", "running"),), False)
+    rows = [
+        {"ID": "a", "Names": ["/a"], "State": "running"},
+        {"ID": "b", "Names": ["/b"], "State": "exited"},
+    ]
+    assert json.loads(view.apply(json.dumps(rows))) == [{"ID": "a", "State": "running"}]
+    # b changing does not change the view
+    rows[1]["Names"] = ["/renamed"]
+    assert view.apply(json.dumps(rows)) is None
+    rows[0]["State"] = "exited"
+    assert view.apply(json.dumps(rows)) == "[]"
+    assert view.apply("null") is None
+
+
+def test_delta_views_remove_rows_that_stop_matching():
+    source = ViewSource("containers_list", STATE)
+    view = View("list:view", source, ("State",), (("state", "running"),), True)
+    rows = [{"ID": "a", "State": "running"}, {"ID": "b", "State": "running"}]
+    assert json.loads(view.apply(json.dumps(rows)))["type"] == "full"
+    rows[0]["State"] = "exited"
+    delta = json.loads(view.apply(json.dumps(rows)))
+    assert delta == {"type": "delta", "added": [], "updated": [], "removed": ["a"]}
+
+
+def test_views_are_shared_and_dropped_with_their_last_client():
+    hub = StreamHub()
+    hub.add_local_channel("containers_list")
+    views = StreamViews(hub)
+    views.add_source("containers_list", STATE)
+    with pytest.raises(ValueError):
+        views.shape("containers_list", image="nginx")
+    assert views.shape("containers_list") is None
+    shape = views.shape("containers_list", fields="State,Names", state="running")
+    first = views.acquire(shape)
+    # the same fields in another order are the same view
+    second = views.acquire(
+        views.shape("containers_list", fields="Names,State", state="running")
+    )
+    assert second is first
+    assert views.view_counts() == {"containers_list": 1}
+    hub.publish_local("containers_list", json.dumps([{"ID": "a", "State": "running"}]))
+    assert hub.snapshot_frames(first.chan) == ['[{"ID":"a","State":"running"}]']
+    views.release(first)
+    views.release(second)
+    assert views.view_counts() == {"containers_list": 0}
+    assert hub.snapshot_frames(first.chan) == []